@@ -0,0 +1,209 @@
+"""
+mail.py 的性能测试: 用本地测试服务器 (fake_imap.py) 和生成的测试邮箱 (mailgen.py) 完整运行一次下载
+
+    python3 bench/bench_mail.py --messages 2000 --mode structure --connections 4 --batch-size 200
+
+输出: 每秒处理邮件数、从服务器获取的字节数、峰值内存 (RSS) 以及各阶段耗时
+(fetch 网络请求 / decode 解析解码 / classify 分类重命名 / dedup 去重 / write 写盘，见 metrics.py)。
+测试服务器在单独的进程中运行，峰值内存只包含 mail.py 本身。
+"""
+import os
+import sys
+import json
+import hashlib
+import time
+import shutil
+import argparse
+import tempfile
+import contextlib
+import multiprocessing
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import mail
+import metrics
+import mailgen
+import fake_imap
+from config import load_config
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+# mail.py 中的阶段 (metrics.py 中的 mail.* 计时器)
+STAGES = ('fetch', 'decode', 'classify', 'dedup', 'write')
+
+def _serve(mbox_path, conn, idle, latency):
+    """测试服务器进程: 发送端口，收到任意消息后返回统计并退出"""
+    box = fake_imap.Mailbox.load(mbox_path)
+    server = fake_imap.FakeIMAPServer(box, idle=idle, latency=latency)
+    _, port = server.start()
+    conn.send((port, len(box.messages)))
+    conn.recv()
+    conn.send(server.stats())
+    server.shutdown()
+
+def _generate(output, kwargs):
+    mailgen.generate(output, **kwargs)
+
+def prepare_fixture(args):
+    """生成 (或复用已生成的) 测试邮箱，返回 mbox 路径"""
+    if args.fixture:
+        return args.fixture
+    output = os.path.join(BENCH_DIR, "fixtures", f"m{args.messages}-s{args.seed}-l{args.large_fraction}")
+    mbox_path = os.path.join(output, "mailbox.mbox")
+    if not os.path.exists(mbox_path):
+        print(f"正在生成测试邮箱 {output} ...")
+        # 在子进程中生成，避免影响本进程的峰值内存
+        p = multiprocessing.Process(target=_generate, args=(output, {
+            'messages': args.messages, 'seed': args.seed, 'large_fraction': args.large_fraction}))
+        p.start()
+        p.join()
+    return mbox_path
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 / 1024 if sys.platform == 'darwin' else rss / 1024
+
+def snapshot_tree(root):
+    """目录中所有非隐藏文件的 {相对路径: 内容哈希}"""
+    result = {}
+    for folder, _, files in os.walk(root):
+        for name in files:
+            if not name.startswith('.'):
+                path = os.path.join(folder, name)
+                with open(path, 'rb') as f:
+                    result[os.path.relpath(path, root)] = hashlib.sha256(f.read()).hexdigest()
+    return result
+
+def run(args):
+    mbox_path = prepare_fixture(args)
+
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=_serve, args=(mbox_path, child, True, args.latency / 1000),
+                                     daemon=True)
+    server.start()
+    port, total = parent.recv()
+
+    work = tempfile.mkdtemp(prefix="bench-mail-")
+    cwd = os.getcwd()
+    os.chdir(work)
+    try:
+        mail.configure(load_config(overrides={
+            'imap_host': "127.0.0.1", 'imap_port': port, 'imap_ssl': False,
+            'email_account': "bench", 'email_password': "bench",
+            'start_date': None, 'end_date': None, 'download_dir': "downloads",
+            'fetch_mode': args.mode, 'max_connections': args.connections, 'fetch_batch_size': args.batch_size,
+            'raw_cache_dir': ".mail_cache" if args.raw_cache or args.reprocess else "",
+        }))
+        metrics.enable(summary=False)
+        metrics.reset()
+
+        output = sys.stdout if args.verbose else open(os.devnull, 'w')
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            result = mail.main()
+        wall = time.perf_counter() - start
+        stats = metrics.summary()
+
+        saved = sum(len([f for f in files if not f.startswith('.')]) for _, _, files in os.walk("downloads"))
+
+        reprocess = None
+        if args.reprocess:
+            # 用刚才同步时缓存的原始邮件离线重建 downloads，并检查结果是否与同步时相同
+            before = snapshot_tree("downloads")
+            metrics.reset()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(output):
+                mail.reprocess()
+            reprocess = {
+                'wall_seconds': round(time.perf_counter() - start, 3),
+                'identical': snapshot_tree("downloads") == before,
+                'stages': {stage: metrics.summary()['stages'].get('mail.' + stage, {'seconds': 0.0, 'calls': 0})
+                           for stage in STAGES},
+            }
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(work, ignore_errors=True)
+
+    parent.send('stats')
+    server_stats = parent.recv()
+    server.join(5)
+
+    report = {
+        'mode': args.mode,
+        'connections': args.connections,
+        'batch_size': args.batch_size,
+        'latency_ms': args.latency,
+        'messages': result['messages'] if result else 0,
+        'failures': result['failures'] if result else None,
+        'files_saved': saved,
+        'wall_seconds': round(wall, 3),
+        'messages_per_second': round((result['messages'] if result else 0) / wall, 1) if wall else None,
+        'bytes_fetched': server_stats['bytes_sent'],
+        'body_bytes_fetched': server_stats['body_bytes'],
+        'imap_commands': server_stats['commands'],
+        'peak_rss_mb': round(peak_rss_mb(), 1) if resource else None,
+        'stages': {stage: stats['stages'].get('mail.' + stage, {'seconds': 0.0, 'calls': 0})
+                   for stage in STAGES},
+        'counters': stats['counters'],
+    }
+    if reprocess:
+        report['reprocess'] = reprocess
+    if args.keep:
+        report['workdir'] = work
+    return report
+
+def print_report(report):
+    print("=" * 50)
+    print(f"模式: {report['mode']}  并发连接: {report['connections']}  批量: {report['batch_size']}  模拟延迟: {report['latency_ms']} 毫秒")
+    print(f"邮件数: {report['messages']}  失败: {report['failures']}  保存文件: {report['files_saved']}")
+    print(f"总耗时: {report['wall_seconds']:.2f} 秒  ({report['messages_per_second']} 封/秒)")
+    print(f"获取字节数: {report['bytes_fetched'] / 1024 / 1024:.1f} MB "
+          f"(其中邮件内容 {report['body_bytes_fetched'] / 1024 / 1024:.1f} MB)  IMAP 命令: {report['imap_commands']}")
+    if report['peak_rss_mb'] is not None:
+        print(f"峰值内存: {report['peak_rss_mb']:.1f} MB")
+    print("-" * 50)
+    print(f"{'阶段':<10}{'耗时(秒, 各线程累加)':>22}{'调用次数':>12}")
+    for stage, item in report['stages'].items():
+        print(f"{stage:<10}{item['seconds']:>22.3f}{item['calls']:>12}")
+    if report['counters']:
+        print("-" * 50)
+        print("  ".join(f"{name}={value}" for name, value in report['counters'].items()))
+    if 'reprocess' in report:
+        item = report['reprocess']
+        print("-" * 50)
+        print(f"离线重新处理: {item['wall_seconds']:.2f} 秒  结果与同步时{'相同' if item['identical'] else '不同'}")
+    print("=" * 50)
+
+def main():
+    parser = argparse.ArgumentParser(description="mail.py 性能测试")
+    parser.add_argument('--messages', type=int, default=2000, help="生成的邮件数")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--large-fraction', type=float, default=0.005, help="带大 PDF 附件的邮件比例")
+    parser.add_argument('--fixture', help="使用已有的 mbox 文件，不生成")
+    parser.add_argument('--mode', choices=['structure', 'full'], default='structure', help="mail.py 的 fetch_mode")
+    parser.add_argument('--connections', type=int, default=4, help="mail.py 的 max_connections")
+    parser.add_argument('--batch-size', type=int, default=200, help="mail.py 的 fetch_batch_size (1 表示逐封获取)")
+    parser.add_argument('--latency', type=float, default=0, help="测试服务器每条命令的模拟往返延迟，毫秒")
+    parser.add_argument('--raw-cache', action='store_true', help="开启原始邮件缓存 (mail.py 的 raw_cache_dir)")
+    parser.add_argument('--reprocess', action='store_true', help="同步后再用原始邮件缓存离线重建一次 (隐含 --raw-cache)")
+    parser.add_argument('--json', help="同时把结果保存为 JSON 文件")
+    parser.add_argument('--keep', action='store_true', help="保留下载结果所在的临时目录")
+    parser.add_argument('--verbose', action='store_true', help="显示 mail.py 的输出")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
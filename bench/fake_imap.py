@@ -0,0 +1,399 @@
+"""
+本地 IMAP 测试服务器: 把一个 mbox 或 Maildir 文件夹当作邮箱提供给 mail.py (明文连接，不校验密码)
+
+支持 mail.py 用到的命令: LOGIN / SELECT (含 UIDVALIDITY) / SEARCH 和 UID SEARCH (ALL, SINCE, BEFORE, UID 范围) /
+FETCH 和 UID FETCH (RFC822, ENVELOPE, BODYSTRUCTURE, BODY.PEEK[段]<起点.长度>) / IDLE / NOOP / LOGOUT
+
+单独运行:
+    python3 bench/fake_imap.py fixture.mbox --port 1143
+然后在 config.json 中设置 "imap_host": "127.0.0.1", "imap_port": 1143, "imap_ssl": false
+"""
+import os
+import re
+import sys
+import email
+import email.utils
+import select
+import socket
+import mailbox
+import argparse
+import datetime
+import time
+import threading
+import socketserver
+from collections import OrderedDict
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+def _quote(value):
+    """IMAP 字符串: 含非 ASCII 或换行时使用字面量 {n}"""
+    if value is None:
+        return b"NIL"
+    if isinstance(value, str):
+        value = value.encode("utf-8", "surrogateescape")
+    if any(c > 127 for c in value) or b"\r" in value or b"\n" in value:
+        return b"{%d}\r\n" % len(value) + value
+    return b'"' + value.replace(b"\\", b"\\\\").replace(b'"', b'\\"') + b'"'
+
+def _param_list(params):
+    if not params:
+        return b"NIL"
+    return b"(" + b" ".join(_quote(k) + b" " + _quote(v) for k, v in params) + b")"
+
+def _part_body(part):
+    """非 multipart 段的原始正文 (传输编码后的)"""
+    raw = part.as_bytes()
+    idx = raw.find(b"\n\n")
+    return raw[idx + 2:] if idx >= 0 else b""
+
+def _envelope(msg):
+    def addresses(header):
+        value = msg.get(header)
+        if not value:
+            return b"NIL"
+        out = []
+        for name, addr in email.utils.getaddresses([value]):
+            mbox, _, host = addr.partition("@")
+            out.append(b"(" + _quote(name or None) + b" NIL " + _quote(mbox) + b" " + _quote(host) + b")")
+        return b"(" + b"".join(out) + b")"
+
+    subject = msg.get("Subject")
+    fields = [_quote(msg.get("Date")), _quote(str(subject) if subject is not None else None),
+              addresses("From"), addresses("From"), addresses("From"),
+              addresses("To"), addresses("Cc"), b"NIL", b"NIL", _quote(msg.get("Message-ID"))]
+    return b"(" + b" ".join(fields) + b")"
+
+def _disposition(part):
+    value = part.get("Content-Disposition")
+    if value is None:
+        return b"NIL"
+    params = part.get_params(header="content-disposition", unquote=False) or []
+    kind = params[0][0] if params else value.split(";")[0]
+    rest = []
+    for k, v in params[1:]:
+        if isinstance(v, tuple):
+            # RFC2231 参数原样转发 (filename*=utf-8''...)
+            v = email.utils.collapse_rfc2231_value(v).strip('"')
+            rest.append((k + "*", email.utils.encode_rfc2231(v, "utf-8")))
+        else:
+            rest.append((k, v.strip('"')))
+    return b"(" + _quote(kind) + b" " + _param_list(rest) + b")"
+
+def _bodystructure(part):
+    maintype = part.get_content_maintype()
+    subtype = part.get_content_subtype()
+    if maintype == "multipart":
+        children = b"".join(_bodystructure(p) for p in part.get_payload())
+        return b"(" + children + b" " + _quote(subtype) + b" NIL " + _disposition(part) + b" NIL NIL)"
+
+    params = [(k, v.strip('"')) for k, v in (part.get_params(unquote=False) or [])[1:]]
+    encoding = part.get("Content-Transfer-Encoding", "7bit")
+    fields = [_quote(maintype), _quote(subtype), _param_list(params), _quote(part.get("Content-ID")),
+              _quote(part.get("Content-Description")), _quote(encoding)]
+    if maintype == "message" and subtype == "rfc822":
+        inner = part.get_payload()[0]
+        body = inner.as_bytes()
+        fields += [str(len(body)).encode(), _envelope(inner), _bodystructure(inner), str(body.count(b"\n")).encode()]
+    else:
+        body = _part_body(part)
+        fields.append(str(len(body)).encode())
+        if maintype == "text":
+            fields.append(str(body.count(b"\n")).encode())
+    fields += [b"NIL", _disposition(part), b"NIL", b"NIL"]
+    return b"(" + b" ".join(fields) + b")"
+
+def _section(msg, section):
+    """BODY[1.2] 这样的段对应的原始数据"""
+    node = msg
+    for idx in section.split("."):
+        if node.get_content_type() == "message/rfc822":
+            node = node.get_payload()[0]
+        if node.is_multipart():
+            node = node.get_payload()[int(idx) - 1]
+        elif idx != "1":
+            return b""
+    if node.get_content_type() == "message/rfc822":
+        return node.get_payload()[0].as_bytes()
+    return _part_body(node)
+
+def _message_date(raw):
+    """邮件的日期 (用作 INTERNALDATE，SINCE/BEFORE 搜索按它比较)"""
+    header = email.message_from_bytes(raw.split(b"\n\n", 1)[0] + b"\n\n").get("Date")
+    try:
+        return email.utils.parsedate_to_datetime(header).date()
+    except (TypeError, ValueError):
+        return datetime.date.today()
+
+class Mailbox:
+    """
+    内存中的邮箱: [(UID, 日期, 原始邮件)]
+
+    解析后的邮件和段数据按 UID 缓存，分段下载大附件时不会反复解析。
+    """
+
+    def __init__(self, messages=(), uidvalidity=1):
+        self.uidvalidity = uidvalidity
+        self.messages = []
+        self.next_uid = 1
+        self.cond = threading.Condition()
+        self._parsed = OrderedDict()
+        self._sections = OrderedDict()
+        for raw, date in messages:
+            self.append(raw, date)
+
+    @classmethod
+    def load(cls, path, uidvalidity=1):
+        """从 mbox 文件或 Maildir 文件夹加载"""
+        box = mailbox.Maildir(path, create=False) if os.path.isdir(path) else mailbox.mbox(path, create=False)
+        try:
+            raws = [bytes(box.get_bytes(key)) for key in box.keys()]
+        finally:
+            box.close()
+        return cls(((raw, _message_date(raw)) for raw in raws), uidvalidity)
+
+    def append(self, raw, date=None):
+        with self.cond:
+            self.messages.append((self.next_uid, date or _message_date(raw), raw))
+            self.next_uid += 1
+            self.cond.notify_all()
+
+    def parsed(self, uid, raw):
+        with self.cond:
+            msg = self._parsed.get(uid)
+            if msg is None:
+                msg = email.message_from_bytes(raw)
+                self._parsed[uid] = msg
+                if len(self._parsed) > 256:
+                    self._parsed.popitem(last=False)
+            return msg
+
+    def section(self, uid, raw, section):
+        key = (uid, section)
+        with self.cond:
+            data = self._sections.get(key)
+        if data is None:
+            data = _section(self.parsed(uid, raw), section)
+            with self.cond:
+                self._sections[key] = data
+                if len(self._sections) > 16:
+                    self._sections.popitem(last=False)
+        return data
+
+class Handler(socketserver.StreamRequestHandler):
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        self.wfile.write(data)
+        self.server.bytes_sent += len(data)
+
+    def handle(self):
+        self.box = self.server.mailbox
+        self.server.clients.append(self.request)
+        # 响应分多次写出，关闭 Nagle 算法避免每条命令多等一个延迟确认 (约 40ms)
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.send(b"* OK fake IMAP ready\r\n")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            parts = line.rstrip(b"\r\n").decode("utf-8", "replace").split(" ", 2)
+            if len(parts) < 2:
+                continue
+            tag, cmd = parts[0], parts[1].upper()
+            args = parts[2] if len(parts) > 2 else ""
+            uid_mode = False
+            if cmd == "UID":
+                uid_mode = True
+                sub = args.split(" ", 1)
+                cmd, args = sub[0].upper(), (sub[1] if len(sub) > 1 else "")
+            self.server.commands += 1
+            if self.server.latency:
+                time.sleep(self.server.latency) # 模拟真实服务器的网络往返延迟
+
+            if cmd == "CAPABILITY":
+                caps = "IMAP4rev1 IDLE" if self.server.idle else "IMAP4rev1"
+                self.send(f"* CAPABILITY {caps}\r\n")
+            elif cmd == "LOGIN":
+                pass
+            elif cmd in ("SELECT", "EXAMINE"):
+                self.send(f"* {len(self.box.messages)} EXISTS\r\n"
+                          f"* OK [UIDVALIDITY {self.box.uidvalidity}]\r\n"
+                          f"* OK [UIDNEXT {self.box.next_uid}]\r\n")
+            elif cmd == "SEARCH":
+                found = " ".join(str(n) for n in self.search(args, uid_mode))
+                self.send(f"* SEARCH {found}\r\n")
+            elif cmd == "FETCH":
+                self.fetch(args, uid_mode)
+            elif cmd == "IDLE":
+                self.idle(tag)
+                continue
+            elif cmd in ("NOOP", "CLOSE", "CHECK"):
+                pass
+            elif cmd == "LOGOUT":
+                self.send(f"* BYE\r\n{tag} OK LOGOUT\r\n")
+                return
+            else:
+                self.send(f"{tag} BAD unknown command\r\n")
+                continue
+            self.send(f"{tag} OK {cmd} completed\r\n")
+
+    def idle(self, tag):
+        self.send(b"+ idling\r\n")
+        known = len(self.box.messages)
+        while True:
+            with self.box.cond:
+                if len(self.box.messages) != known:
+                    known = len(self.box.messages)
+                    self.send(f"* {known} EXISTS\r\n")
+            ready, _, _ = select.select([self.request], [], [], 0.2)
+            if ready:
+                self.rfile.readline() # DONE
+                break
+        self.send(f"{tag} OK IDLE terminated\r\n")
+
+    def resolve(self, spec, uid_mode):
+        """把 1:5,7,9:* 这样的序号/UID 集合转换为序号列表"""
+        msgs = self.box.messages
+        maxval = (msgs[-1][0] if uid_mode else len(msgs)) if msgs else 0
+        wanted = []
+        for rng in spec.split(","):
+            a, colon, b = rng.partition(":")
+            lo = maxval if a == "*" else int(a)
+            hi = lo if not colon else (maxval if b == "*" else int(b))
+            wanted.append((min(lo, hi), max(lo, hi)))
+        return [seq for seq, (uid, _, _) in enumerate(msgs, 1)
+                if any(lo <= (uid if uid_mode else seq) <= hi for lo, hi in wanted)]
+
+    def search(self, args, uid_mode):
+        tokens = args.replace('"', "").split()
+        if tokens and tokens[0].upper() == "CHARSET":
+            tokens = tokens[2:]
+        seqs = list(range(1, len(self.box.messages) + 1))
+        i = 0
+        while i < len(tokens):
+            t = tokens[i].upper()
+            if t in ("SINCE", "BEFORE"):
+                d, m, y = tokens[i + 1].split("-")
+                ref = datetime.date(int(y), MONTHS.index(m) + 1, int(d))
+                if t == "SINCE":
+                    seqs = [s for s in seqs if self.box.messages[s - 1][1] >= ref]
+                else:
+                    seqs = [s for s in seqs if self.box.messages[s - 1][1] < ref]
+                i += 2
+            elif t == "UID":
+                allowed = set(self.resolve(tokens[i + 1], True))
+                seqs = [s for s in seqs if s in allowed]
+                i += 2
+            else:
+                i += 1 # ALL 等
+        if uid_mode:
+            return [self.box.messages[s - 1][0] for s in seqs]
+        return seqs
+
+    def fetch(self, args, uid_mode):
+        spec, _, items = args.partition(" ")
+        items = items.strip()
+        if items.startswith("(") and items.endswith(")"):
+            items = items[1:-1]
+        names = re.findall(r'BODY(?:\.PEEK)?\[[^\]]*\](?:<\d+\.\d+>)?|[A-Z0-9.]+', items.upper())
+        seqs = self.resolve(spec, uid_mode)
+        for seq in seqs:
+            uid, date, raw = self.box.messages[seq - 1]
+            if uid in self.server.missing_uids or (len(seqs) > 1 and uid in self.server.omit_in_batch):
+                continue # 模拟服务器的响应中缺少某封邮件
+            out = []
+            if uid_mode and "UID" not in names:
+                out.append(b"UID %d" % uid)
+            for name in names:
+                if name == "UID":
+                    out.append(b"UID %d" % uid)
+                elif name in ("RFC822", "BODY[]", "BODY.PEEK[]"):
+                    self.server.body_bytes += len(raw)
+                    out.append(b"RFC822 {%d}\r\n" % len(raw) + raw)
+                elif name == "RFC822.SIZE":
+                    out.append(b"RFC822.SIZE %d" % len(raw))
+                elif name == "FLAGS":
+                    out.append(b"FLAGS ()")
+                elif name == "ENVELOPE":
+                    out.append(b"ENVELOPE " + _envelope(self.box.parsed(uid, raw)))
+                elif name == "BODYSTRUCTURE":
+                    out.append(b"BODYSTRUCTURE " + _bodystructure(self.box.parsed(uid, raw)))
+                elif name.startswith("BODY"):
+                    m = re.match(r'BODY(?:\.PEEK)?\[([^\]]*)\](?:<(\d+)\.(\d+)>)?', name)
+                    section = m.group(1)
+                    data = self.box.section(uid, raw, section)
+                    key = f"BODY[{section}]"
+                    if m.group(2):
+                        start, length = int(m.group(2)), int(m.group(3))
+                        data = data[start:start + length]
+                        key += f"<{start}>"
+                    self.server.body_bytes += len(data)
+                    out.append(key.encode() + b" {%d}\r\n" % len(data) + data)
+            self.send(f"* {seq} FETCH (".encode() + b" ".join(out) + b")\r\n")
+
+class FakeIMAPServer(socketserver.ThreadingTCPServer):
+    """
+    在后台线程中运行的测试服务器
+
+    Attributes:
+        bytes_sent (int): 发送给客户端的总字节数
+        body_bytes (int): 其中邮件内容 (整封或附件段) 的字节数
+        commands (int): 收到的命令数
+        omit_in_batch (set): 一条 FETCH 命令获取多封邮件时不返回这些 UID (单独获取时正常返回)
+        missing_uids (set): FETCH 命令始终不返回这些 UID
+    """
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, mailbox, address=("127.0.0.1", 0), idle=True, latency=0.0):
+        super().__init__(address, Handler)
+        self.mailbox = mailbox
+        self.idle = idle
+        self.latency = latency
+        self.bytes_sent = 0
+        self.body_bytes = 0
+        self.commands = 0
+        self.clients = []
+        self.omit_in_batch = set()
+        self.missing_uids = set()
+
+    def start(self):
+        """在后台线程中开始服务，返回 (地址, 端口)"""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self.server_address
+
+    def stats(self):
+        return {'bytes_sent': self.bytes_sent, 'body_bytes': self.body_bytes, 'commands': self.commands}
+
+    def drop_all(self):
+        """断开所有客户端连接 (用于测试重连)"""
+        for conn in self.clients:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.clients = []
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 IMAP 测试服务器")
+    parser.add_argument('fixture', help="mbox 文件或 Maildir 文件夹 (可用 bench/mailgen.py 生成)")
+    parser.add_argument('--port', type=int, default=1143)
+    parser.add_argument('--no-idle', action='store_true', help="不提供 IDLE 能力 (测试轮询模式)")
+    parser.add_argument('--latency', type=float, default=0, help="每条命令的模拟往返延迟，毫秒")
+    args = parser.parse_args()
+
+    box = Mailbox.load(args.fixture)
+    server = FakeIMAPServer(box, ("127.0.0.1", args.port), idle=not args.no_idle,
+                            latency=args.latency / 1000)
+    print(f"已加载 {len(box.messages)} 封邮件，监听 127.0.0.1:{server.server_address[1]} (Ctrl+C 退出)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(server.stats(), file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
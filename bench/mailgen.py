@@ -0,0 +1,197 @@
+"""
+生成模拟一个学期作业邮件的测试邮箱 (mbox) 和对应的学生名单
+
+    python3 bench/mailgen.py --messages 2000 --students 120 --output bench/fixture
+
+邮件中包含: GBK / UTF-8 编码的主题和附件名 (RFC2047 与 RFC2231 两种写法)、
+无意义的附件名 (需要用主题补全)、不支持的格式、大 PDF、重复提交 (内容相同或修改后重发)、
+转发的邮件 (message/rfc822) 以及与作业无关的邮件。同样的参数和 seed 总是生成同样的邮箱。
+"""
+import os
+import re
+import json
+import random
+import argparse
+import datetime
+import email.utils
+from email.header import Header
+from email.mime.base import MIMEBase
+from email.mime.text import MIMEText
+from email.mime.message import MIMEMessage
+from email.mime.multipart import MIMEMultipart
+from email import encoders
+
+SURNAMES = "赵钱孙李周吴郑王冯陈褚卫蒋沈韩杨朱秦尤许何吕施张孔曹严华金魏陶姜谢邹喻柏窦章苏潘葛范彭鲁马方"
+GIVEN = "伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰萍鹏辉建国志红梅琳雪婷宇浩然子轩欣怡思远"
+
+ASSIGNMENTS = [('LAB', n) for n in range(1, 9)] + [('课堂作业', n) for n in range(1, 7)]
+
+CN_NUMS = "零一二三四五六七八九十"
+
+FROM_LINE = re.compile(rb'^From ', re.M)
+
+def make_roster(count, rng):
+    students = []
+    names = set()
+    for serial in range(1, count + 1):
+        while True:
+            name = rng.choice(SURNAMES) + ''.join(rng.choice(GIVEN) for _ in range(rng.choice((1, 2, 2))))
+            if name not in names:
+                names.add(name)
+                break
+        students.append({'serial': serial, 'id': f"2023{serial:06d}", 'name': name})
+    return students
+
+def _assignment_title(kind, num, rng):
+    """作业在主题或文件名中的各种写法"""
+    n = rng.choice((str(num), CN_NUMS[num]))
+    if kind == 'LAB':
+        return rng.choice((f"第{n}次实验", f"实验{n}", f"实验报告{n}", f"LAB{num}", f"lab {num}", f"第{n}次实验报告"))
+    return rng.choice((f"第{n}次作业", f"作业{n}", f"课堂作业{n}", f"第{n}次课堂作业"))
+
+def _subject(student, title, rng):
+    return rng.choice((
+        f"{title} {student['id']} {student['name']}",
+        f"{student['id']}{student['name']}{title}",
+        f"{student['name']}-{title}",
+        f"【{title}】{student['name']} {student['id']}",
+        f"{title}",  # 主题中没有身份信息，只能靠附件名
+    ))
+
+def _filename(student, title, ext, rng):
+    return rng.choice((
+        f"{student['id']}{student['name']}{title}{ext}",
+        f"{student['id']}_{student['name']}{ext}",
+        f"{student['name']}{title}{ext}",
+        f"实验报告{ext}",
+        f"新建 Microsoft Word 文档{ext}",
+        f"{rng.getrandbits(64):016x}{ext}",
+        f"IMG_{rng.randint(1000, 9999)}{ext}",
+    ))
+
+def _payload(ext, size, rng):
+    if ext == '.pdf':
+        return b'%PDF-1.4\n' + rng.randbytes(max(0, size - 9))
+    if ext == '.txt':
+        return ("作业内容 " * (size // 13 + 1)).encode('utf-8')[:size]
+    return rng.randbytes(size)
+
+def make_message(subject, attachments, date, rng, msgid, charset=None):
+    """
+    构造一封邮件
+
+    Args:
+        attachments (list): [(文件名, 内容)]
+    """
+    charset = charset or rng.choice(('utf-8', 'gbk'))
+    msg = MIMEMultipart(boundary=f"=={rng.getrandbits(64):016x}==")
+    msg['Subject'] = Header(subject, charset).encode()
+    msg['From'] = email.utils.formataddr(("学生", f"stu{rng.randint(1, 99999)}@qq.com"))
+    msg['To'] = "teacher@qq.com"
+    msg['Date'] = email.utils.format_datetime(date)
+    msg['Message-ID'] = msgid
+    msg.attach(MIMEText("老师好，作业见附件。", 'plain', charset))
+    for name, data in attachments:
+        part = MIMEBase('application', 'octet-stream')
+        part.set_payload(data)
+        encoders.encode_base64(part)
+        if rng.random() < 0.5:
+            part.add_header('Content-Disposition', 'attachment', filename=(charset, '', name))
+        else:
+            part.add_header('Content-Disposition', 'attachment', filename=Header(name, charset).encode())
+        msg.attach(part)
+    return msg
+
+def generate(output, messages=2000, students=120, seed=1, large_fraction=0.005, large_size=8 * 1024 * 1024,
+             duplicate_fraction=0.1, term_start=datetime.date(2026, 2, 23)):
+    """
+    在 output 目录下生成 mailbox.mbox 和 students.json
+
+    Returns:
+        dict: 生成的邮件数和附件数等统计
+    """
+    rng = random.Random(seed)
+    os.makedirs(output, exist_ok=True)
+    roster = make_roster(students, rng)
+    with open(os.path.join(output, "students.json"), 'w', encoding='utf-8') as f:
+        json.dump(roster, f, ensure_ascii=False, indent=2)
+
+    mbox_path = os.path.join(output, "mailbox.mbox")
+    stats = {'messages': 0, 'attachments': 0, 'large': 0, 'duplicates': 0, 'noise': 0, 'bytes': 0}
+    sent = [] # 已发送的 (邮件, 附件) 用于模拟重复提交
+
+    with open(mbox_path, 'wb') as box:
+        for i in range(messages):
+            week = i * len(ASSIGNMENTS) // max(1, messages)
+            date = datetime.datetime.combine(term_start + datetime.timedelta(days=week * 7 + rng.randint(0, 6)),
+                                             datetime.time(rng.randint(8, 23), rng.randint(0, 59)),
+                                             tzinfo=datetime.timezone(datetime.timedelta(hours=8)))
+            roll = rng.random()
+            if sent and roll < duplicate_fraction:
+                # 重复提交: 原样重发，或者修改内容后重发
+                subject, attachments = rng.choice(sent)
+                if rng.random() < 0.5:
+                    attachments = [(name, data[:-16] + rng.randbytes(16)) for name, data in attachments]
+                subject = rng.choice((subject, f"{subject} 重新提交", f"Re: {subject}"))
+                stats['duplicates'] += 1
+            elif roll < duplicate_fraction + 0.03:
+                subject = rng.choice(("系统通知", "关于期中考试的问题", "请假条", "Re: 课程安排"))
+                attachments = [] if rng.random() < 0.7 else [("课程表.xlsx", rng.randbytes(3000))]
+                stats['noise'] += 1
+            else:
+                student = rng.choice(roster)
+                kind, num = ASSIGNMENTS[min(week, len(ASSIGNMENTS) - 1)]
+                title = _assignment_title(kind, num, rng)
+                subject = _subject(student, title, rng)
+                attachments = []
+                if rng.random() < large_fraction:
+                    attachments.append((_filename(student, title, '.pdf', rng), _payload('.pdf', large_size, rng)))
+                    stats['large'] += 1
+                else:
+                    for _ in range(rng.choice((1, 1, 1, 2))):
+                        ext = rng.choice(('.pdf', '.pdf', '.docx', '.doc', '.txt', '.jpg', '.png', '.zip'))
+                        size = int(rng.lognormvariate(10, 1)) + 200 # 中位数约 22KB
+                        attachments.append((_filename(student, title, ext, rng), _payload(ext, size, rng)))
+                sent.append((subject, attachments))
+                if len(sent) > 200:
+                    sent.pop(rng.randrange(len(sent)))
+
+            msg = make_message(subject, attachments, date, rng, f"<{seed}.{i}@example.com>")
+            if rng.random() < 0.02:
+                # 转发的邮件: 附件在 message/rfc822 中
+                outer = MIMEMultipart(boundary=f"=={rng.getrandbits(64):016x}==")
+                outer['Subject'] = Header(f"Fwd: {subject}", 'utf-8').encode()
+                outer['From'] = msg['From']
+                outer['To'] = msg['To']
+                outer['Date'] = msg['Date']
+                outer.attach(MIMEText("转发", 'plain', 'utf-8'))
+                outer.attach(MIMEMessage(msg))
+                msg = outer
+
+            raw = msg.as_bytes()
+            # mbox 格式: 每封邮件以 "From " 行开头，正文中以 "From " 开头的行需要转义
+            box.write(b"From MAILER-DAEMON " + date.strftime("%a %b %d %H:%M:%S %Y").encode() + b"\n")
+            box.write(FROM_LINE.sub(b">From ", raw.replace(b"\r\n", b"\n")))
+            box.write(b"\n\n")
+            stats['messages'] += 1
+            stats['attachments'] += len(attachments)
+            stats['bytes'] += len(raw)
+    return stats
+
+def main():
+    parser = argparse.ArgumentParser(description="生成测试邮箱 (mbox) 和学生名单")
+    parser.add_argument('--output', default=os.path.join("bench", "fixture"), help="输出目录")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--students', type=int, default=120)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--large-fraction', type=float, default=0.005, help="带大 PDF 附件的邮件比例")
+    parser.add_argument('--large-size', type=int, default=8 * 1024 * 1024, help="大 PDF 的字节数")
+    parser.add_argument('--duplicate-fraction', type=float, default=0.1, help="重复提交邮件的比例")
+    args = parser.parse_args()
+
+    stats = generate(args.output, args.messages, args.students, args.seed,
+                     args.large_fraction, args.large_size, args.duplicate_fraction)
+    print(f"已生成 {args.output}/mailbox.mbox: {stats}")
+
+if __name__ == "__main__":
+    main()
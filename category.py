@@ -0,0 +1,134 @@
+import os
+import re
+import shutil
+from functools import lru_cache
+
+# 中文数字映射
+cn_map = {'零': 0, '一': 1, '二': 2, '三': 3, '四': 4, '五': 5,
+          '六': 6, '七': 7, '八': 8, '九': 9, '十': 10}
+
+def _num(name):
+    return rf'(?P<{name}_num>\d+|[零一二三四五六七八九十]+)'
+
+# 分类规则 (按优先级排列): (组名, 分类前缀, 正则, 是否需要检查编号长度)
+RULES = [
+    # 1. 匹配 "第X次...实验" 格式 (允许中间有其他字符)
+    ('lab1', 'LAB', r'第\s*' + _num('lab1') + r'\s*次.*?(?:实验|LAB|实践)', False),
+    # 2. 匹配 "实验报告1", "LAB 1", "实验作业2", "实验4" 等 (数字在后)
+    ('lab2', 'LAB', r'(?:实验报告|实验作业|实践|LAB|实验).*?' + _num('lab2'), True),
+    # 3. 匹配 "第X次...作业" 格式 (允许中间有其他字符)
+    ('class1', '课堂作业', r'第\s*' + _num('class1') + r'\s*次.*?(?:课堂作业|作业)', False),
+    # 4. 匹配 "课堂作业1", "作业 2" 等 (数字在后)
+    ('class2', '课堂作业', r'(?:课堂作业|作业).*?' + _num('class2'), True),
+]
+
+# 所有规则合并为一个预编译的正则，每条规则放在零宽前瞻中，扫描一遍即可得到每条规则最靠前的匹配
+# 开头的字符集是所有规则可能的首字符，用于快速跳过无关位置
+COMBINED = re.compile(
+    '(?=[第实课作L])(?:' + '|'.join(f'(?=(?P<{name}>{pattern}))' for name, _, pattern, _ in RULES) + ')',
+    re.IGNORECASE,
+)
+
+def to_arabic(num_str):
+    """把中文数字转换为阿拉伯数字字符串，支持 十一、二十、二十一 等复合数字"""
+    if num_str.isdigit():
+        return num_str
+    if '十' in num_str:
+        tens, _, ones = num_str.partition('十')
+        if len(tens) > 1 or len(ones) > 1:
+            return num_str
+        value = cn_map.get(tens, 1) * 10 + cn_map.get(ones, 0)
+        return str(value)
+    if len(num_str) == 1 and num_str in cn_map:
+        return str(cn_map[num_str])
+    return num_str
+
+def is_valid_num(num_str):
+    """判断是否为合理的作业编号 (避免匹配到学号)"""
+    # 如果是数字字符串，长度不应超过2位 (防止匹配到学号/年份)
+    if num_str.isdigit():
+        return len(num_str) <= 2
+    return True
+
+def _rule_name(m):
+    """返回合并正则的一次匹配对应的规则名"""
+    for name, _, _, _ in RULES:
+        if m.group(name) is not None:
+            return name
+
+def _first_matches(text):
+    """扫描一遍，返回每条规则最靠前的匹配编号"""
+    found = {}
+    for m in COMBINED.finditer(text):
+        name = _rule_name(m)
+        if name not in found:
+            found[name] = m.group(name + '_num')
+            if name == RULES[0][0]:
+                break # 最高优先级的规则已经匹配，无需继续
+    return found
+
+def _decide(found):
+    """按规则优先级，从各规则的第一个匹配中选出分类"""
+    for name, prefix, _, check_num in RULES:
+        if name in found:
+            num = to_arabic(found[name])
+            if check_num and not is_valid_num(num):
+                continue
+            return f"{prefix}{num}"
+    return None
+
+@lru_cache(maxsize=4096)
+def get_category(text):
+    """尝试从文本 (邮件主题或文件名) 中提取分类，如 LAB4、课堂作业2；无法识别时返回 None"""
+    if not text:
+        return None
+    return _decide(_first_matches(text))
+
+def classify_batch(texts):
+    """
+    批量分类，重复的文本 (如同一主题下的多个附件、多次重发) 只计算一次
+
+    Args:
+        texts (list): 邮件主题或文件名列表
+
+    Returns:
+        list: 与 texts 一一对应的分类结果 (无法识别时为 None)
+    """
+    return [get_category(text) for text in texts]
+
+def main():
+    """离线整理 downloads/tmp: 对未分类的文件重新分类并移动到对应文件夹"""
+    tmp_dir = os.path.join("downloads", "tmp")
+    if not os.path.exists(tmp_dir):
+        print(f"目录 '{tmp_dir}' 不存在。")
+        return
+
+    files = sorted(f for f in os.listdir(tmp_dir)
+                   if not f.startswith('.') and os.path.isfile(os.path.join(tmp_dir, f)))
+    categories = classify_batch(files)
+
+    moves = [(f, c) for f, c in zip(files, categories) if c]
+    print(f"tmp 中共有 {len(files)} 个文件，其中 {len(moves)} 个可以重新分类:")
+    for filename, category in moves:
+        print(f"  {filename} -> {category}")
+
+    if not moves:
+        return
+
+    confirm = input("是否移动这些文件? (y/n): ").strip().lower()
+    if confirm != 'y':
+        print("已取消。")
+        return
+
+    for filename, category in moves:
+        target_dir = os.path.join("downloads", category)
+        os.makedirs(target_dir, exist_ok=True)
+        target = os.path.join(target_dir, filename)
+        if os.path.exists(target):
+            print(f"  [跳过] 目标文件已存在: {target}")
+            continue
+        shutil.move(os.path.join(tmp_dir, filename), target)
+        print(f"  [移动] {filename} -> {category}")
+
+if __name__ == "__main__":
+    main()
@@ -1,180 +1,482 @@
-import os
-import json
-from typing import List, Tuple
-
-def load_student_list(json_file: str) -> List[dict]:
-    """从JSON文件加载学生名单"""
-    try:
-        with open(json_file, 'r', encoding='utf-8') as f:
-            students = json.load(f)
-        print(f"成功加载 {len(students)} 名学生信息")
-        return students
-    except Exception as e:
-        print(f"加载JSON文件失败: {e}")
-        return []
-
-def get_files_in_folder(folder_path: str) -> List[str]:
-    """获取文件夹中的所有文件名"""
-    if not os.path.exists(folder_path):
-        print(f"文件夹不存在: {folder_path}")
-        return []
-    
-    files = []
-    for filename in os.listdir(folder_path):
-        if os.path.isfile(os.path.join(folder_path, filename)):
-            files.append(filename)
-    
-    print(f"在文件夹中找到 {len(files)} 个文件")
-    return files
-
-def check_submission(student_id: str, student_name: str, files: List[str]) -> Tuple[bool, str]:
-    """检查单个学生的作业提交情况"""
-    for filename in files:
-        # 检查文件名是否包含学号和姓名
-        if student_id in filename and student_name in filename:
-            return True, filename
-        # 宽松匹配：只检查学号
-        elif student_id in filename:
-            return True, filename
-        # 更宽松的匹配：检查姓名（可能存在重名风险）
-        elif student_name in filename and len(student_name) > 1:
-            return True, filename
-    return False, ""
-
-def analyze_all_submissions(students: List[dict], folder_path: str) -> Tuple[List[dict], List[dict]]:
-    """分析所有学生的提交情况"""
-    files = get_files_in_folder(folder_path)
-    if not files:
-        return [], students
-    
-    submitted = []
-    not_submitted = []
-    
-    for student in students:
-        student_id = student['id']
-        student_name = student['name']
-        
-        has_submitted, filename = check_submission(student_id, student_name, files)
-        
-        if has_submitted:
-            submitted.append({
-                'serial': student['serial'],
-                'id': student_id,
-                'name': student_name,
-                'filename': filename
-            })
-        else:
-            not_submitted.append({
-                'serial': student['serial'],
-                'id': student_id,
-                'name': student_name
-            })
-    
-    return submitted, not_submitted
-
-def generate_report(submitted: List[dict], not_submitted: List[dict], output_file: str = None) -> str:
-    """生成提交情况报告"""
-    total_students = len(submitted) + len(not_submitted)
-    submission_rate = (len(submitted) / total_students) * 100 if total_students > 0 else 0
-    
-    report = []
-    report.append("=" * 60)
-    report.append("作业提交情况统计报告")
-    report.append("=" * 60)
-    report.append(f"总学生数: {total_students}")
-    report.append(f"已提交: {len(submitted)} 人")
-    report.append(f"未提交: {len(not_submitted)} 人")
-    report.append(f"提交率: {submission_rate:.1f}%")
-    report.append("")
-    
-    # 已提交学生名单
-    report.append("已提交学生名单:")
-    report.append("-" * 40)
-    for student in sorted(submitted, key=lambda x: x['serial']):
-        report.append(f"{student['serial']:3d}. {student['id']} {student['name']:10s} - {student['filename']}")
-    
-    report.append("")
-    
-    # 未提交学生名单
-    report.append("未提交学生名单:")
-    report.append("-" * 40)
-    for student in sorted(not_submitted, key=lambda x: x['serial']):
-        report.append(f"{student['serial']:3d}. {student['id']} {student['name']}")
-    
-    report_text = "\n".join(report)
-    
-    # 输出到文件
-    if output_file:
-        try:
-            with open(output_file, 'w', encoding='utf-8') as f:
-                f.write(report_text)
-            print(f"报告已保存到: {output_file}")
-        except Exception as e:
-            print(f"保存报告文件失败: {e}")
-    
-    return report_text
-
-def main():
-    """主函数"""
-    print("作业提交检查程序")
-    print("=" * 50)
-    
-    # 加载学生名单
-    students = load_student_list("students.json")
-    if not students:
-        return
-    
-    # 获取downloads下的所有文件夹
-    downloads_path = "downloads"
-    if not os.path.exists(downloads_path):
-        print(f"错误：目录 '{downloads_path}' 不存在。")
-        return
-
-    subfolders = [f for f in os.listdir(downloads_path) if os.path.isdir(os.path.join(downloads_path, f))]
-    subfolders.sort()
-
-    if not subfolders:
-        print(f"'{downloads_path}' 下没有找到任何文件夹。")
-        return
-
-    print("请选择作业文件夹:")
-    for i, folder in enumerate(subfolders, 1):
-        print(f"{i}. {folder}")
-    
-    choice = input("请输入序号: ").strip()
-    
-    if not choice.isdigit():
-        print("输入无效，请输入数字。")
-        return
-    
-    idx = int(choice) - 1
-    if idx < 0 or idx >= len(subfolders):
-        print("输入的序号超出范围。")
-        return
-        
-    folder_name = subfolders[idx]
-    print(f"已选择: {folder_name}")
-    
-    # 构造完整路径
-    folder_path = os.path.join(downloads_path, folder_name)
-
-    submitted, not_submitted = analyze_all_submissions(students, folder_path)
-    
-    # 设置默认输出文件名
-    default_output_file = f"{folder_name}_output.txt"
-    
-    # 询问用户是否使用默认输出文件名
-    use_default = input(f"是否使用默认输出文件名 '{default_output_file}'? (y/n, 回车默认使用): ").strip().lower()
-    
-    if use_default == 'n':
-        output_file = input("请输入自定义报告输出文件名: ").strip()
-        if not output_file:
-            output_file = default_output_file
-    else:
-        output_file = default_output_file
-    
-    # 生成报告
-    report = generate_report(submitted, not_submitted, output_file)
-
-if __name__ == "__main__":
+import os
+import json
+import hashlib
+import sqlite3
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+import metrics
+from roster import AhoCorasick, Roster, build_matcher, load_roster, match_file
+from store import get_store
+
+@metrics.timed('check.list')
+def scan_folder_entries(folder_path: str) -> List[Tuple[str, int, int]]:
+    """获取文件夹中的所有文件及其 (大小, 修改时间)"""
+    if not os.path.exists(folder_path):
+        print(f"文件夹不存在: {folder_path}")
+        return []
+
+    entries = []
+    with os.scandir(folder_path) as it:
+        for entry in it:
+            # 隐藏文件 (检查快照、下载中的临时文件等) 不是作业
+            if entry.name.startswith('.'):
+                continue
+            if entry.is_file():
+                st = entry.stat()
+                entries.append((entry.name, st.st_size, st.st_mtime_ns))
+
+    print(f"在文件夹中找到 {len(entries)} 个文件")
+    return entries
+
+def get_files_in_folder(folder_path: str) -> List[str]:
+    """获取文件夹中的所有文件名"""
+    return [name for name, _, _ in scan_folder_entries(folder_path)]
+
+@metrics.timed('check.match')
+def summarize_matches(files: List[str], matches: Dict[str, List[int]], students: List[dict]) -> Tuple[Dict[int, str], List[dict], List[str]]:
+    """
+    汇总一个文件夹中每个文件的匹配结果
+
+    Returns:
+        tuple: ({学生下标: 该学生的第一个文件}, 匹配到多个学生的文件, 未匹配到任何学生的文件)
+    """
+    first_file = {}
+    ambiguous = []
+    unmatched = []
+
+    for filename in files:
+        matched = matches.get(filename, [])
+        if not matched:
+            unmatched.append(filename)
+            continue
+        if len(matched) > 1:
+            ambiguous.append({
+                'filename': filename,
+                'students': [f"{students[i]['id']} {students[i]['name']}" for i in matched]
+            })
+        for index in matched:
+            first_file.setdefault(index, filename)
+
+    return first_file, ambiguous, unmatched
+
+# --- 增量检查: 每个文件夹保存一份 (文件名, 大小, 修改时间) -> 匹配结果 的快照 ---
+SNAPSHOT_FILE = ".check_snapshot.json"
+
+def roster_fingerprint(students: List[dict]) -> str:
+    """名单内容的哈希，名单变化时快照中的匹配结果全部失效"""
+    data = json.dumps(students, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+@metrics.timed('check.snapshot')
+def load_snapshot(folder_path: str) -> dict:
+    try:
+        with open(os.path.join(folder_path, SNAPSHOT_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+@metrics.timed('check.snapshot')
+def save_snapshot(folder_path: str, snapshot: dict) -> None:
+    path = os.path.join(folder_path, SNAPSHOT_FILE)
+    tmp_file = path + ".tmp"
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_file, path)
+    except OSError as e:
+        print(f"保存检查快照失败: {e}")
+
+def load_folder_matches(folder_path: str, students: List[dict], matcher: AhoCorasick = None) -> Tuple[List[str], Dict[str, List[int]], Dict[str, List[str]]]:
+    """
+    增量匹配一个文件夹: 只对新增或大小/修改时间变化的文件重新匹配，其余直接复用快照；
+    结果同时写入数据库 (store.py)
+
+    快照中的匹配结果每次扫描都会更新；"上次检查" 的基线 (已提交的学号) 按报告分别保存，
+    只在报告生成后由 save_baseline 更新，单纯扫描 (如批量模式) 不会改变它。
+
+    Returns:
+        tuple: (文件列表, {文件名: 学生下标列表}, {报告名: 该报告上次生成时已提交的学号列表})
+    """
+    entries = scan_folder_entries(folder_path)
+    files = [name for name, _, _ in entries]
+
+    with metrics.stage('check.match'):
+        fingerprint = roster_fingerprint(students)
+    snapshot = load_snapshot(folder_path)
+    cached = snapshot.get('files', {}) if snapshot.get('roster') == fingerprint else {}
+    baselines = snapshot.get('baselines', {})
+
+    id_index = {str(s['id']): i for i, s in enumerate(students)}
+    matches = {}
+    new_files = {}
+    rematched = 0
+    with metrics.stage('check.match'):
+        for filename, size, mtime in entries:
+            entry = cached.get(filename)
+            if entry and entry[0] == size and entry[1] == mtime:
+                matches[filename] = [id_index[i] for i in entry[2] if i in id_index]
+            else:
+                if matcher is None:
+                    matcher = build_matcher(students)
+                matches[filename] = match_file(filename, students, matcher)
+                rematched += 1
+            new_files[filename] = [size, mtime, [str(students[i]['id']) for i in matches[filename]]]
+    metrics.count('check.files', len(entries))
+    metrics.count('check.rematched', rematched)
+
+    if cached:
+        print(f"使用检查快照: {len(files) - rematched} 个文件未变化，{rematched} 个文件重新匹配")
+
+    new_snapshot = {'roster': fingerprint, 'files': new_files, 'baselines': baselines}
+    if new_snapshot != snapshot:
+        save_snapshot(folder_path, new_snapshot)
+
+    # 匹配结果写入数据库，之后可以直接查询谁没交某次作业
+    with metrics.stage('check.store'):
+        try:
+            get_store().sync_folder(os.path.basename(os.path.normpath(folder_path)),
+                                    {filename: entry[2] for filename, entry in new_files.items()})
+        except sqlite3.Error as e:
+            print(f"更新数据库失败: {e}")
+
+    return files, matches, baselines
+
+def save_baseline(folder_path: str, report: str, submitted: List[dict]) -> None:
+    """报告生成后，把本次已提交的学生记为该报告下次 "自上次检查以来新提交" 的基线"""
+    snapshot = load_snapshot(folder_path)
+    if not snapshot:
+        return # 文件夹还没有扫描过
+    ids = sorted(str(s['id']) for s in submitted)
+    if snapshot.setdefault('baselines', {}).get(report) != ids:
+        snapshot['baselines'][report] = ids
+        save_snapshot(folder_path, snapshot)
+
+def analyze_all_submissions(students: List[dict], folder_path: str, matcher: AhoCorasick = None,
+                            report: str = None) -> Tuple[List[dict], List[dict], List[dict], List[str]]:
+    """
+    分析所有学生的提交情况
+
+    每个文件名只扫描一次，找出其中提到的所有学生；未变化的文件直接复用上次检查的结果。
+    已提交记录中的 'new' 表示该学生是报告 report 上次生成 (见 save_baseline) 之后新提交的。
+
+    Returns:
+        tuple: (已提交, 未提交, 匹配到多个学生的文件, 未匹配到任何学生的文件)
+    """
+    files, matches, baselines = load_folder_matches(folder_path, students, matcher)
+    previous = set(baselines[report]) if report in baselines else None
+    if not files:
+        return [], students, [], []
+
+    first_file, ambiguous, unmatched = summarize_matches(files, matches, students)
+
+    submitted = []
+    not_submitted = []
+
+    for index, student in enumerate(students):
+        if index in first_file:
+            submitted.append({
+                'serial': student['serial'],
+                'id': student['id'],
+                'name': student['name'],
+                'filename': first_file[index],
+                'new': previous is not None and str(student['id']) not in previous
+            })
+        else:
+            not_submitted.append({
+                'serial': student['serial'],
+                'id': student['id'],
+                'name': student['name']
+            })
+
+    return submitted, not_submitted, ambiguous, unmatched
+
+# --- 批量模式: 一次扫描所有作业文件夹 ---
+# 进程池中每个进程持有一份名单和匹配自动机 (只在进程启动时传入一次)
+_worker_students = None
+_worker_matcher = None
+
+def _init_worker(students: List[dict], matcher: AhoCorasick) -> None:
+    global _worker_students, _worker_matcher
+    _worker_students = students
+    _worker_matcher = matcher
+
+def _scan_folder(folder_path: str) -> Dict[int, str]:
+    files, matches, _ = load_folder_matches(folder_path, _worker_students, _worker_matcher)
+    return summarize_matches(files, matches, _worker_students)[0]
+
+def _init_pool_worker(students: List[dict], matcher: AhoCorasick) -> None:
+    metrics.drain() # 丢弃 fork 时从父进程继承的统计
+    _init_worker(students, matcher)
+
+def _scan_folder_in_worker(folder_path: str) -> Tuple[Dict[int, str], dict]:
+    """子进程中扫描，连同本次的性能统计一起返回给父进程"""
+    return _scan_folder(folder_path), metrics.drain() if metrics.enabled() else None
+
+@metrics.timed('check.list')
+def list_assignment_folders(downloads_path: str = "downloads") -> List[str]:
+    """列出所有作业文件夹 (不包括未分类的 tmp)"""
+    if not os.path.exists(downloads_path):
+        return []
+    folders = [f for f in os.listdir(downloads_path)
+               if os.path.isdir(os.path.join(downloads_path, f)) and f != 'tmp']
+    folders.sort()
+    return folders
+
+def build_submission_matrix(students: List[dict], downloads_path: str = "downloads", workers: int = 1,
+                            matcher: AhoCorasick = None):
+    """
+    扫描所有作业文件夹，生成 学生 × 作业 的提交矩阵
+
+    Args:
+        workers (int): 进程数，大于 1 时用进程池并行扫描各文件夹
+        matcher (AhoCorasick): 已建好的名单匹配自动机，不传时现场建立
+
+    Returns:
+        tuple: (提交矩阵 DataFrame (True 表示已提交，最后一列为未交次数), 各作业提交率 DataFrame)
+    """
+    import pandas as pd
+
+    folders = list_assignment_folders(downloads_path)
+    paths = [os.path.join(downloads_path, f) for f in folders]
+    if matcher is None:
+        matcher = build_matcher(students)
+
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_pool_worker,
+                                 initargs=(students, matcher)) as executor:
+            results = []
+            for first_file, stats in executor.map(_scan_folder_in_worker, paths):
+                results.append(first_file)
+                metrics.merge(stats)
+    else:
+        _init_worker(students, matcher)
+        results = [_scan_folder(path) for path in paths]
+
+    with metrics.stage('check.report'):
+        index = pd.MultiIndex.from_tuples(
+            [(s['serial'], s['id'], s['name']) for s in students], names=['序号', '学号', '姓名'])
+        matrix = pd.DataFrame(
+            {folder: pd.Series(True, index=list(first_file), dtype=bool) for folder, first_file in zip(folders, results)},
+            columns=folders)
+        matrix = matrix.reindex(range(len(students))).fillna(False).astype(bool)
+        matrix.index = index
+        matrix = matrix.sort_index(level='序号')
+
+        rates = pd.DataFrame({
+            '已提交': matrix.sum(axis=0),
+            '未提交': (~matrix).sum(axis=0),
+            '提交率(%)': (matrix.mean(axis=0) * 100).round(1),
+        })
+        matrix['未交次数'] = (~matrix).sum(axis=1)
+    return matrix, rates
+
+@metrics.timed('check.report')
+def save_submission_matrix(matrix, rates, output_prefix: str = "submission_matrix", formats=("csv",)) -> None:
+    """把提交矩阵保存为 CSV / XLSX / JSON"""
+    import pandas as pd
+
+    for fmt in formats:
+        output_file = f"{output_prefix}.{fmt}"
+        try:
+            if fmt == 'csv':
+                # utf-8-sig 便于 Excel 直接打开中文
+                matrix.astype(int).to_csv(output_file, encoding='utf-8-sig')
+                rates.to_csv(f"{output_prefix}_rates.csv", encoding='utf-8-sig')
+            elif fmt == 'xlsx':
+                with pd.ExcelWriter(output_file) as writer:
+                    matrix.astype(int).to_excel(writer, sheet_name='提交矩阵')
+                    rates.to_excel(writer, sheet_name='提交率')
+            elif fmt == 'json':
+                data = {
+                    'students': json.loads(matrix.reset_index().to_json(orient='records', force_ascii=False)),
+                    'assignments': json.loads(rates.reset_index(names='作业').to_json(orient='records', force_ascii=False)),
+                }
+                with open(output_file, 'w', encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+            else:
+                print(f"不支持的输出格式: {fmt}")
+                continue
+            print(f"提交矩阵已保存到: {output_file}")
+        except Exception as e:
+            print(f"保存提交矩阵失败 ({output_file}): {e}")
+
+def run_batch(formats=("csv",), workers: int = 1, output_prefix: str = "submission_matrix",
+              roster: Roster = None, downloads_path: str = "downloads") -> None:
+    """非交互批量模式: 扫描所有作业文件夹并输出提交矩阵"""
+    if roster is None:
+        roster = load_roster("students.json")
+    if not roster.students:
+        print("未找到学生名单 students.json")
+        return
+    print(f"成功加载 {len(roster)} 名学生信息")
+
+    matrix, rates = build_submission_matrix(roster.students, downloads_path, workers, roster.matcher)
+    if rates.empty:
+        print(f"'{downloads_path}' 下没有找到任何作业文件夹。")
+        return
+
+    print("\n各作业提交情况:")
+    print(rates.to_string())
+    print(f"\n至少缺交一次的学生: {int((matrix['未交次数'] > 0).sum())} 人")
+    save_submission_matrix(matrix, rates, output_prefix, formats)
+
+@metrics.timed('check.report')
+def generate_report(submitted: List[dict], not_submitted: List[dict], output_file: str = None,
+                    ambiguous: List[dict] = None, unmatched: List[str] = None) -> str:
+    """生成提交情况报告"""
+    total_students = len(submitted) + len(not_submitted)
+    submission_rate = (len(submitted) / total_students) * 100 if total_students > 0 else 0
+    
+    report = []
+    report.append("=" * 60)
+    report.append("作业提交情况统计报告")
+    report.append("=" * 60)
+    report.append(f"总学生数: {total_students}")
+    report.append(f"已提交: {len(submitted)} 人")
+    report.append(f"未提交: {len(not_submitted)} 人")
+    report.append(f"提交率: {submission_rate:.1f}%")
+    newly_submitted = [x for x in submitted if x.get('new')]
+    if newly_submitted:
+        report.append(f"自上次检查以来新提交: {len(newly_submitted)} 人")
+    report.append("")
+
+    # 上次检查之后新提交的学生
+    if newly_submitted:
+        report.append("自上次检查以来新提交:")
+        report.append("-" * 40)
+        for student in sorted(newly_submitted, key=lambda x: x['serial']):
+            report.append(f"{student['serial']:3d}. {student['id']} {student['name']:10s} - {student['filename']}")
+        report.append("")
+    
+    # 已提交学生名单
+    report.append("已提交学生名单:")
+    report.append("-" * 40)
+    for student in sorted(submitted, key=lambda x: x['serial']):
+        report.append(f"{student['serial']:3d}. {student['id']} {student['name']:10s} - {student['filename']}")
+    
+    report.append("")
+    
+    # 未提交学生名单
+    report.append("未提交学生名单:")
+    report.append("-" * 40)
+    for student in sorted(not_submitted, key=lambda x: x['serial']):
+        report.append(f"{student['serial']:3d}. {student['id']} {student['name']}")
+
+    # 需要人工确认的文件
+    if ambiguous:
+        report.append("")
+        report.append("匹配到多个学生的文件 (请人工确认):")
+        report.append("-" * 40)
+        for item in ambiguous:
+            report.append(f"{item['filename']} -> {', '.join(item['students'])}")
+
+    if unmatched:
+        report.append("")
+        report.append("未匹配到任何学生的文件 (请人工确认):")
+        report.append("-" * 40)
+        for filename in unmatched:
+            report.append(filename)
+    
+    report_text = "\n".join(report)
+    
+    # 输出到文件
+    if output_file:
+        try:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write(report_text)
+            print(f"报告已保存到: {output_file}")
+        except Exception as e:
+            print(f"保存报告文件失败: {e}")
+    
+    return report_text
+
+def main(argv: List[str] = None, roster: Roster = None, downloads_path: str = "downloads"):
+    """
+    主函数
+
+    Args:
+        argv (list): 命令行参数 (默认读取 sys.argv)
+        roster (Roster): 已加载的学生名单 (由 main.py 共享)；不传时从 students.json 加载
+        downloads_path (str): 作业下载目录
+    """
+    parser = argparse.ArgumentParser(description="作业提交检查程序")
+    parser.add_argument('--all', action='store_true', help="批量模式: 扫描所有作业文件夹，输出 学生×作业 提交矩阵")
+    parser.add_argument('--format', default='csv', help="批量模式输出格式，可用逗号分隔多个: csv,xlsx,json (默认 csv)")
+    parser.add_argument('--workers', type=int, default=1, help="批量模式并行扫描的进程数 (默认 1)")
+    args = parser.parse_args(argv)
+
+    print("作业提交检查程序")
+    print("=" * 50)
+
+    if args.all:
+        formats = [f.strip().lower() for f in args.format.split(',') if f.strip()]
+        run_batch(formats, args.workers, roster=roster, downloads_path=downloads_path)
+        return
+    
+    # 加载学生名单
+    if roster is None:
+        roster = load_roster("students.json")
+    students = roster.students
+    if not students:
+        print("未找到学生名单 students.json")
+        return
+    print(f"成功加载 {len(students)} 名学生信息")
+    
+    # 获取downloads下的所有文件夹
+    if not os.path.exists(downloads_path):
+        print(f"错误：目录 '{downloads_path}' 不存在。")
+        return
+
+    subfolders = [f for f in os.listdir(downloads_path) if os.path.isdir(os.path.join(downloads_path, f))]
+    subfolders.sort()
+
+    if not subfolders:
+        print(f"'{downloads_path}' 下没有找到任何文件夹。")
+        return
+
+    print("请选择作业文件夹:")
+    for i, folder in enumerate(subfolders, 1):
+        print(f"{i}. {folder}")
+    
+    choice = input("请输入序号: ").strip()
+    
+    if not choice.isdigit():
+        print("输入无效，请输入数字。")
+        return
+    
+    idx = int(choice) - 1
+    if idx < 0 or idx >= len(subfolders):
+        print("输入的序号超出范围。")
+        return
+        
+    folder_name = subfolders[idx]
+    print(f"已选择: {folder_name}")
+    
+    # 构造完整路径
+    folder_path = os.path.join(downloads_path, folder_name)
+
+    # 设置默认输出文件名
+    default_output_file = f"{folder_name}_output.txt"
+    
+    # 询问用户是否使用默认输出文件名
+    use_default = input(f"是否使用默认输出文件名 '{default_output_file}'? (y/n, 回车默认使用): ").strip().lower()
+    
+    if use_default == 'n':
+        output_file = input("请输入自定义报告输出文件名: ").strip()
+        if not output_file:
+            output_file = default_output_file
+    else:
+        output_file = default_output_file
+
+    # 每个报告文件有各自的 "上次检查" 基线
+    submitted, not_submitted, ambiguous, unmatched = analyze_all_submissions(
+        students, folder_path, roster.matcher, output_file)
+    
+    # 生成报告
+    report = generate_report(submitted, not_submitted, output_file, ambiguous, unmatched)
+    if os.path.exists(output_file):
+        save_baseline(folder_path, output_file, submitted)
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,76 @@
+import os
+import json
+import datetime
+
+# 默认配置文件 (可用 --config 或环境变量 HOMEWORK_CONFIG 指定其他路径)
+CONFIG_FILE = "config.json"
+
+# 环境变量前缀: 例如 HOMEWORK_EMAIL_PASSWORD 对应配置项 email_password
+ENV_PREFIX = "HOMEWORK_"
+
+DEFAULTS = {
+    'imap_host': "imap.qq.com",
+    'imap_port': 0,             # 0 表示使用默认端口 (SSL 993 / 明文 143)
+    'imap_ssl': True,
+    'email_account': "",
+    'email_password': "",
+    'start_date': None,         # 起始日期 "YYYY-MM-DD" (None 表示不限)
+    'end_date': None,           # 结束日期 "YYYY-MM-DD" (None 表示直到现在，包含该日)
+    'mailbox': "inbox",
+    'fetch_mode': "structure",
+    'max_connections': 4,
+    'fetch_batch_size': 200,    # 每条 UID FETCH 命令最多获取的邮件数 (1 表示逐封获取)
+    'raw_cache_dir': "",  # 原始邮件缓存目录 (如 ".mail_cache"，默认不缓存)，用于 reprocess 离线重建
+    'download_dir': "downloads",
+    'roster_file': "students.json",
+    'database': "course.db",
+    'workers': 1,
+    'format': "csv",
+}
+
+def parse_date(value):
+    """把 "YYYY-MM-DD" 转换为 date；已经是 date 或为空时原样返回"""
+    if not value or isinstance(value, datetime.date):
+        return value or None
+    return datetime.datetime.strptime(str(value).strip(), "%Y-%m-%d").date()
+
+def _convert(key, value):
+    """环境变量都是字符串，按默认值的类型转换"""
+    default = DEFAULTS.get(key)
+    if isinstance(default, bool):
+        return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+    if isinstance(default, int):
+        return int(value)
+    return value
+
+def load_config(path=None, overrides=None):
+    """
+    读取配置，优先级: overrides (命令行参数) > 环境变量 > 配置文件 > 默认值
+
+    Args:
+        path (str): 配置文件路径 (默认 HOMEWORK_CONFIG 或 config.json；文件不存在时跳过)
+        overrides (dict): 命令行参数，值为 None 的项不覆盖
+
+    Returns:
+        dict: 完整配置
+    """
+    config = dict(DEFAULTS)
+
+    path = path or os.environ.get(ENV_PREFIX + "CONFIG") or CONFIG_FILE
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                config.update(json.load(f))
+        except (OSError, ValueError) as e:
+            print(f"读取配置文件 {path} 失败: {e}")
+
+    for key in DEFAULTS:
+        value = os.environ.get(ENV_PREFIX + key.upper())
+        if value is not None:
+            config[key] = _convert(key, value)
+
+    for key, value in (overrides or {}).items():
+        if value is not None:
+            config[key] = value
+
+    return config
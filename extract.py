@@ -1,96 +1,282 @@
-import pandas as pd
-import json
-import re
-
-def extract_students_from_excel(excel_file):
-    """
-    从Excel文件中提取学生信息
-    
-    Args:
-        excel_file (str): Excel文件路径
-        
-    Returns:
-        list: 学生信息列表
-    """
-    try:
-        # 读取Excel文件 (默认读取第一个Sheet)
-        df = pd.read_excel(excel_file, header=None)
-        
-        students = []
-        
-        # 遍历所有行
-        for index, row in df.iterrows():
-            # 检查是否为学生数据行（序号列为数字）
-            if pd.notna(row[0]) and str(row[0]).isdigit():
-                serial = int(row[0])
-                student_id = str(row[1]).strip() if pd.notna(row[1]) else ""
-                name = str(row[2]).strip() if pd.notna(row[2]) else ""
-                
-                # 清理姓名中的特殊标记（如*号）
-                name = re.sub(r'\s*\*', '', name)
-                
-                # 确保所有必要字段都存在
-                if student_id and name:
-                    student = {
-                        "serial": serial,
-                        "id": student_id,
-                        "name": name
-                    }
-                    students.append(student)
-        
-        # 按序号排序
-        students.sort(key=lambda x: x["serial"])
-        
-        return students
-        
-    except Exception as e:
-        print(f"读取Excel文件时出错: {e}")
-        return []
-
-def save_to_json(students, json_file):
-    """
-    将学生信息保存为JSON文件
-    
-    Args:
-        students (list): 学生信息列表
-        json_file (str): JSON文件路径
-    """
-    try:
-        with open(json_file, 'w', encoding='utf-8') as f:
-            json.dump(students, f, ensure_ascii=False, indent=2)
-        print(f"数据已成功保存到 {json_file}")
-    except Exception as e:
-        print(f"保存JSON文件时出错: {e}")
-
-def main():
-    # 文件路径
-    default_file = "总名单.xlsx"
-    # 获取用户输入的文件名，如果为空则使用默认值
-    user_input = input(f"请输入Excel文件名 (默认为 {default_file}): ").strip()
-    excel_file = user_input if user_input else default_file
-    
-    output_json = "students.json"
-    
-    # 从Excel提取数据
-    print("正在从Excel文件中提取学生信息...")
-    students = extract_students_from_excel(excel_file)
-    
-    if students:
-        print(f"成功提取 {len(students)} 名学生信息")
-        
-        # 显示前几条记录作为示例
-        print("\n前5条记录示例:")
-        for i, student in enumerate(students[:5]):
-            print(f"序号: {student['serial']}, 学号: {student['id']}, 姓名: {student['name']}")
-        
-        # 保存为JSON文件
-        save_to_json(students, output_json)
-        
-        # 同时在控制台输出JSON内容
-        print(f"\n生成的JSON内容:")
-        print(json.dumps(students, ensure_ascii=False, indent=2))
-    else:
-        print("未找到学生数据")
-
-if __name__ == "__main__":
-    main()
\ No newline at end of file
+import os
+import csv
+import json
+import re
+import time
+import hashlib
+import metrics
+from roster import load_roster
+from store import get_store
+
+# 姓名中的特殊标记 (如*号)
+NAME_MARK = re.compile(r'\s*\*')
+
+def _read_csv_rows(csv_file):
+    """读取 CSV 名单的所有行 (兼容 Excel 导出的 UTF-8 BOM 和 GBK 编码)"""
+    for encoding in ('utf-8-sig', 'gb18030'):
+        try:
+            with open(csv_file, 'r', encoding=encoding, newline='') as f:
+                return [list(row) for row in csv.reader(f)]
+        except UnicodeDecodeError:
+            continue
+    return []
+
+def iter_sheets(excel_file):
+    """
+    逐个工作表读取名单文件，每个工作表返回一个行列表 (每行为单元格值的元组)
+
+    .xlsx 用 openpyxl 的只读模式流式读取 (不加载 pandas)；
+    .csv 直接读取；其他格式 (如 .xls) 才退回到 pandas。
+    """
+    ext = os.path.splitext(excel_file)[1].lower()
+    if ext == '.csv':
+        yield _read_csv_rows(excel_file)
+    elif ext in ('.xlsx', '.xlsm'):
+        from openpyxl import load_workbook
+        wb = load_workbook(excel_file, read_only=True, data_only=True)
+        try:
+            for ws in wb.worksheets:
+                yield list(ws.iter_rows(values_only=True))
+        finally:
+            wb.close()
+    else:
+        import pandas as pd
+        for df in pd.read_excel(excel_file, header=None, sheet_name=None).values():
+            yield list(df.astype(object).where(df.notna(), None).itertuples(index=False, name=None))
+
+def _serial(value):
+    """序号列的值为数字时返回整数，否则返回 None (表头、空行、备注等)"""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float):
+        return int(value) if value.is_integer() else None
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return None
+
+def _cell_text(value):
+    """把单元格值转换为字符串 (学号按整数显示，避免出现 2023001.0)"""
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+def extract_students_from_excel(excel_file):
+    """
+    从Excel文件中提取学生信息
+
+    支持 .xlsx / .xls / .csv；工作簿有多个工作表时合并所有工作表 (同一学号只保留第一次出现)。
+
+    Args:
+        excel_file (str): Excel文件路径
+        
+    Returns:
+        list: 学生信息列表
+    """
+    try:
+        students = []
+        seen_ids = set()
+
+        for rows in metrics.timed_iter('extract.read', iter_sheets(excel_file)):
+            metrics.count('extract.rows', len(rows))
+            with metrics.stage('extract.filter'):
+                # 只保留学生数据行（序号列为数字）
+                data_rows = [(serial, row) for row in rows if row
+                             for serial in (_serial(row[0]),) if serial is not None]
+                sheet_students = []
+                for serial, row in data_rows:
+                    student_id = _cell_text(row[1]) if len(row) > 1 else ""
+                    name = NAME_MARK.sub('', _cell_text(row[2])) if len(row) > 2 else ""
+
+                    # 确保所有必要字段都存在
+                    if student_id and name and student_id not in seen_ids:
+                        seen_ids.add(student_id)
+                        sheet_students.append({
+                            "serial": serial,
+                            "id": student_id,
+                            "name": name
+                        })
+
+                # 每个工作表内按序号排序，工作表之间保持原有顺序
+                sheet_students.sort(key=lambda x: x["serial"])
+                students.extend(sheet_students)
+        
+        return students
+        
+    except Exception as e:
+        print(f"读取Excel文件时出错: {e}")
+        return []
+
+@metrics.timed('extract.serialize')
+def save_to_json(students, json_file):
+    """
+    将学生信息保存为JSON文件 (先写临时文件再替换)
+    
+    Args:
+        students (list): 学生信息列表
+        json_file (str): JSON文件路径
+
+    Returns:
+        bool: 是否保存成功
+    """
+    try:
+        tmp_file = json_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(students, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_file, json_file)
+        print(f"数据已成功保存到 {json_file}")
+        return True
+    except Exception as e:
+        print(f"保存JSON文件时出错: {e}")
+        return False
+
+# --- 提取缓存: 在 students.json 旁记录来源文件的哈希、大小和修改时间 ---
+
+def _source_meta_path(json_file):
+    folder, name = os.path.split(json_file)
+    return os.path.join(folder, f".{name}.source")
+
+@metrics.timed('extract.hash')
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def load_source_meta(json_file):
+    try:
+        with open(_source_meta_path(json_file), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_source_meta(json_file, meta):
+    path = _source_meta_path(json_file)
+    tmp_file = path + ".tmp"
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_file, path)
+    except OSError as e:
+        print(f"保存提取缓存失败: {e}")
+
+def source_unchanged(excel_file, json_file):
+    """
+    判断名单文件自上次提取以来是否没有变化
+
+    先比较大小和修改时间，不同时再比较内容哈希 (文件被复制或 touch 过但内容相同也算未变化)。
+
+    Returns:
+        tuple: (是否未变化, 当前来源信息 {source, size, mtime_ns, sha256})
+    """
+    st = os.stat(excel_file)
+    meta = {'source': os.path.abspath(excel_file), 'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+    cached = load_source_meta(json_file)
+    if not os.path.exists(json_file) or cached.get('source') != meta['source']:
+        meta['sha256'] = file_sha256(excel_file)
+        return False, meta
+
+    if cached.get('size') == meta['size'] and cached.get('mtime_ns') == meta['mtime_ns']:
+        meta['sha256'] = cached.get('sha256')
+        return True, meta
+
+    meta['sha256'] = file_sha256(excel_file)
+    return meta['sha256'] == cached.get('sha256'), meta
+
+def diff_students(old, new):
+    """
+    比较新旧名单 (按学号)
+
+    Returns:
+        dict: {'added': [新增学生], 'removed': [删除的学生], 'renamed': [{'id', 'old_name', 'new_name'}]}
+    """
+    old_by_id = {str(s['id']): s for s in old}
+    new_by_id = {str(s['id']): s for s in new}
+    return {
+        'added': [s for i, s in new_by_id.items() if i not in old_by_id],
+        'removed': [s for i, s in old_by_id.items() if i not in new_by_id],
+        'renamed': [{'id': i, 'old_name': old_by_id[i]['name'], 'new_name': s['name']}
+                    for i, s in new_by_id.items() if i in old_by_id and old_by_id[i]['name'] != s['name']],
+    }
+
+@metrics.timed('extract.serialize')
+def save_diff(diff, excel_file, json_file):
+    """把名单变化写入 students.json 同目录下的 students_diff.json"""
+    diff_file = os.path.join(os.path.dirname(json_file), "students_diff.json")
+    data = {'source': excel_file, 'time': time.strftime('%Y-%m-%d %H:%M:%S'), **diff}
+    try:
+        with open(diff_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        print(f"名单变化: 新增 {len(diff['added'])} 人，删除 {len(diff['removed'])} 人，"
+              f"改名 {len(diff['renamed'])} 人，详情已保存到 {diff_file}")
+    except OSError as e:
+        print(f"保存名单变化失败: {e}")
+
+def run(excel_file, output_json="students.json"):
+    """
+    从名单文件提取学生信息，保存到数据库并导出为 students.json (名单文件没有变化时跳过)
+
+    Returns:
+        list: 新提取的学生列表；名单未变化时返回 None，提取失败时返回空列表
+    """
+    if not os.path.exists(excel_file):
+        print(f"文件不存在: {excel_file}")
+        return []
+
+    # 名单文件没有变化时直接使用已有的 students.json
+    unchanged, meta = source_unchanged(excel_file, output_json)
+    if unchanged:
+        print(f"{excel_file} 自上次提取以来没有变化，继续使用 {output_json}。")
+        save_source_meta(output_json, meta)
+        return None
+
+    # 读取旧名单用于比较变化 (数据库中还没有名单时从旧的 students.json 导入，见 roster.load_roster)
+    old_students = load_roster(output_json).students or None
+    
+    # 从Excel提取数据
+    print("正在从Excel文件中提取学生信息...")
+    students = extract_students_from_excel(excel_file)
+    
+    if students:
+        print(f"成功提取 {len(students)} 名学生信息")
+        
+        # 显示前几条记录作为示例
+        print("\n前5条记录示例:")
+        for i, student in enumerate(students[:5]):
+            print(f"序号: {student['serial']}, 学号: {student['id']}, 姓名: {student['name']}")
+
+        if old_students is not None:
+            diff = diff_students(old_students, students)
+            if any(diff.values()):
+                save_diff(diff, excel_file, output_json)
+            else:
+                print("名单中的学生没有变化。")
+        
+        # 保存到数据库，并导出为JSON文件
+        if save_to_json(students, output_json):
+            with metrics.stage('extract.serialize'):
+                get_store().replace_students(students, file_sha256(output_json))
+            save_source_meta(output_json, meta)
+    else:
+        print("未找到学生数据")
+    return students
+
+def main():
+    # 文件路径
+    default_file = "总名单.xlsx"
+    # 获取用户输入的文件名，如果为空则使用默认值
+    user_input = input(f"请输入Excel文件名 (默认为 {default_file}): ").strip()
+    excel_file = user_input if user_input else default_file
+    
+    students = run(excel_file, "students.json")
+    if students:
+        # 同时在控制台输出JSON内容
+        print(f"\n生成的JSON内容:")
+        print(json.dumps(students, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
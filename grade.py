@@ -1,36 +1,85 @@
 import os
 import json
+import shutil
 import subprocess
 import sys
 import platform
+import socket
+import sqlite3
+import getpass
+import threading
+from preview import PreviewPrefetcher, format_preview
+from roster import load_roster
+from store import get_store
+
+# 后台预读的文件数: 批改当前文件时提前准备后面几个文件的预览
+prefetch_count = 3
+
+# 批改租约的有效期 (秒): 多人同时批改同一个作业时，每个文件在被领取后由该会话独占；
+# 会话在后台定期续约，程序崩溃或被关闭后租约在这段时间后过期，文件可以被其他人重新领取
+lease_seconds = 300
 
 def open_file(filepath):
     """
-    根据操作系统打开文件
+    根据操作系统打开文件 (不等待查看器退出)
+
+    Returns:
+        bool: 是否找到了可用的图形查看器
     """
     if platform.system() == 'Darwin':       # macOS
-        subprocess.call(('open', filepath))
+        subprocess.Popen(('open', filepath))
     elif platform.system() == 'Windows':    # Windows
         os.startfile(filepath)
     else:                                   # linux variants
         # 优先尝试使用 VS Code 的 code 命令打开 (适配远程开发环境)
+        if shutil.which('code'):
+            subprocess.Popen(('code', filepath))
+        # 如果没有 code 命令，则在有图形界面时尝试 xdg-open
+        elif shutil.which('xdg-open') and (os.environ.get('DISPLAY') or os.environ.get('WAYLAND_DISPLAY')):
+            subprocess.Popen(('xdg-open', filepath))
+        else:
+            print(f"无法打开文件: {filepath} (未找到打开方式)，以下为文本预览:")
+            return False
+    return True
+
+def load_legacy_grades(folder_name):
+    """
+    读取旧版本保存的成绩: <文件夹>_grades.json 以及上次未正常退出时留下的日志 <文件夹>_grades.jsonl
+    (忽略崩溃时写了一半的最后一行)
+    """
+    records = []
+    output_file = f"{folder_name}_grades.json"
+    if os.path.exists(output_file):
         try:
-            # 使用 code 命令打开文件
-            subprocess.call(('code', filepath))
-        except FileNotFoundError:
-            # 如果没有 code 命令，则尝试 xdg-open
-            try:
-                subprocess.call(('xdg-open', filepath))
-            except FileNotFoundError:
-                print(f"无法打开文件: {filepath} (未找到打开方式)")
+            with open(output_file, 'r', encoding='utf-8') as f:
+                records.extend(json.load(f))
+        except Exception as e:
+            print(f"加载历史成绩失败: {e}")
+
+    journal_file = f"{folder_name}_grades.jsonl"
+    if os.path.exists(journal_file):
+        with open(journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+    return records
 
 def save_grades(grades, output_file):
     """
-    保存成绩到JSON文件
+    导出成绩到JSON文件 (先写临时文件再替换，避免保存中途退出导致文件损坏)
+
+    Returns:
+        bool: 是否保存成功
     """
     try:
-        with open(output_file, 'w', encoding='utf-8') as f:
+        tmp_file = f"{output_file}.{os.getpid()}.tmp" # 多人同时批改时各自导出，临时文件不能重名
+        with open(tmp_file, 'w', encoding='utf-8') as f:
             json.dump(grades, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, output_file)
         print(f"成绩已保存到: {output_file}")
         
         # 计算并显示平均分
@@ -47,53 +96,67 @@ def save_grades(grades, output_file):
         if valid_count > 0:
             average = total_score / valid_count
             print(f"当前平均分: {average:.2f} (基于 {valid_count} 份有效成绩)")
+        return True
             
     except Exception as e:
         print(f"保存文件失败: {e}")
+        return False
 
-def load_students():
-    """
-    加载学生名单
-    """
-    try:
-        if os.path.exists('students.json'):
-            with open('students.json', 'r', encoding='utf-8') as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return []
-
-def find_student_in_list(filename, students):
-    """
-    在学生名单中查找匹配的学生
+def export_grades(store, folder_name):
+    """把数据库中一个作业的成绩导出为 <文件夹>_grades.json"""
+    return save_grades(store.grades(folder_name), f"{folder_name}_grades.json")
+
+class LeaseKeeper:
+    """后台线程: 定期为当前正在批改的文件续约"""
+
+    def __init__(self, store, folder_name, owner, ttl):
+        self.store = store
+        self.folder_name = folder_name
+        self.owner = owner
+        self.ttl = ttl
+        self.filename = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def hold(self, filename):
+        """开始 (filename 为 None 时停止) 为一个文件续约"""
+        self.filename = filename
+
+    def _run(self):
+        while not self._stop.wait(self.ttl / 3):
+            filename = self.filename
+            if filename:
+                try:
+                    self.store.renew_lease(self.folder_name, filename, self.owner, self.ttl)
+                except sqlite3.Error:
+                    pass # 数据库暂时被锁，下次再续
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+def main(roster=None, downloads_path="downloads", grader=None):
     """
-    for student in students:
-        student_id = str(student.get('id', ''))
-        student_name = str(student.get('name', ''))
-        
-        # 优先匹配学号 (如果学号存在且在文件名中)
-        if student_id and student_id in filename:
-            return student
-        
-        # 其次匹配姓名 (如果姓名存在且在文件名中，且长度大于1以避免误判)
-        if student_name and len(student_name) > 1 and student_name in filename:
-            return student
-            
-    return None
+    交互式批改
 
-def main():
+    Args:
+        roster (Roster): 已加载的学生名单 (由 main.py 共享)；不传时从 students.json 加载
+        downloads_path (str): 作业下载目录
+        grader (str): 批改人 (默认为当前系统用户名)
+    """
     print("作业批改助手")
     print("=" * 50)
     
     # 加载学生名单
-    students = load_students()
-    if students:
-        print(f"已加载 {len(students)} 名学生信息用于匹配。")
+    if roster is None:
+        roster = load_roster()
+    if roster.students:
+        print(f"已加载 {len(roster)} 名学生信息用于匹配。")
     else:
         print("未找到 students.json，将只记录文件名和分数。")
 
     # 1. 获取downloads下的所有文件夹
-    downloads_path = "downloads"
     if not os.path.exists(downloads_path):
         print(f"错误：目录 '{downloads_path}' 不存在。")
         return
@@ -122,8 +185,19 @@ def main():
         
     folder_name = subfolders[idx]
     print(f"已选择: {folder_name}")
-    
+    grade_folder(folder_name, roster, downloads_path, grader)
+
+def grade_folder(folder_name, roster, downloads_path="downloads", grader=None):
+    """
+    批改 downloads_path 下的一个作业文件夹 (成绩录入后立即写入数据库，结束时导出 <文件夹>_grades.json)
+
+    多名助教可以同时批改同一个文件夹 (各自运行 grade.py)，每个会话依次领取下一个还没有人批改的文件，
+    互不重复，成绩都写入同一个数据库。
+    """
     folder_path = os.path.join(downloads_path, folder_name)
+    if not os.path.isdir(folder_path):
+        print(f"错误：目录 '{folder_path}' 不存在。")
+        return
     
     # 2. 获取文件列表
     files = [f for f in os.listdir(folder_path) if os.path.isfile(os.path.join(folder_path, f))]
@@ -138,90 +212,141 @@ def main():
     print(f"共找到 {len(files)} 个文件，开始批改...")
     print("-" * 50)
     
-    # 尝试加载已有成绩
-    output_file = f"{folder_name}_grades.json"
-    grades = []
-    graded_filenames = set()
-    
-    if os.path.exists(output_file):
-        try:
-            with open(output_file, 'r', encoding='utf-8') as f:
-                grades = json.load(f)
-                for record in grades:
-                    if 'filename' in record:
-                        graded_filenames.add(record['filename'])
-            print(f"已加载 {len(grades)} 条历史成绩，将跳过已评分文件。")
-        except Exception as e:
-            print(f"加载历史成绩失败: {e}")
-    
+    # 第一次在数据库中批改这个作业时，导入旧版本保存的成绩
+    store = get_store()
+    graded_filenames = store.graded_filenames(folder_name)
+    if not graded_filenames:
+        imported = store.import_grades(folder_name, load_legacy_grades(folder_name))
+        if imported:
+            print(f"已从 {folder_name}_grades.json(l) 导入 {imported} 条历史成绩。")
+            try:
+                os.remove(f"{folder_name}_grades.jsonl")
+            except OSError:
+                pass
+            graded_filenames = store.graded_filenames(folder_name)
+    if graded_filenames:
+        print(f"已加载 {len(graded_filenames)} 条历史成绩，将跳过已评分文件。")
+
+    grader = grader or getpass.getuser()
+    others = store.active_leases(folder_name)
+    if others:
+        print(f"正在同时批改此文件夹的: {', '.join(sorted({l['grader'] or l['owner'] for l in others}))}")
+
+    try:
+        grade_files(files, folder_path, roster, store, folder_name, graded_filenames, grader)
+    except (KeyboardInterrupt, EOFError):
+        print("\n批改中断，已录入的成绩都已保存。")
+
+    # 4. 导出结果
+    export_grades(store, folder_name)
+
+def grade_files(files, folder_path, roster, store, folder_name, graded_filenames, grader=None):
+    """逐个领取文件并录入分数；每条成绩立即写入数据库"""
+    # 本会话的唯一标识 (同一批改人可能在多个终端中同时批改)
+    owner = f"{grader}@{socket.gethostname()}:{os.getpid()}"
+    keeper = LeaseKeeper(store, folder_name, owner, lease_seconds)
+    # 只为开始时还没评分的文件准备预览 (领取顺序与此相同，被其他人领取的文件会被跳过)
+    pending = [f for f in files if f not in graded_filenames]
+    prefetcher = PreviewPrefetcher([os.path.join(folder_path, f) for f in pending], lookahead=prefetch_count)
+    try:
+        _grade_loop(files, folder_path, roster, store, folder_name, grader, owner, keeper, pending, prefetcher)
+    finally:
+        keeper.stop()
+        if keeper.filename:
+            store.release_lease(folder_name, keeper.filename, owner)
+        prefetcher.shutdown()
+
+def _grade_loop(files, folder_path, roster, store, folder_name, grader, owner, keeper, pending, prefetcher):
+    """grade_files 的批改循环，prefetcher 按 pending (开始时未评分的文件) 的顺序编号"""
     word_hint_shown = False
+    pending_index = {f: i for i, f in enumerate(pending)}
+    skipped = set()
     
-    # 3. 循环批改
-    for i, filename in enumerate(files):
-        if filename in graded_filenames:
-            print(f"[{i+1}/{len(files)}] {filename} (已评分) - 跳过")
-            continue
+    # 3. 循环批改: 每次领取下一个没有人在批改的文件
+    while True:
+        filename = store.claim_next(folder_name, files, owner, grader, lease_seconds, exclude=skipped)
+        if filename is None:
+            break
+        keeper.hold(filename)
+
+        # 当前文件及后面 prefetch_count 个文件的预览在后台准备
+        current = pending_index[filename]
+        prefetcher.advance(current)
 
         filepath = os.path.join(folder_path, filename)
-        print(f"[{i+1}/{len(files)}] 正在打开: {filename}")
+        print(f"[{files.index(filename)+1}/{len(files)}] 正在打开: {filename}")
         
         # 检查是否为 Word 文档并提示
         if filename.lower().endswith(('.doc', '.docx')) and not word_hint_shown:
             print("提示: VS Code 默认无法预览 Word 文档。")
             print("      请在扩展商店搜索并安装 'Office Viewer' (cweijan.vscode-office) 插件以正常查看。")
+            print("      也可以在输入分数时输入 'p' 查看文本预览。")
             word_hint_shown = True
 
-        # 自动打开文件
+        # 自动打开文件；没有图形查看器时直接在终端显示预览
         try:
-            open_file(filepath)
+            if not open_file(filepath):
+                print(format_preview(prefetcher.get(current)))
         except Exception as e:
             print(f"无法自动打开文件: {e}")
         
         # 输入分数
         while True:
-            score_input = input(f"请输入 '{filename}' 的分数 (输入 'q' 退出, 's' 跳过): ").strip()
+            score_input = input(f"请输入 '{filename}' 的分数 (输入 'q' 退出, 's' 跳过, 'p' 预览): ").strip()
             
+            if score_input.lower() == 'p':
+                print(format_preview(prefetcher.get(current)))
+                continue
+
             if score_input.lower() == 'q':
-                print("批改中断，正在保存已批改内容...")
-                output_file = f"{folder_name}_grades.json"
-                save_grades(grades, output_file)
+                print("批改中断，已录入的成绩都已保存。")
                 return
             
             if score_input.lower() == 's':
+                # 本会话不再领取该文件，其他人仍可以批改
+                skipped.add(filename)
+                keeper.hold(None)
+                store.release_lease(folder_name, filename, owner)
                 print("已跳过")
                 break
                 
-            try:
-                score = score_input
-                
-                # 尝试匹配学生信息
-                matched_student = find_student_in_list(filename, students)
-                
-                if matched_student:
-                    # 如果匹配成功，基于学生信息构建记录
-                    record = matched_student.copy()
-                    record['score'] = score
-                    record['filename'] = filename # 保留文件名作为参考
-                    grades.append(record)
-                    print(f"  -> 已匹配学生: {matched_student.get('name')} ({matched_student.get('id')})")
-                else:
-                    # 无法匹配，按原格式记录
-                    grades.append({
-                        "filename": filename,
-                        "score": score
-                    })
-                    print("  -> 未匹配到学生信息，仅记录文件名。")
-                
-                break
-            except Exception:
+            score = score_input
+            if not score:
                 print("输入无效，请重新输入")
+                continue
+
+            # 尝试匹配学生信息
+            matched_student = roster.resolve(filename)
+
+            # 写入成绩并释放租约
+            try:
+                conflict = store.set_grade(folder_name, filename, matched_student['id'] if matched_student else None,
+                                           score, grader, owner)
+            except sqlite3.Error as e:
+                print(f"保存成绩失败: {e}，请重新输入")
+                continue
+            keeper.hold(None)
+            if conflict:
+                # 本会话的租约已失效且文件已被其他会话评分 (例如长时间休眠)，不覆盖
+                print(f"  -> [冲突] 该文件已由 {conflict['owner'] or conflict['grader'] or '其他会话'} 评分为 {conflict['score']}，"
+                      f"本次输入的分数未覆盖 (已记入评分日志)。")
+            elif matched_student:
+                print(f"  -> 已匹配学生: {matched_student.get('name')} ({matched_student.get('id')})")
+            else:
+                print("  -> 未匹配到学生信息，仅记录文件名。")
+
+            break
         
         print("-" * 30)
 
-    # 4. 保存结果
-    output_file = f"{folder_name}_grades.json"
-    save_grades(grades, output_file)
-    print("所有文件批改完成！")
+    others = store.active_leases(folder_name)
+    if others:
+        print(f"剩余 {len(others)} 个文件正在由其他批改人批改: "
+              f"{', '.join(sorted({l['grader'] or l['owner'] for l in others}))}")
+    elif skipped:
+        print(f"本次跳过了 {len(skipped)} 个文件，其余文件均已批改。")
+    else:
+        print("所有文件批改完成！")
 
 if __name__ == "__main__":
     main()
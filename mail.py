@@ -1,20 +1,100 @@
 import imaplib
 import email
+import email.utils
 import datetime
 import re
 import os
+import json
+import base64
+import hashlib
+import quopri
+import gzip
+import io
+import shutil
+import tempfile
+import select
+import sqlite3
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from email.header import decode_header
+import metrics
+from category import get_category
+from config import load_config, parse_date
+from store import get_store
 
-# 连接到QQ邮箱IMAP服务器
-mail = imaplib.IMAP4_SSL("imap.qq.com")
-mail.login("您的QQ号@qq.com", "您的授权码")
+# 邮箱地址、授权码、日期范围等不再写在代码中，而是从 config.json、环境变量 (HOMEWORK_*) 或命令行参数读取，
+# 见 config.py；导入时先按配置文件和环境变量设置一次，main.py 的命令行参数通过 configure() 覆盖
+IMAP_HOST = "imap.qq.com"
+IMAP_PORT = 0 # 0 表示默认端口
+IMAP_SSL = True # 本地测试服务器 (见 bench/fake_imap.py) 使用明文连接
+EMAIL_ACCOUNT = ""
+EMAIL_PASSWORD = ""
 
-mail.select("inbox")
+# 1. 搜索日期范围 (start_date 为 None 表示不限起始日期，end_date 为 None 表示直到现在)
+start_date = None
+end_date = None
 
-# 1. 设定搜索日期范围
-start_date = datetime.date(2026, 1, 1) # 起始日期
-end_date = None # 结束日期 (None 表示直到现在)
-# end_date = datetime.date(2025, 12, 25) # 如果要指定结束日期，取消注释并修改
+# 获取方式:
+#   "structure" - 先只获取 ENVELOPE/BODYSTRUCTURE，分类、过滤、去重后再用 BODY.PEEK[n] 下载需要的附件段
+#   "full"      - 整封下载 (RFC822)，适用于不支持 BODYSTRUCTURE 的服务器
+fetch_mode = "structure"
+
+mailbox = "inbox"
+
+download_dir = "downloads"
+
+# 分段下载附件时每次请求的字节数 (编码后)，附件边下载边解码写入临时文件，内存占用与附件大小无关
+fetch_chunk_size = 1024 * 1024
+
+# 并发连接数上限: 同时打开的已登录 IMAP 连接数 (QQ邮箱等服务商对并发连接数有限制，不宜过大)
+max_connections = 4
+
+# 批量获取: 一条 UID FETCH 命令获取一批邮件 (如 UID FETCH 1200:1300)，而不是每封邮件一次往返。
+# 每批最多 fetch_batch_size 封，并按已获取邮件的平均响应大小调整，使每批约 fetch_batch_bytes 字节
+# (structure 模式每封只有几 KB，一批可达上限；full 模式整封下载，大邮件多时自动减小批量)
+fetch_batch_size = 200
+fetch_batch_bytes = 4 * 1024 * 1024
+
+# 增量同步: 记录每个邮箱的 UIDVALIDITY 和已处理的最大 UID，之后只处理新邮件
+# 如需重新扫描整个日期范围，将 full_resync 改为 True
+sync_state_file = os.path.join(download_dir, ".sync_state.json")
+full_resync = False
+
+# 内容去重清单: 记录每个已保存附件的 sha256 -> 路径/邮件UID/时间，内容完全相同的附件不会重复写入
+manifest_file = os.path.join(download_dir, ".manifest.json")
+
+# 原始邮件缓存 (默认关闭): 设为目录名 (如 ".mail_cache") 后每封处理过的邮件原样压缩保存一份 (见 RawCache)，
+# 修改分类、重命名或去重规则后可用 reprocess() 离线重建 downloads，不必重新从邮箱下载。
+# 开启缓存时总是整封获取邮件 (RFC822)，structure 模式只下载需要的附件段的优势不再适用。
+raw_cache_dir = ""
+
+def configure(config):
+    """按配置 (见 config.load_config) 设置邮箱、日期范围和下载目录"""
+    global IMAP_HOST, IMAP_PORT, IMAP_SSL, EMAIL_ACCOUNT, EMAIL_PASSWORD, start_date, end_date
+    global fetch_mode, mailbox, download_dir, max_connections, fetch_batch_size, sync_state_file, manifest_file
+    global raw_cache_dir
+    IMAP_HOST = config['imap_host']
+    IMAP_PORT = int(config['imap_port'] or 0)
+    IMAP_SSL = config['imap_ssl']
+    EMAIL_ACCOUNT = config['email_account']
+    EMAIL_PASSWORD = config['email_password']
+    start_date = parse_date(config['start_date'])
+    end_date = parse_date(config['end_date'])
+    fetch_mode = config['fetch_mode']
+    mailbox = config['mailbox']
+    download_dir = config['download_dir']
+    max_connections = int(config['max_connections'])
+    fetch_batch_size = int(config['fetch_batch_size'])
+    sync_state_file = os.path.join(download_dir, ".sync_state.json")
+    manifest_file = os.path.join(download_dir, ".manifest.json")
+    raw_cache_dir = config['raw_cache_dir']
+
+configure(load_config())
+
+# 只允许 pdf, doc, docx, jpg, png， txt
+allowed_extensions = ('.pdf', '.doc', '.docx', '.jpg', '.png', '.txt')
 
 
 months = {
@@ -25,268 +105,1550 @@ months = {
 def get_imap_date(d):
     return f'{d.day}-{months[d.month]}-{d.year}'
 
-start_str = get_imap_date(start_date)
-search_query = f'SINCE "{start_str}"'
+def build_search_query():
+    """根据起止日期构造 IMAP 搜索条件"""
+    criteria = []
+    if start_date:
+        criteria.append(f'SINCE "{get_imap_date(start_date)}"')
+    if end_date:
+        # IMAP BEFORE 是不包含该日期的，所以为了包含 end_date，需要加一天
+        cutoff_date = end_date + datetime.timedelta(days=1)
+        criteria.append(f'BEFORE "{get_imap_date(cutoff_date)}"')
 
-if end_date:
-    # IMAP BEFORE 是不包含该日期的，所以为了包含 end_date，需要加一天
-    cutoff_date = end_date + datetime.timedelta(days=1)
-    end_str = get_imap_date(cutoff_date)
-    search_query += f' BEFORE "{end_str}"'
-    print(f"正在搜索 {start_str} 到 {get_imap_date(end_date)} (包含) 的所有邮件...")
-else:
-    print(f"正在搜索 {start_str} 以来(包含该日)的所有邮件...")
+    if start_date and end_date:
+        print(f"正在搜索 {get_imap_date(start_date)} 到 {get_imap_date(end_date)} (包含) 的所有邮件...")
+    elif start_date:
+        print(f"正在搜索 {get_imap_date(start_date)} 以来(包含该日)的所有邮件...")
+    elif end_date:
+        print(f"正在搜索 {get_imap_date(end_date)} 之前(包含该日)的所有邮件...")
+    else:
+        print("正在搜索所有邮件...")
+    return ' '.join(criteria) or 'ALL'
 
-# 2. 搜索指定日期范围的邮件
-status, messages = mail.search(None, search_query)
-mail_ids = messages[0].split()
+def load_sync_state():
+    """加载增量同步状态"""
+    try:
+        if os.path.exists(sync_state_file):
+            with open(sync_state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+    except Exception as e:
+        print(f"加载同步状态失败，将进行全量同步: {e}")
+    return {}
 
-# 倒序，从最新开始处理
-target_ids = list(reversed(mail_ids))
+def save_sync_state(state):
+    """保存增量同步状态 (先写临时文件再替换，避免中途退出导致文件损坏)"""
+    tmp_file = sync_state_file + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, sync_state_file)
 
-print(f"共找到 {len(target_ids)} 封邮件。\n")
+def get_uidvalidity(mail):
+    """读取 SELECT 返回的 UIDVALIDITY (复用的连接上已被读取过时重新 SELECT 一次)"""
+    typ, data = mail.response('UIDVALIDITY')
+    if not data or not data[0]:
+        mail.select(mailbox)
+        typ, data = mail.response('UIDVALIDITY')
+    if data and data[0]:
+        return data[0].decode() if isinstance(data[0], bytes) else str(data[0])
+    return None
 
-# 确保下载目录存在
-download_dir = "downloads"
-if not os.path.exists(download_dir):
-    os.makedirs(download_dir)
+def search_new_uids(mail, search_query, box_state, uidvalidity):
+    """
+    搜索需要处理的邮件 UID
 
-# 3. 循环处理每一封邮件
-for i, email_id in enumerate(target_ids):
-    print(f"正在读取第 {i+1} 封邮件 (ID: {email_id.decode()})...")
-    
-    # 为了下载附件，我们需要获取邮件内容
-    # 虽然 (RFC822) 会下载整封邮件，但这是获取附件内容最通用的方式
-    status, msg_data = mail.fetch(email_id, "(RFC822)")
+    UIDVALIDITY 未变化且搜索条件相同时，只搜索上次处理过的最大 UID 之后的新邮件 (UID n:*)；
+    否则按日期范围全量搜索。
 
-    for response_part in msg_data:
-        if isinstance(response_part, tuple):
-            msg = email.message_from_bytes(response_part[1])
-            
-            # --- 解析主题 ---
-            subject_header = msg["Subject"]
-            if subject_header:
-                decoded_list = decode_header(subject_header)
-                subject_bytes, encoding = decoded_list[0]
-                if isinstance(subject_bytes, bytes):
-                    # 如果没有指定编码，默认使用 utf-8
-                    subject = subject_bytes.decode(encoding if encoding else "utf-8", errors="replace")
+    Returns:
+        tuple: (需要处理的 UID 列表, 本次搜索的起点 UID)
+    """
+    last_uid = 0
+    if full_resync:
+        print("已开启 full_resync，将重新扫描整个日期范围。")
+    elif box_state.get('uidvalidity') != uidvalidity:
+        if box_state:
+            print("邮箱 UIDVALIDITY 已变化，将重新扫描整个日期范围。")
+    elif box_state.get('query') != search_query:
+        print("搜索日期范围已变化，将重新扫描整个日期范围。")
+    else:
+        last_uid = int(box_state.get('last_uid', 0))
+
+    if last_uid:
+        print(f"增量同步: 只处理 UID 大于 {last_uid} 的新邮件。")
+        status, messages = mail.uid('SEARCH', None, f'UID {last_uid + 1}:* {search_query}')
+    else:
+        status, messages = mail.uid('SEARCH', None, search_query)
+
+    # 注意: 当没有新邮件时，服务器对 n:* 仍会返回当前最大的 UID，需要再过滤一次
+    uids = [u for u in messages[0].split() if int(u) > last_uid]
+    return uids, last_uid
+
+def safe_name(text):
+    """处理文件名中的非法字符 (防止路径错误)"""
+    return "".join([c for c in text if c not in r'\/:*?"<>|'])
+
+@metrics.timed('mail.decode')
+def decode_subject(subject_header):
+    """解析邮件主题"""
+    if subject_header:
+        decoded_list = decode_header(subject_header)
+        subject_bytes, encoding = decoded_list[0]
+        if isinstance(subject_bytes, bytes):
+            # 如果没有指定编码，默认使用 utf-8
+            return subject_bytes.decode(encoding if encoding else "utf-8", errors="replace")
+        return subject_bytes # 已经是字符串
+    return "无主题"
+
+@metrics.timed('mail.decode')
+def decode_filename(fileName):
+    """解析附件文件名"""
+    decoded_list = decode_header(fileName)
+    fname_bytes, encoding = decoded_list[0]
+
+    if isinstance(fname_bytes, bytes):
+        try:
+            fileName = fname_bytes.decode(encoding if encoding else "utf-8")
+        except (UnicodeDecodeError, LookupError):
+            try:
+                fileName = fname_bytes.decode("gbk")
+            except UnicodeDecodeError:
+                fileName = fname_bytes.decode("gb18030", errors="replace")
+
+    return safe_name(fileName)
+
+def fix_filename(fileName, subject):
+    """尝试用邮件主题修复/补全附件文件名"""
+    # --- 尝试修复无意义的文件名 ---
+    # 如果文件名看起来像哈希值(例如QQ截图生成的)或通用名称，且主题包含有效信息，则尝试用主题重命名
+    name_root, name_ext = os.path.splitext(fileName)
+    # 匹配 16位以上纯十六进制/数字字母组合，或 image/screenshot/wx_camera/新建 开头
+    is_garbage_name = re.match(r'^([a-fA-F0-9]{16,}|image|screenshot|wx_camera|新建|IMG|IMAGE)', name_root, re.IGNORECASE)
+
+    if is_garbage_name and subject and subject != "无主题":
+        safe_subject = safe_name(subject)
+        if safe_subject:
+            new_fileName = f"{safe_subject}{name_ext}"
+            print(f"    [重命名] 检测到无意义文件名，已重命名: {fileName} -> {new_fileName}")
+            fileName = new_fileName
+
+    # --- 补充信息：如果文件名缺失关键信息（如学号），尝试用主题补全 ---
+    # 提取主题中的学号 (8位以上数字)
+    subj_id_match = re.search(r'\d{8,}', subject)
+    subj_id = subj_id_match.group(0) if subj_id_match else None
+
+    should_rename = False
+    # 情况1: 主题包含学号，但文件名不包含
+    if subj_id and subj_id not in fileName:
+        should_rename = True
+    # 情况2: 文件名是通用名称 (如 "第二次作业.docx") 且不包含长数字
+    elif not re.search(r'\d{8,}', fileName):
+        if re.search(r'(?:作业|实验|报告|文档|DOCX|PDF)', fileName, re.IGNORECASE):
+             should_rename = True
+
+    if should_rename and subject and subject != "无主题":
+        safe_subject = safe_name(subject)
+        # 避免重复：如果文件名已经是主题的一部分，或者主题包含文件名，需谨慎
+        if safe_subject not in fileName:
+             new_fileName = f"{safe_subject}_{fileName}"
+             print(f"    [重命名] 补充身份信息: {fileName} -> {new_fileName}")
+             fileName = new_fileName
+
+    return fileName
+
+def choose_folder(folder_from_subject, folder_from_file):
+    """综合主题和文件名的分类结果，决定目标文件夹"""
+    if folder_from_subject and folder_from_file:
+        if folder_from_subject == folder_from_file:
+            return folder_from_subject
+        # 冲突：主题和文件名分类不一致 -> 优先根据文件名进行分类
+        print(f"    [警告] 分类冲突: 主题({folder_from_subject}) vs 文件名({folder_from_file}) -> 优先使用文件名")
+        return folder_from_file
+    elif folder_from_subject:
+        return folder_from_subject
+    elif folder_from_file:
+        return folder_from_file
+    # 均未匹配到分类 -> 存入 tmp (有疑问/未分类)
+    return "tmp"
+
+def extract_student_info(text):
+    """从文件名中提取学号和姓名"""
+    # 1. 提取学号 (8位以上数字)
+    id_match = re.search(r'\d{8,}', text)
+    s_id = id_match.group(0) if id_match else None
+
+    # 2. 提取姓名 (2-4个中文字符)
+    # 先移除常见的干扰词
+    clean_text = re.sub(r'实验|作业|报告|课堂|文档|提交|修改|版|第|次|LAB|Homework|[0-9a-zA-Z\._\-\(\)\s]', '', text, flags=re.IGNORECASE)
+    name_match = re.search(r'[\u4e00-\u9fa5]{2,4}', clean_text)
+    s_name = name_match.group(0) if name_match else None
+    return s_id, s_name
+
+def same_student(file_a, file_b):
+    """两个文件名是否能确认属于同一个学生 (学号 > 姓名，无法确认时返回 False)"""
+    id_a, name_a = extract_student_info(file_a)
+    id_b, name_b = extract_student_info(file_b)
+    if id_a and id_b:
+        return id_a == id_b
+    return bool(name_a) and name_a == name_b
+
+class FolderIndex:
+    """
+    单个分类目录的去重索引 (学号 > 姓名)
+
+    启动时扫描一次目录，按 文件名 / 学号 / 姓名 建立字典，之后每决定保存一个文件就更新索引，
+    判断重复只需几次字典查找，不再对每个附件重新 listdir 并对所有文件跑正则。
+    """
+
+    def __init__(self, target_dir):
+        self.files = {}    # 文件名 -> (学号, 姓名)
+        self.by_id = {}    # 学号 -> 文件名
+        self.by_name = {}  # 姓名 -> [(学号或None, 文件名), ...]
+        # 分类决定在主线程中进行，下载失败的线程会并发地撤销索引项
+        self.lock = threading.Lock()
+        if os.path.exists(target_dir):
+            for existing_file in os.listdir(target_dir):
+                # 忽略非文件和隐藏文件 (如下载中的 .part 临时文件)
+                if existing_file.startswith('.'):
+                    continue
+                if os.path.isfile(os.path.join(target_dir, existing_file)):
+                    self.add(existing_file)
+
+    @metrics.timed('mail.dedup')
+    def add(self, fileName):
+        with self.lock:
+            if fileName in self.files:
+                return
+            s_id, s_name = self.files[fileName] = extract_student_info(fileName)
+            if s_id:
+                self.by_id.setdefault(s_id, fileName)
+            if s_name:
+                self.by_name.setdefault(s_name, []).append((s_id, fileName))
+
+    def remove(self, fileName):
+        """撤销一个最终没有保存的文件 (下载失败或内容重复被跳过)"""
+        with self.lock:
+            info = self.files.pop(fileName, None)
+            if info is None:
+                return
+            s_id, s_name = info
+            if s_name:
+                entries = [e for e in self.by_name.get(s_name, ()) if e[1] != fileName]
+                if entries:
+                    self.by_name[s_name] = entries
                 else:
-                    subject = subject_bytes # 已经是字符串
+                    self.by_name.pop(s_name, None)
+            if s_id and self.by_id.get(s_id) == fileName:
+                del self.by_id[s_id]
+                # 同一学号可能还有其他文件
+                for other, (other_id, _) in self.files.items():
+                    if other_id == s_id:
+                        self.by_id[s_id] = other
+                        break
+
+    @metrics.timed('mail.dedup')
+    def is_duplicate(self, fileName):
+        """智能去重逻辑 (学号 > 姓名)"""
+        with self.lock:
+            return self._is_duplicate(fileName)
+
+    def _is_duplicate(self, fileName):
+        # 如果完全同名，肯定是重复
+        if fileName in self.files:
+            print(f"    [跳过] 文件已存在: {fileName}")
+            return True
+
+        current_id, current_name = extract_student_info(fileName)
+
+        # 规则1: 学号匹配 (最准确)
+        if current_id and current_id in self.by_id:
+            print(f"    [跳过] 已存在该学号({current_id})的较新版本: {self.by_id[current_id]}")
+            return True
+
+        # 规则2: 姓名匹配 (作为兜底，但需防止同名不同人)
+        # 只有当无法通过学号区分时(比如其中一个没写学号)，才使用姓名判断
+        # 如果两人都有学号且不相等，则不是同一个人，即使姓名相同
+        if current_name:
+            for ex_id, existing_file in self.by_name.get(current_name, ()):
+                if current_id and ex_id and current_id != ex_id:
+                    continue # 同名不同人，不跳过
+
+                print(f"    [跳过] 已存在该姓名({current_name})的较新版本: {existing_file}")
+                return True
+
+        return False
+
+@metrics.timed('mail.dedup')
+def build_folder_indexes():
+    """启动时为 downloads 下已有的每个分类目录建立去重索引"""
+    indexes = {}
+    if os.path.exists(download_dir):
+        for folder in os.listdir(download_dir):
+            target_dir = os.path.join(download_dir, folder)
+            if os.path.isdir(target_dir):
+                indexes[target_dir] = FolderIndex(target_dir)
+    return indexes
+
+@metrics.timed('mail.classify')
+def plan_message(subject, attachments, indexes):
+    """
+    对一封邮件执行 分类 -> 重命名 -> 格式过滤 -> 去重，决定需要保存哪些附件
+
+    Args:
+        subject (str): 已解码的邮件主题
+        attachments (list): [(原始文件名, 获取内容的函数), ...]，获取内容的函数接收一个可写对象，
+                            内容只在附件确定要保存时才会被获取
+        indexes (dict): {目标目录: FolderIndex}，决定保存的文件会立即加入索引
+
+    Returns:
+        list: [(目标文件夹, 文件名, 获取内容的函数, 目标目录的 FolderIndex), ...]
+    """
+    print(f"  主题: {subject}")
+
+    folder_from_subject = get_category(subject)
+
+    if not attachments:
+        print("    [无附件]")
+        return []
+
+    tasks = []
+
+    for raw_name, load_payload in attachments:
+        fileName = decode_filename(raw_name)
+
+        # --- 优先基于原始文件名提取分类 (避免重命名引入主题中的混淆信息) ---
+        folder_from_file = get_category(fileName)
+
+        fileName = fix_filename(fileName, subject)
+
+        # --- 检查文件扩展名 ---
+        if not fileName.lower().endswith(allowed_extensions):
+            print(f"    [跳过] 不支持的文件格式: {fileName}")
+            continue
+
+        # --- 智能分类逻辑 ---
+        target_folder = choose_folder(folder_from_subject, folder_from_file)
+
+        # 创建分类目录
+        target_dir = os.path.join(download_dir, target_folder)
+        if not os.path.exists(target_dir):
+            os.makedirs(target_dir)
+
+        index = indexes.get(target_dir)
+        if index is None:
+            index = indexes[target_dir] = FolderIndex(target_dir)
+
+        if index.is_duplicate(fileName):
+            metrics.count('mail.duplicate_name')
+            continue
+
+        # 下载在后台进行，先加入索引，保证之后的去重判断能看到这个文件 (最终没有保存时由 save_attachment 撤销)
+        index.add(fileName)
+        tasks.append((target_folder, fileName, load_payload, index))
+
+    return tasks
+
+class Manifest:
+    """
+    附件内容清单 (保存在 downloads/.manifest.json)
+
+    以 sha256 为键，记录 {path, uid, date, size}。写入磁盘前先查清单，
+    同一份内容 (学生换主题重发、多封邮件带同一附件) 只保存一次；
+    同时保留邮件 UID 和时间，无需扫描目录即可判断哪一份是最新版本。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.blobs = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    self.blobs = json.load(f)
+                return
+            except Exception as e:
+                print(f"加载内容清单失败，将重新建立: {e}")
+        self.backfill()
+
+    @metrics.timed('mail.dedup')
+    def backfill(self):
+        """首次使用时，为 downloads 下已有的文件补充记录"""
+        if not os.path.exists(download_dir):
+            return
+        for folder in os.listdir(download_dir):
+            folder_path = os.path.join(download_dir, folder)
+            if not os.path.isdir(folder_path):
+                continue
+            for existing_file in os.listdir(folder_path):
+                filepath = os.path.join(folder_path, existing_file)
+                if existing_file.startswith('.') or not os.path.isfile(filepath):
+                    continue
+                sha256 = hashlib.sha256()
+                with open(filepath, 'rb') as f:
+                    for block in iter(lambda: f.read(fetch_chunk_size), b''):
+                        sha256.update(block)
+                digest = sha256.hexdigest()
+                self.blobs.setdefault(digest, {
+                    'path': os.path.join(folder, existing_file),
+                    'uid': None,
+                    'date': None,
+                    'size': os.path.getsize(filepath),
+                })
+
+    @metrics.timed('mail.dedup')
+    def claim(self, digest, relpath, uid, date, size):
+        """
+        登记一份即将写入的内容
+
+        Returns:
+            str: 如果相同内容已经保存过 (且文件仍存在)，返回已有文件的相对路径；否则返回 None
+        """
+        with self.lock:
+            entry = self.blobs.get(digest)
+            if entry and os.path.exists(os.path.join(download_dir, entry['path'])):
+                return entry['path']
+            self.blobs[digest] = {'path': relpath, 'uid': uid, 'date': date, 'size': size}
+            return None
+
+    def forget(self, digest):
+        with self.lock:
+            self.blobs.pop(digest, None)
+
+    @metrics.timed('mail.write')
+    def save(self):
+        """先写临时文件再替换，避免中途退出导致文件损坏"""
+        with self.lock:
+            tmp_file = self.path + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.blobs, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, self.path)
+
+class HashingWriter:
+    """写入文件的同时计算 sha256 和大小"""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self.f.write(data)
+        self.sha256.update(data)
+        self.size += len(data)
+
+def record_submission(target_folder, fileName, writer, uid, date):
+    """把保存的附件记录到数据库 (失败时不影响已保存的文件，下次检查时会补上)"""
+    try:
+        get_store().record_submission(target_folder, fileName, writer.sha256.hexdigest(), uid, date, writer.size)
+    except sqlite3.Error as e:
+        print(f"    [警告] 记录到数据库失败: {e}")
+
+@metrics.timed('mail.write')
+def save_attachment(target_folder, fileName, load_payload, index, manifest, uid=None, date=None):
+    """
+    下载附件，按内容去重后保存到分类目录
+
+    附件先边下载边写入同目录下的隐藏临时文件，同时计算 sha256；
+    确认不是重复内容后再原子地重命名为目标文件名。
+    文件最终没有以 fileName 保存时 (下载失败或内容重复)，从 index 中撤销该文件名。
+
+    Returns:
+        bool: 是否成功 (内容重复而跳过也算成功)；失败时邮件不应被记为已同步
+    """
+    target_dir = os.path.join(download_dir, target_folder)
+    filepath = os.path.join(target_dir, fileName)
+    relpath = os.path.join(target_folder, fileName)
+    digest = None
+    tmp_file = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=target_dir, prefix='.', suffix='.part', delete=False) as f:
+            tmp_file = f.name
+            writer = HashingWriter(f)
+            load_payload(writer)
+        digest = writer.sha256.hexdigest()
+
+        existing = manifest.claim(digest, relpath, uid, date, writer.size)
+        if existing:
+            # 同一分类下同一个学生重发的相同文件才跳过；其他学生交了相同的文件时照常保存 (硬链接)，否则该学生会被当作未提交
+            if os.path.dirname(existing) == target_folder and same_student(os.path.basename(existing), fileName):
+                print(f"    [跳过] 内容与已有文件完全相同: {existing}")
+                metrics.count('mail.duplicate_content')
+                index.remove(fileName)
+                return True
+            # 相同内容已保存在其他分类或属于其他学生 -> 建立硬链接，不再重复写入
+            try:
+                os.link(os.path.join(download_dir, existing), filepath)
+                print(f"    [附件] 内容与 {existing} 相同，已链接至 [{target_folder}]: {fileName}")
+                metrics.count('mail.linked')
+                record_submission(target_folder, fileName, writer, uid, date)
+                return True
+            except OSError:
+                digest = None # 不支持硬链接时正常写入，清单中保留原有记录
+
+        os.replace(tmp_file, filepath)
+        tmp_file = None
+        print(f"    [附件] 已下载至 [{target_folder}]: {fileName}")
+        metrics.count('mail.saved')
+        record_submission(target_folder, fileName, writer, uid, date)
+        metrics.count('mail.bytes_written', writer.size)
+        return True
+    except Exception as e:
+        if digest:
+            manifest.forget(digest)
+        index.remove(fileName)
+        print(f"    [附件] 下载失败: {fileName} ({e})")
+        return False
+    finally:
+        if tmp_file and os.path.exists(tmp_file):
+            os.remove(tmp_file)
+
+def format_date(date_header):
+    """把邮件 Date 头转换为 ISO 格式时间，无法解析时原样返回"""
+    if not date_header:
+        return None
+    try:
+        return email.utils.parsedate_to_datetime(date_header).isoformat()
+    except (TypeError, ValueError):
+        return date_header
+
+# --- IMAP 响应解析 ---
+_token_re = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|((?:[^\s()"\[\]]|\[[^\]]*\])+))', re.S)
+
+def _scan(data, tokens):
+    pos = 0
+    while pos < len(data):
+        m = _token_re.match(data, pos)
+        if not m or m.end() == pos:
+            break
+        pos = m.end()
+        if m.group(1):
+            tokens.append('(')
+        elif m.group(2):
+            tokens.append(')')
+        elif m.group(3) is not None:
+            tokens.append(re.sub(rb'\\(.)', rb'\1', m.group(3)))
+        elif m.group(4):
+            atom = m.group(4).decode('ascii', errors='replace')
+            tokens.append(None if atom.upper() == 'NIL' else atom)
+
+@metrics.timed('mail.decode')
+def parse_fetch_response(msg_data):
+    """
+    解析 imaplib 返回的 FETCH 响应
+
+    括号列表解析为 list，字符串和字面量解析为 bytes，原子解析为 str，NIL 解析为 None。
+
+    Returns:
+        list: 每封邮件一个 dict，例如 {'UID': '12', 'BODYSTRUCTURE': [...]}
+    """
+    tokens = []
+    for item in msg_data:
+        if isinstance(item, tuple):
+            head, literal = item
+            # 去掉末尾的 {n} 长度标记，字面量内容原样作为一个记号
+            _scan(head[:head.rindex(b'{')], tokens)
+            tokens.append(literal)
+        elif item:
+            _scan(item, tokens)
+
+    stack = [[]]
+    for tok in tokens:
+        if tok == '(':
+            stack.append([])
+        elif tok == ')':
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+        else:
+            stack[-1].append(tok)
+
+    results = []
+    for item in stack[0]:
+        if isinstance(item, list):
+            results.append({str(item[i]).upper(): item[i + 1] for i in range(0, len(item) - 1, 2)})
+    return results
+
+def _text(value):
+    """把 IMAP 字符串转换为 str (部分服务器会直接返回 8 位编码的原文)"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return value
+    try:
+        return value.decode("utf-8")
+    except UnicodeDecodeError:
+        return value.decode("gb18030", errors="replace")
+
+def _params(plist):
+    """把 ("name" "value" ...) 形式的参数列表解析为 dict (兼容 RFC2231 编码)"""
+    if not isinstance(plist, list):
+        return {}
+    pairs = [(_text(plist[i]).lower(), _text(plist[i + 1]) or '')
+             for i in range(0, len(plist) - 1, 2)]
+    decoded = email.utils.decode_params([('', '')] + pairs)[1:]
+    return {k: email.utils.unquote(email.utils.collapse_rfc2231_value(v)) for k, v in decoded}
+
+def walk_bodystructure(body, section=""):
+    """按 IMAP 段号遍历 BODYSTRUCTURE，产出 (段号, 单个部分的结构)"""
+    if body and isinstance(body[0], list):
+        # multipart: 子部分依次编号
+        index = 0
+        for child in body:
+            if isinstance(child, list):
+                index += 1
+                yield from walk_bodystructure(child, f"{section}.{index}" if section else str(index))
+        return
+
+    yield section or "1", body
+
+    # 转发的邮件 (message/rfc822) 也需要继续查找其中的附件
+    if _text(body[0]).lower() == 'message' and _text(body[1]).lower() == 'rfc822' and len(body) > 8:
+        inner = body[8]
+        if inner and isinstance(inner[0], list):
+            yield from walk_bodystructure(inner, section or "1")
+        elif inner:
+            yield from walk_bodystructure(inner, f"{section or '1'}.1")
+
+def get_part_filename(part):
+    """获取单个部分的附件文件名；没有 Content-Disposition 或文件名时返回 None"""
+    maintype = _text(part[0]).lower()
+    subtype = _text(part[1]).lower()
+    if maintype == 'text':
+        ext_start = 8
+    elif maintype == 'message' and subtype == 'rfc822':
+        ext_start = 10
+    else:
+        ext_start = 7
+
+    # 扩展数据: md5, disposition, language, location
+    if len(part) <= ext_start + 1 or not isinstance(part[ext_start + 1], list):
+        return None
+    disposition = part[ext_start + 1]
+
+    filename = _params(disposition[1] if len(disposition) > 1 else None).get('filename')
+    if not filename:
+        filename = _params(part[2]).get('name')
+    return filename or None
+
+class StreamDecoder:
+    """按 Content-Transfer-Encoding 分块解码，解码结果直接写入 out"""
+
+    def __init__(self, encoding, out):
+        self.encoding = (encoding or '').lower()
+        self.out = out
+        self.buffer = b''
+
+    @metrics.timed('mail.decode')
+    def feed(self, data):
+        if self.encoding == 'base64':
+            # 只保留 base64 字符，按 4 字节对齐解码，剩余部分留到下一块
+            data = self.buffer + re.sub(rb'[^A-Za-z0-9+/=]', b'', data)
+            cut = len(data) // 4 * 4
+            self.buffer = data[cut:]
+            if cut:
+                self.out.write(base64.b64decode(data[:cut]))
+        elif self.encoding == 'quoted-printable':
+            # 按整行解码，避免 "=XX" 或软换行被分块截断
+            data = self.buffer + data
+            cut = data.rfind(b'\n') + 1
+            self.buffer = data[cut:]
+            if cut:
+                self.out.write(quopri.decodestring(data[:cut]))
+        else:
+            self.out.write(data)
+
+    def close(self):
+        if self.buffer:
+            if self.encoding == 'base64':
+                self.out.write(base64.b64decode(self.buffer + b'=' * (-len(self.buffer) % 4)))
             else:
-                subject = "无主题"
-            
-            print(f"  主题: {subject}")
-
-            # --- 确定分类文件夹 ---
-            # 辅助函数：尝试从文本中提取分类
-            def get_category(text):
-                if not text:
-                    return None
-                
-                # 中文数字映射
-                cn_map = {'一': '1', '二': '2', '三': '3', '四': '4', '五': '5', 
-                          '六': '6', '七': '7', '八': '8', '九': '9', '十': '10'}
-                
-                def to_arabic(num_str):
-                    return cn_map.get(num_str, num_str)
-
-                # 辅助：判断是否为合理的作业编号 (避免匹配到学号)
-                def is_valid_num(num_str):
-                    # 如果是数字字符串，长度不应超过2位 (防止匹配到学号/年份)
-                    if num_str.isdigit():
-                        return len(num_str) <= 2
-                    return True
-
-                # 检查实验报告 (LAB)
-                # 1. 匹配 "第X次...实验" 格式 (允许中间有其他字符)
-                lab_match_1 = re.search(r'第\s*(\d+|[一二三四五六七八九十]+)\s*次.*?(?:实验|LAB|实践)', text, re.IGNORECASE)
-                if lab_match_1:
-                    return f"LAB{to_arabic(lab_match_1.group(1))}"
-                
-                # 2. 匹配 "实验报告1", "LAB 1", "实验作业2", "实验4" 等 (数字在后)
-                lab_match_2 = re.search(r'(?:实验报告|实验作业|实践|LAB|实验).*?(\d+|[一二三四五六七八九十]+)', text, re.IGNORECASE)
-                if lab_match_2 and is_valid_num(to_arabic(lab_match_2.group(1))):
-                    return f"LAB{to_arabic(lab_match_2.group(1))}"
-                
-                # 检查课堂作业
-                # 1. 匹配 "第X次...作业" 格式 (允许中间有其他字符)
-                class_match_1 = re.search(r'第\s*(\d+|[一二三四五六七八九十]+)\s*次.*?(?:课堂作业|作业)', text, re.IGNORECASE)
-                if class_match_1:
-                    return f"课堂作业{to_arabic(class_match_1.group(1))}"
-
-                # 2. 匹配 "课堂作业1", "作业 2" 等 (数字在后)
-                class_match_2 = re.search(r'(?:课堂作业|作业).*?(\d+|[一二三四五六七八九十]+)', text, re.IGNORECASE)
-                if class_match_2 and is_valid_num(to_arabic(class_match_2.group(1))):
-                    return f"课堂作业{to_arabic(class_match_2.group(1))}"
-                
+                self.out.write(quopri.decodestring(self.buffer))
+            self.buffer = b''
+
+def fetch_part(mail, email_id, section, encoding, out):
+    """
+    使用 BODY.PEEK[n]<offset.length> 分段下载单个附件段 (不会把邮件标记为已读)，
+    边下载边解码写入 out
+    """
+    decoder = StreamDecoder(encoding, out)
+    offset = 0
+    while True:
+        status, data = mail.uid('FETCH', email_id, f"(BODY.PEEK[{section}]<{offset}.{fetch_chunk_size}>)")
+        if status != 'OK':
+            raise RuntimeError(f"获取附件段 {section} 失败")
+        chunk = None
+        for response in parse_fetch_response(data):
+            for key, value in response.items():
+                if key.startswith('BODY['):
+                    chunk = value or b''
+        if chunk is None:
+            raise RuntimeError(f"服务器未返回附件段 {section}")
+
+        decoder.feed(chunk)
+        offset += len(chunk)
+        if len(chunk) < fetch_chunk_size:
+            break
+    decoder.close()
+
+@metrics.timed('mail.decode')
+def read_message_structure(mail, email_id):
+    """先获取 ENVELOPE/BODYSTRUCTURE，返回 (主题, 附件列表, 时间)；附件内容按需下载"""
+    status, msg_data = mail.uid('FETCH', email_id, "(ENVELOPE BODYSTRUCTURE)")
+    responses = parse_fetch_response(msg_data) if status == 'OK' else []
+    if not responses:
+        return None
+    return message_from_structure(mail, email_id, responses[0])
+
+@metrics.timed('mail.decode')
+def message_from_structure(mail, email_id, response):
+    """由一封邮件的 ENVELOPE/BODYSTRUCTURE 响应得到 (主题, 附件列表, 时间)；附件内容之后通过 mail 按需下载"""
+    if 'BODYSTRUCTURE' not in response:
+        return None
+
+    envelope = response.get('ENVELOPE') or []
+    subject = decode_subject(_text(envelope[1]) if len(envelope) > 1 else None)
+    date = format_date(_text(envelope[0]) if envelope else None)
+
+    attachments = []
+    for section, part in walk_bodystructure(response['BODYSTRUCTURE']):
+        if isinstance(part[0], list):
+            continue
+        fileName = get_part_filename(part)
+        if not fileName:
+            continue
+        encoding = _text(part[5]) if len(part) > 5 else None
+        load = lambda out, s=section, enc=encoding: fetch_part(mail, email_id, s, enc, out)
+        attachments.append((fileName, load))
+
+    return subject, attachments, date
+
+@metrics.timed('mail.decode')
+def read_message_full(mail, email_id, cache=None):
+    """整封下载邮件 (RFC822)，返回 (主题, 附件列表, 时间)；传入 cache 时同时保存原始邮件"""
+    status, msg_data = mail.uid('FETCH', email_id, "(RFC822)")
+
+    for response_part in msg_data:
+        if isinstance(response_part, tuple):
+            if cache is not None:
+                cache.put(email_id, response_part[1])
+            return message_from_bytes(response_part[1])
+
+    return None
+
+@metrics.timed('mail.decode')
+def message_from_bytes(raw):
+    """解析整封邮件，返回 (主题, 附件列表, 时间)"""
+    msg = email.message_from_bytes(raw)
+    subject = decode_subject(msg["Subject"])
+
+    attachments = []
+    for part in msg.walk():
+        if part.get_content_maintype() == 'multipart':
+            continue
+        if part.get('Content-Disposition') is None:
+            continue
+        fileName = part.get_filename()
+        if bool(fileName):
+            attachments.append((fileName, lambda out, p=part: out.write(p.get_payload(decode=True))))
+    return subject, attachments, format_date(msg["Date"])
+
+def read_message(mail, email_id, cache=None):
+    """按 fetch_mode 读取一封邮件，返回 (主题, 附件列表, 时间)；有原始邮件缓存时先查缓存，并总是整封下载"""
+    if cache is not None:
+        raw = cache.get(email_id)
+        if raw is not None:
+            return message_from_bytes(raw)
+    message = None
+    if fetch_mode == "structure" and cache is None:
+        try:
+            message = read_message_structure(mail, email_id)
+        except Exception as e:
+            print(f"  [UID {email_id.decode()}] 解析邮件结构失败，改为整封下载 ({e})")
+    if message is None:
+        message = read_message_full(mail, email_id, cache)
+    return message
+
+# --- 原始邮件缓存 ---
+
+class RawCache:
+    """
+    原始邮件缓存: 每封邮件用 gzip 压缩保存为 <raw_cache_dir>/<邮箱>/<UIDVALIDITY>/<UID>.eml.gz
+
+    UID 只在同一个 UIDVALIDITY 下指向同一封邮件，因此按 UIDVALIDITY 分目录。
+    每封邮件一个文件，先写临时文件再替换，多个下载线程可以同时写入。
+    """
+
+    def __init__(self, root, box, uidvalidity):
+        self.path = os.path.join(root, safe_name(box), str(uidvalidity))
+
+    @classmethod
+    def latest(cls, root, box, uidvalidity=None):
+        """离线使用: 取指定的 UIDVALIDITY，未指定时取最近写入的目录；没有缓存时返回 None"""
+        box_dir = os.path.join(root, safe_name(box))
+        if uidvalidity is None:
+            try:
+                dirs = [d for d in os.listdir(box_dir) if os.path.isdir(os.path.join(box_dir, d))]
+            except OSError:
                 return None
+            if not dirs:
+                return None
+            uidvalidity = max(dirs, key=lambda d: os.path.getmtime(os.path.join(box_dir, d)))
+        cache = cls(root, box, uidvalidity)
+        return cache if os.path.isdir(cache.path) else None
 
-            folder_from_subject = get_category(subject)
+    def file(self, email_id):
+        return os.path.join(self.path, f"{int(email_id)}.eml.gz")
 
-            # --- 遍历查找并下载附件 ---
-            attachment_count = 0
-            for part in msg.walk():
-                if part.get_content_maintype() == 'multipart':
-                    continue
-                if part.get('Content-Disposition') is None:
-                    continue
-                
-                fileName = part.get_filename()
-                if bool(fileName):
-                    attachment_count += 1
-                    # 解析文件名
-                    decoded_list = decode_header(fileName)
-                    fname_bytes, encoding = decoded_list[0]
-                    
-                    if isinstance(fname_bytes, bytes):
+    def get(self, email_id):
+        try:
+            with open(self.file(email_id), 'rb') as f:
+                return gzip.decompress(f.read())
+        except (OSError, EOFError):
+            return None
+
+    def put(self, email_id, raw):
+        """保存一封邮件 (失败时只给出警告，不影响下载)"""
+        path = self.file(email_id)
+        try:
+            os.makedirs(self.path, exist_ok=True)
+            tmp_file = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_file, 'wb') as f:
+                f.write(gzip.compress(raw, compresslevel=6, mtime=0))
+            os.replace(tmp_file, path)
+        except OSError as e:
+            print(f"  [警告] 缓存原始邮件失败 (UID {int(email_id)}): {e}")
+
+    def uids(self):
+        """缓存中的所有 UID (从小到大)"""
+        try:
+            names = os.listdir(self.path)
+        except OSError:
+            return []
+        return sorted(int(n[:-len(".eml.gz")]) for n in names if n.endswith(".eml.gz") and n[:-len(".eml.gz")].isdigit())
+
+# --- 批量获取 ---
+
+# 以 {n} 结尾的响应行: 后面紧跟 n 字节的字面量
+_literal_re = re.compile(rb'\{(\d+)\}\r?\n?$')
+_fetch_line_re = re.compile(rb'\* \d+ FETCH ', re.I)
+
+def uid_set(uids):
+    """把 UID 列表压缩为 IMAP 集合，连续的 UID 合并为范围: [5, 6, 7, 9] -> 5:7,9"""
+    ranges = []
+    for uid in sorted(int(u) for u in uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(lo) if lo == hi else f"{lo}:{hi}" for lo, hi in ranges)
+
+def stream_fetch(conn, uids, items):
+    """
+    在一个连接上发送一条 UID FETCH 命令，边接收边解析: 每读完一封邮件的响应就产出，
+    不等待整个命令结束 (imaplib 会先把整批响应读入内存)
+
+    Yields:
+        tuple: (一封邮件的 FETCH 响应 (格式同 parse_fetch_response)，该响应的字节数)
+    """
+    tag = conn._new_tag()
+    conn.send(tag + b' UID FETCH ' + uid_set(uids).encode('ascii') + b' ' + items.encode('ascii') + b'\r\n')
+    try:
+        while True:
+            line = conn.readline()
+            if not line:
+                raise imaplib.IMAP4.abort("连接已被服务器关闭")
+            if line.startswith(tag + b' '):
+                if not line[len(tag) + 1:].upper().startswith(b'OK'):
+                    raise imaplib.IMAP4.error(f"UID FETCH 失败: {line.strip().decode(errors='replace')}")
+                return
+
+            # 与 imaplib 相同的格式: 含字面量的部分为 (前面的内容, 字面量)，其余为 bytes
+            parts = []
+            size = len(line)
+            while True:
+                m = _literal_re.search(line)
+                if not m:
+                    parts.append(line.rstrip(b'\r\n'))
+                    break
+                literal = conn.read(int(m.group(1)))
+                parts.append((line.rstrip(b'\r\n'), literal))
+                line = conn.readline()
+                if not line:
+                    raise imaplib.IMAP4.abort("连接已被服务器关闭")
+                size += len(literal) + len(line)
+
+            # 其他未标记的响应 (如 EXISTS) 忽略
+            if _fetch_line_re.match(parts[0][0] if isinstance(parts[0], tuple) else parts[0]):
+                for response in parse_fetch_response(parts):
+                    yield response, size
+    finally:
+        conn.tagged_commands.pop(tag, None)
+
+class BatchSizer:
+    """
+    决定每批获取的邮件数: 按目前为止每封邮件的平均响应大小，使每批约 target_bytes 字节，
+    不超过 limit 封；还没有数据时先取一小批估计大小
+    """
+
+    def __init__(self, limit, target_bytes, initial=10):
+        self.limit = max(1, limit)
+        self.target_bytes = target_bytes
+        self.initial = initial
+        self.messages = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def record(self, messages, nbytes):
+        with self.lock:
+            self.messages += messages
+            self.bytes += nbytes
+
+    def next_size(self):
+        with self.lock:
+            if not self.messages:
+                return min(self.limit, self.initial)
+            per_message = self.bytes / self.messages
+        return max(1, min(self.limit, int(self.target_bytes / max(per_message, 1))))
+
+def iter_batches(target_ids, sizer):
+    """按顺序把 target_ids 切分为批，每取一批时才按 sizer 当前的估计决定批量"""
+    pos = 0
+    while pos < len(target_ids):
+        size = sizer.next_size()
+        yield target_ids[pos:pos + size]
+        pos += size
+
+def read_batch(pool, uids, sizer=None, cache=None):
+    """
+    用一条 UID FETCH 命令读取一批邮件
+
+    structure 模式获取 ENVELOPE/BODYSTRUCTURE (结构无法解析的邮件单独整封下载)，full 模式直接整批获取 RFC822。
+    有原始邮件缓存时，已缓存的邮件不再请求服务器，其余的整封获取并存入缓存。
+    整批获取失败时退回逐封读取。
+
+    Returns:
+        tuple: ({UID: (主题, 附件列表, 时间)}, {UID: 读取失败的异常})；批量响应中缺少的邮件会单独重新获取，
+               仍然读不到 (如已被删除) 时记为读取失败
+    """
+    raws = {}
+    if cache is not None:
+        for email_id in uids:
+            raw = cache.get(email_id)
+            if raw is not None:
+                raws[email_id] = raw
+    to_fetch = [email_id for email_id in uids if email_id not in raws]
+
+    responses = {}
+    if to_fetch:
+        full = cache is not None or fetch_mode != "structure"
+        items = "(UID RFC822)" if full else "(UID ENVELOPE BODYSTRUCTURE)"
+        try:
+            responses, nbytes = pool.fetch(to_fetch, items)
+        except Exception as e:
+            if len(to_fetch) > 1:
+                print(f"  批量获取 {len(to_fetch)} 封邮件失败，改为逐封获取 ({e})")
+            messages, errors = {}, {}
+            for email_id in uids:
+                try:
+                    messages[email_id] = _read_single(pool, email_id, cache)
+                except Exception as e:
+                    errors[email_id] = e
+            return messages, errors
+        if sizer is not None:
+            sizer.record(len(to_fetch), nbytes)
+
+    messages, errors = {}, {}
+    for email_id in uids:
+        try:
+            if email_id in raws:
+                messages[email_id] = message_from_bytes(raws[email_id])
+                continue
+            response = responses.get(email_id)
+            if response is not None and response.get('RFC822') is not None:
+                if cache is not None:
+                    cache.put(email_id, response['RFC822'])
+                messages[email_id] = message_from_bytes(response['RFC822'])
+            elif response is not None and 'BODYSTRUCTURE' in response:
+                message = None
+                try:
+                    message = message_from_structure(pool, email_id, response)
+                except Exception as e:
+                    print(f"  [UID {email_id.decode()}] 解析邮件结构失败，改为整封下载 ({e})")
+                messages[email_id] = message or _read_single(pool, email_id, cache)
+            else:
+                # 批量响应中没有这封邮件 (或缺少需要的数据)，单独再读一次；仍然读不到时记为失败，
+                # 不能悄悄跳过: 否则同步状态会越过这封邮件，以后再也不会下载
+                print(f"  [UID {email_id.decode()}] 批量获取的响应中没有该邮件，单独重新获取")
+                messages[email_id] = _read_single(pool, email_id, cache)
+        except Exception as e:
+            errors[email_id] = e
+    return messages, errors
+
+def _read_single(pool, email_id, cache=None):
+    """逐封读取 (见 read_message)，服务器没有返回该邮件时抛出异常"""
+    message = read_message(pool, email_id, cache)
+    if message is None:
+        raise imaplib.IMAP4.error(f"服务器没有返回 UID {email_id.decode()} 的邮件")
+    return message
+
+class ConnectionPool:
+    """
+    已登录的 IMAP 连接池，最多同时打开 size 个连接
+
+    提供与 IMAP4 相同的 uid() 方法，每次调用时借出一个空闲连接，
+    因此 read_message / fetch_part 等函数可以直接传入连接池使用。
+    """
+
+    def __init__(self, size):
+        self.size = max(1, size)
+        self._idle = deque()
+        # 保护 _idle 和 _opened；归还或丢弃连接时唤醒等待的线程
+        self._cond = threading.Condition()
+        self._opened = []
+
+    def _connect(self):
+        if IMAP_SSL:
+            conn = imaplib.IMAP4_SSL(IMAP_HOST, IMAP_PORT or imaplib.IMAP4_SSL_PORT)
+        else:
+            conn = imaplib.IMAP4(IMAP_HOST, IMAP_PORT or imaplib.IMAP4_PORT)
+        conn.login(EMAIL_ACCOUNT, EMAIL_PASSWORD)
+        conn.select(mailbox)
+        return conn
+
+    def acquire(self):
+        with self._cond:
+            while not self._idle and len(self._opened) >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.popleft()
+            self._opened.append(None) # 先占位，避免并发时超出上限
+
+        try:
+            conn = self._connect()
+        except BaseException:
+            with self._cond:
+                self._opened.remove(None)
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._opened[self._opened.index(None)] = conn
+        return conn
+
+    def release(self, conn):
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def discard(self, conn):
+        """丢弃已断开的连接，之后会按需重新建立"""
+        with self._cond:
+            if conn in self._opened:
+                self._opened.remove(conn)
+            self._cond.notify() # 腾出了名额，等待的线程可以新建连接
+        try:
+            conn.shutdown()
+        except Exception:
+            pass
+
+    @metrics.timed('mail.fetch')
+    def uid(self, *args):
+        conn = self.acquire()
+        try:
+            result = conn.uid(*args)
+        except (imaplib.IMAP4.abort, OSError):
+            self.discard(conn)
+            raise
+        except imaplib.IMAP4.error:
+            self.release(conn) # 服务器拒绝了命令，连接仍可用
+            raise
+        except BaseException:
+            self.discard(conn) # 响应没有读完，连接的状态未知
+            raise
+        self.release(conn)
+        if metrics.enabled():
+            metrics.count('mail.fetch_bytes', sum(len(item[1]) for item in result[1] or () if isinstance(item, tuple)))
+        return result
+
+    @metrics.timed('mail.fetch')
+    def fetch(self, uids, items):
+        """
+        借出一个连接，用一条 UID FETCH 命令获取一批邮件 (见 stream_fetch)
+
+        Returns:
+            tuple: ({UID (bytes): FETCH 响应}, 响应的总字节数)
+        """
+        conn = self.acquire()
+        wanted = set(uids)
+        responses = {}
+        nbytes = 0
+        try:
+            for response, size in stream_fetch(conn, uids, items):
+                nbytes += size
+                uid = response.get('UID')
+                if uid is not None and uid.encode() in wanted:
+                    responses[uid.encode()] = response
+        except imaplib.IMAP4.abort:
+            self.discard(conn)
+            raise
+        except imaplib.IMAP4.error:
+            self.release(conn) # 服务器拒绝了命令，响应已读完，连接仍可用
+            raise
+        except BaseException:
+            self.discard(conn) # 响应没有读完，连接的状态未知
+            raise
+        self.release(conn)
+        metrics.count('mail.fetch_bytes', nbytes)
+        return responses, nbytes
+
+    def refresh(self):
+        """检查空闲连接是否仍然可用 (长时间闲置后服务器可能已断开)，丢弃失效的连接"""
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn in idle:
+            try:
+                conn.noop()
+            except Exception:
+                self.discard(conn)
+            else:
+                self.release(conn)
+
+    def close(self):
+        with self._cond:
+            conns = [c for c in self._opened if c is not None]
+            self._opened = []
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in conns:
+            try:
+                conn.close()
+                conn.logout()
+            except Exception:
+                pass
+
+def run_pipeline(pool, target_ids, cache=None):
+    """
+    并发处理一批邮件
+
+    1. 读取阶段: 按批获取邮件结构，每批一条 UID FETCH 命令 (批量见 BatchSizer)，
+       多个连接同时获取不同的批 (最多提前 max_connections * 2 批，控制内存)
+    2. 决策阶段: 按 target_ids 的顺序 (最新优先) 在当前线程依次分类、重命名、去重，
+       保证去重判断是串行的，结果与逐封处理一致
+    3. 下载阶段: 需要保存的附件交给下载线程并发获取并写入
+
+    Args:
+        cache (RawCache): 原始邮件缓存，为 None 时不缓存
+
+    Returns:
+        int: 读取或附件保存失败的邮件数
+    """
+    failed = set()
+    workers = pool.size
+    sizer = BatchSizer(fetch_batch_size, fetch_batch_bytes)
+    with ThreadPoolExecutor(max_workers=workers) as readers, \
+         ThreadPoolExecutor(max_workers=workers) as downloaders:
+        window = deque()
+        batches = iter_batches(target_ids, sizer)
+        for uids in batches:
+            window.append((uids, readers.submit(read_batch, pool, uids, sizer, cache)))
+            if len(window) >= workers * 2:
+                break
+
+        indexes = build_folder_indexes()
+        manifest = Manifest(manifest_file)
+        downloads = []
+        i = 0
+        while window:
+            uids, future = window.popleft()
+            next_uids = next(batches, None)
+            if next_uids is not None:
+                window.append((next_uids, readers.submit(read_batch, pool, next_uids, sizer, cache)))
+
+            messages, errors = future.result()
+            for email_id in uids:
+                i += 1
+                print(f"正在读取第 {i} 封邮件 (UID: {email_id.decode()})...")
+                metrics.count('mail.messages')
+                if email_id in errors:
+                    failed.add(email_id)
+                    metrics.count('mail.failures')
+                    print(f"  读取邮件失败: {errors[email_id]}")
+
+                message = messages.get(email_id)
+                if message:
+                    subject, attachments, date = message
+                    for task in plan_message(subject, attachments, indexes):
+                        downloads.append((email_id, downloaders.submit(save_attachment, *task, manifest,
+                                                                       uid=email_id.decode(), date=date)))
+
+                print("-" * 30)
+
+        for email_id, future in downloads:
+            if not future.result() and email_id not in failed:
+                failed.add(email_id)
+                metrics.count('mail.failures')
+
+    manifest.save()
+    return len(failed)
+
+# --- 离线重新处理: 用原始邮件缓存重建 downloads ---
+
+def _init_reprocess_worker():
+    metrics.drain() # 丢弃 fork 时从父进程继承的统计
+
+def _parse_cached(path):
+    """
+    子进程: 解析一封缓存的邮件并解码其中的所有附件
+
+    Returns:
+        tuple: ((主题, [(原始文件名, 附件内容), ...], 时间) 或错误信息, 性能统计)
+    """
+    try:
+        with open(path, 'rb') as f:
+            raw = gzip.decompress(f.read())
+        subject, attachments, date = message_from_bytes(raw)
+        payloads = []
+        for name, load_payload in attachments:
+            buf = io.BytesIO()
+            with metrics.stage('mail.decode'):
+                load_payload(buf)
+            payloads.append((name, buf.getvalue()))
+        parsed = (subject, payloads, date)
+    except Exception as e:
+        parsed = str(e)
+    return parsed, metrics.drain() if metrics.enabled() else None
+
+def cached_coverage_gaps(cache, uids):
+    """
+    下载目录中现有文件 (按内容清单记录的邮件 UID) 对应、但不在缓存中的邮件
+
+    Returns:
+        list: 缺失的 UID (从小到大)
+    """
+    if not os.path.exists(manifest_file):
+        return []
+    cached = set(uids)
+    missing = set()
+    for blob in Manifest(manifest_file).blobs.values():
+        uid = blob.get('uid')
+        if uid is None or not str(uid).isdigit() or int(uid) in cached:
+            continue
+        if os.path.exists(os.path.join(download_dir, blob['path'])):
+            missing.add(int(uid))
+    return sorted(missing)
+
+def copy_hidden_files(src_dir, dst_dir, skip=()):
+    """复制目录中的隐藏文件 (不包括下载中的 .part 临时文件)"""
+    for name in os.listdir(src_dir):
+        src = os.path.join(src_dir, name)
+        if name.startswith('.') and name not in skip and not name.endswith('.part') and os.path.isfile(src):
+            shutil.copy2(src, os.path.join(dst_dir, name))
+
+def reprocess(workers=None):
+    """
+    离线重新处理: 不连接邮箱，对原始邮件缓存中的所有邮件重新执行 分类 -> 重命名 -> 格式过滤 -> 去重 -> 保存，
+    重建 downloads (修改了 get_category、重命名或去重规则后使用)
+
+    邮件的解压、解析和附件解码在多个进程中并行进行 (最多提前 workers * 4 封，控制内存)；
+    分类、去重和保存按与同步时相同的顺序 (最新邮件优先) 在当前进程中依次进行，同一份缓存总是得到相同的结果。
+    结果先写入临时目录 <downloads>.reprocess，完成后替换 downloads，原目录保留为 <downloads>.bak。
+    downloads 中有来自未缓存邮件的文件时拒绝执行 (见 cached_coverage_gaps)；
+    有邮件解析或保存失败时不替换 downloads。
+
+    Args:
+        workers (int): 进程数 (默认 CPU 核数)
+
+    Returns:
+        dict: {'messages': 处理的邮件数, 'failures': 解析或保存失败的邮件数, 'failed_uids': 失败的 UID,
+               'applied': 是否已替换 downloads}；没有缓存或缓存不完整时返回 None
+    """
+    global download_dir
+    box_state = load_sync_state().get(mailbox, {})
+    cache = RawCache.latest(raw_cache_dir, mailbox, box_state.get('uidvalidity')) if raw_cache_dir else None
+    uids = cache.uids() if cache else []
+    if not uids:
+        print(f"原始邮件缓存 {raw_cache_dir or '(未开启)'} 中没有邮件，请先运行一次同步 (sync)。")
+        return None
+
+    # 下载目录中来自缓存之外的邮件的文件 (开启缓存之前同步的邮件) 重建后会丢失
+    missing = cached_coverage_gaps(cache, uids)
+    if missing:
+        print(f"原始邮件缓存不完整: downloads 中有 {len(missing)} 封邮件 (如 UID {', '.join(map(str, missing[:5]))}) "
+              f"的附件不在缓存 {cache.path} 中，重新处理会丢失这些文件，已取消。")
+        print("请保持 raw_cache_dir 开启，运行一次 sync --full-resync 把这些邮件补充到缓存后再试。")
+        return None
+
+    final_dir = download_dir
+    staging = final_dir.rstrip(os.sep) + ".reprocess"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    print(f"从缓存 {cache.path} 重新处理 {len(uids)} 封邮件 -> {staging}\n")
+
+    workers = workers or os.cpu_count() or 1
+    failed = []
+    download_dir = staging
+    try:
+        indexes = build_folder_indexes()
+        manifest = Manifest(os.path.join(staging, ".manifest.json"))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_reprocess_worker) as executor:
+            window = deque()
+            ids = reversed(uids) # 最新优先，与同步时的顺序相同
+            for uid in ids:
+                window.append((uid, executor.submit(_parse_cached, cache.file(uid))))
+                if len(window) >= workers * 4:
+                    break
+
+            i = 0
+            while window:
+                uid, future = window.popleft()
+                next_uid = next(ids, None)
+                if next_uid is not None:
+                    window.append((next_uid, executor.submit(_parse_cached, cache.file(next_uid))))
+
+                i += 1
+                print(f"正在处理第 {i} 封邮件 (UID: {uid})...")
+                metrics.count('mail.messages')
+                parsed, stats = future.result()
+                metrics.merge(stats)
+                if isinstance(parsed, str):
+                    failed.append(uid)
+                    metrics.count('mail.failures')
+                    print(f"  解析邮件失败: {parsed}")
+                else:
+                    subject, payloads, date = parsed
+                    attachments = [(name, lambda out, data=data: out.write(data)) for name, data in payloads]
+                    saved = [save_attachment(*task, manifest, uid=str(uid), date=date)
+                             for task in plan_message(subject, attachments, indexes)]
+                    if not all(saved):
+                        failed.append(uid)
+                        metrics.count('mail.failures')
+                print("-" * 30)
+        manifest.save()
+    finally:
+        download_dir = final_dir
+
+    # 有邮件处理失败时不替换: 这些邮件的附件会从 downloads 中消失 (只留在下次就会被覆盖的 .bak 中)
+    if failed:
+        failed.sort()
+        print(f"有 {len(failed)} 封缓存的邮件处理失败 (UID: {', '.join(map(str, failed))})，"
+              f"下载目录保持不变，重新处理的结果留在 {staging} 中供检查。")
+        return {'messages': len(uids), 'failures': len(failed), 'failed_uids': failed, 'applied': False}
+
+    # 保留下载目录中的同步状态、各分类的检查快照等隐藏文件 (内容清单已重新生成)
+    if os.path.isdir(final_dir):
+        copy_hidden_files(final_dir, staging, skip={os.path.basename(manifest_file)})
+        for name in os.listdir(final_dir):
+            src = os.path.join(final_dir, name)
+            if not name.startswith('.') and os.path.isdir(src) and os.path.isdir(os.path.join(staging, name)):
+                copy_hidden_files(src, os.path.join(staging, name))
+        backup = final_dir.rstrip(os.sep) + ".bak"
+        shutil.rmtree(backup, ignore_errors=True)
+        os.replace(final_dir, backup)
+        print(f"原下载目录已保留为: {backup}")
+    os.replace(staging, final_dir)
+    print(f"重新处理完成: {len(uids)} 封邮件，结果已保存到 {final_dir}")
+    return {'messages': len(uids), 'failures': 0, 'failed_uids': [], 'applied': True}
+
+# --- 监听模式: 保持一个已登录的连接，用 IDLE (不支持时轮询) 等待新邮件 ---
+
+# IDLE 期间服务器通知新邮件的响应
+_new_mail_re = re.compile(rb'\* \d+ (?:EXISTS|RECENT)', re.I)
+
+def _read_line(sock, buf, timeout):
+    """
+    直接从 socket 读取一行 (IDLE 期间不经过 imaplib 的缓冲，才能按超时等待)
+
+    Returns:
+        tuple: (一行数据，超时时为 None, 剩余缓冲)
+    """
+    deadline = time.monotonic() + timeout
+    while b'\n' not in buf:
+        # SSL 连接中已解密但未读取的数据不会让 select 返回，需要先检查 pending()
+        if not (hasattr(sock, 'pending') and sock.pending()):
+            remaining = max(0, deadline - time.monotonic())
+            ready, _, _ = select.select([sock], [], [], remaining)
+            if not ready:
+                return None, buf
+        data = sock.recv(65536)
+        if not data:
+            raise imaplib.IMAP4.abort("连接已被服务器关闭")
+        buf += data
+    line, _, buf = buf.partition(b'\n')
+    return line + b'\n', buf
+
+def idle_wait(conn, timeout):
+    """
+    在连接上执行 IDLE，直到服务器通知有新邮件或超过 timeout 秒
+
+    Returns:
+        bool: 是否收到新邮件通知
+    """
+    tag = conn._new_tag()
+    conn.send(tag + b' IDLE\r\n')
+    sock = conn.socket()
+    buf = b''
+    changed = False
+
+    # 等待服务器的继续响应 "+ idling"
+    while True:
+        line, buf = _read_line(sock, buf, 30)
+        if line is None:
+            raise imaplib.IMAP4.abort("IDLE 无响应")
+        if line.startswith(b'+'):
+            break
+        if line.startswith(tag + b' '):
+            raise imaplib.IMAP4.error(f"服务器拒绝 IDLE: {line.strip().decode(errors='replace')}")
+        if _new_mail_re.match(line):
+            changed = True
+
+    deadline = time.monotonic() + timeout
+    while not changed:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        line, buf = _read_line(sock, buf, remaining)
+        if line is None:
+            break
+        if _new_mail_re.match(line):
+            changed = True
+
+    # 结束 IDLE，读取到该命令的结束响应为止
+    conn.send(b'DONE\r\n')
+    while True:
+        line, buf = _read_line(sock, buf, 30)
+        if line is None:
+            raise imaplib.IMAP4.abort("结束 IDLE 时无响应")
+        if _new_mail_re.match(line):
+            changed = True
+        if line.startswith(tag + b' '):
+            if not line[len(tag) + 1:].upper().startswith(b'OK'):
+                raise imaplib.IMAP4.error(f"IDLE 失败: {line.strip().decode(errors='replace')}")
+            break
+    return changed
+
+def watch(idle_timeout=600, poll_interval=60, max_backoff=300):
+    """
+    监听模式: 持续运行，收到新邮件后立即按正常流程 (分类、重命名、去重、保存) 处理新到的 UID
+
+    服务器支持 IDLE 时在一个已登录的连接上等待通知 (每 idle_timeout 秒重新进入 IDLE，
+    避免被服务器当作闲置连接断开)；不支持时每 poll_interval 秒检查一次。
+    连接断开后按 1, 2, 4 ... 秒 (最多 max_backoff 秒) 的间隔重新连接。按 Ctrl+C 退出。
+    """
+    if not EMAIL_ACCOUNT or not EMAIL_PASSWORD:
+        main() # 输出未配置的提示
+        return
+
+    pool = None
+    backoff = 1
+    use_idle = True
+    try:
+        while True:
+            try:
+                if pool is None:
+                    pool = ConnectionPool(max_connections)
+                    main(pool) # 先处理离线期间到达的邮件
+                    backoff = 1
+                    print(f"\n正在监听新邮件 (按 Ctrl+C 退出)...")
+
+                conn = pool.acquire()
+                try:
+                    if use_idle and 'IDLE' in conn.capabilities:
                         try:
-                            fileName = fname_bytes.decode(encoding if encoding else "utf-8")
-                        except (UnicodeDecodeError, LookupError):
-                            try:
-                                fileName = fname_bytes.decode("gbk")
-                            except UnicodeDecodeError:
-                                fileName = fname_bytes.decode("gb18030", errors="replace")
-                    
-                    # 处理文件名中的非法字符 (防止路径错误)
-                    fileName = "".join([c for c in fileName if c not in r'\/:*?"<>|'])
-
-                    # --- 优先基于原始文件名提取分类 (避免重命名引入主题中的混淆信息) ---
-                    folder_from_file = get_category(fileName)
-
-                    # --- 尝试修复无意义的文件名 ---
-                    # 如果文件名看起来像哈希值(例如QQ截图生成的)或通用名称，且主题包含有效信息，则尝试用主题重命名
-                    name_root, name_ext = os.path.splitext(fileName)
-                    # 匹配 16位以上纯十六进制/数字字母组合，或 image/screenshot/wx_camera/新建 开头
-                    is_garbage_name = re.match(r'^([a-fA-F0-9]{16,}|image|screenshot|wx_camera|新建|IMG|IMAGE)', name_root, re.IGNORECASE)
-                    
-                    if is_garbage_name and subject and subject != "无主题":
-                        safe_subject = "".join([c for c in subject if c not in r'\/:*?"<>|'])
-                        if safe_subject:
-                            new_fileName = f"{safe_subject}{name_ext}"
-                            print(f"    [重命名] 检测到无意义文件名，已重命名: {fileName} -> {new_fileName}")
-                            fileName = new_fileName
-                    
-                    # --- 补充信息：如果文件名缺失关键信息（如学号），尝试用主题补全 ---
-                    # 提取主题中的学号 (8位以上数字)
-                    subj_id_match = re.search(r'\d{8,}', subject)
-                    subj_id = subj_id_match.group(0) if subj_id_match else None
-                    
-                    should_rename = False
-                    # 情况1: 主题包含学号，但文件名不包含
-                    if subj_id and subj_id not in fileName:
-                        should_rename = True
-                    # 情况2: 文件名是通用名称 (如 "第二次作业.docx") 且不包含长数字
-                    elif not re.search(r'\d{8,}', fileName):
-                        if re.search(r'(?:作业|实验|报告|文档|DOCX|PDF)', fileName, re.IGNORECASE):
-                             should_rename = True
-
-                    if should_rename and subject and subject != "无主题":
-                        safe_subject = "".join([c for c in subject if c not in r'\/:*?"<>|'])
-                        # 避免重复：如果文件名已经是主题的一部分，或者主题包含文件名，需谨慎
-                        if safe_subject not in fileName: 
-                             new_fileName = f"{safe_subject}_{fileName}"
-                             print(f"    [重命名] 补充身份信息: {fileName} -> {new_fileName}")
-                             fileName = new_fileName
-
-                    # --- 检查文件扩展名 ---
-                    # 只允许 pdf, doc, docx, jpg, png， txt
-                    allowed_extensions = ('.pdf', '.doc', '.docx', '.jpg', '.png', '.txt')
-                    if not fileName.lower().endswith(allowed_extensions):
-                        print(f"    [跳过] 不支持的文件格式: {fileName}")
-                        continue
-
-                    # --- 智能分类逻辑 ---
-                    # folder_from_file 已经在重命名之前计算过了
-                    
-                    target_folder = "tmp" # 默认存入 tmp (有疑问/未分类)
-                    
-                    if folder_from_subject and folder_from_file:
-                        if folder_from_subject == folder_from_file:
-                            target_folder = folder_from_subject
-                        else:
-                            # 冲突：主题和文件名分类不一致 -> 优先根据文件名进行分类
-                            print(f"    [警告] 分类冲突: 主题({folder_from_subject}) vs 文件名({folder_from_file}) -> 优先使用文件名")
-                            target_folder = folder_from_file
-                    elif folder_from_subject:
-                        target_folder = folder_from_subject
-                    elif folder_from_file:
-                        target_folder = folder_from_file
+                            changed = idle_wait(conn, idle_timeout)
+                        except imaplib.IMAP4.abort:
+                            raise
+                        except imaplib.IMAP4.error as e:
+                            print(f"{e}，改为每 {poll_interval} 秒检查一次新邮件。")
+                            use_idle = False
+                            changed = False
                     else:
-                        # 均未匹配到分类 -> 存入 tmp
-                        target_folder = "tmp"
-                    
-                    # 创建分类目录
-                    target_dir = os.path.join(download_dir, target_folder)
-                    if not os.path.exists(target_dir):
-                        os.makedirs(target_dir)
-                    
-                    # 下载附件
-                    filepath = os.path.join(target_dir, fileName)
-
-                    # --- 智能去重逻辑 (学号 > 姓名) ---
-                    # 定义提取信息的辅助函数
-                    def extract_student_info(text):
-                        # 1. 提取学号 (8位以上数字)
-                        id_match = re.search(r'\d{8,}', text)
-                        s_id = id_match.group(0) if id_match else None
-                        
-                        # 2. 提取姓名 (2-4个中文字符)
-                        # 先移除常见的干扰词
-                        clean_text = re.sub(r'实验|作业|报告|课堂|文档|提交|修改|版|第|次|LAB|Homework|[0-9a-zA-Z\._\-\(\)\s]', '', text, flags=re.IGNORECASE)
-                        name_match = re.search(r'[\u4e00-\u9fa5]{2,4}', clean_text)
-                        s_name = name_match.group(0) if name_match else None
-                        return s_id, s_name
-
-                    current_id, current_name = extract_student_info(fileName)
-                    
-                    is_duplicate = False
-                    if os.path.exists(target_dir):
-                        for existing_file in os.listdir(target_dir):
-                            # 忽略非文件
-                            if not os.path.isfile(os.path.join(target_dir, existing_file)):
-                                continue
-                                
-                            # 如果完全同名，肯定是重复
-                            if existing_file == fileName:
-                                is_duplicate = True
-                                print(f"    [跳过] 文件已存在: {fileName}")
-                                break
-                            
-                            ex_id, ex_name = extract_student_info(existing_file)
-                            
-                            # 规则1: 学号匹配 (最准确)
-                            if current_id and ex_id and current_id == ex_id:
-                                is_duplicate = True
-                                print(f"    [跳过] 已存在该学号({current_id})的较新版本: {existing_file}")
-                                break
-                            
-                            # 规则2: 姓名匹配 (作为兜底，但需防止同名不同人)
-                            # 只有当无法通过学号区分时(比如其中一个没写学号)，才使用姓名判断
-                            # 如果两人都有学号且不相等，则不是同一个人，即使姓名相同
-                            if current_name and ex_name and current_name == ex_name:
-                                if current_id and ex_id and current_id != ex_id:
-                                    continue # 同名不同人，不跳过
-                                
-                                is_duplicate = True
-                                print(f"    [跳过] 已存在该姓名({current_name})的较新版本: {existing_file}")
-                                break
-                    
-                    if is_duplicate:
-                        continue
-                    # ------------------------------------
-
-                    try:
-                        with open(filepath, "wb") as f:
-                            f.write(part.get_payload(decode=True))
-                        print(f"    [附件] 已下载至 [{target_folder}]: {fileName}")
-                    except Exception as e:
-                        print(f"    [附件] 下载失败: {fileName} ({e})")
-
-            if attachment_count == 0:
-                print("    [无附件]")
-            
-            print("-" * 30)
-
-mail.close()
-mail.logout()
\ No newline at end of file
+                        time.sleep(poll_interval)
+                        changed = True
+                except BaseException:
+                    pool.discard(conn) # IDLE 可能还没有结束，连接的状态未知
+                    raise
+                pool.release(conn)
+
+                if changed:
+                    print(f"\n[{time.strftime('%H:%M:%S')}] 收到新邮件通知")
+                    main(pool)
+            except (imaplib.IMAP4.error, OSError) as e:
+                print(f"连接出错: {e}，{backoff} 秒后重新连接...")
+                if pool is not None:
+                    pool.close()
+                    pool = None
+                time.sleep(backoff)
+                backoff = min(backoff * 2, max_backoff)
+    except KeyboardInterrupt:
+        print("\n已停止监听。")
+    finally:
+        if pool is not None:
+            pool.close()
+
+def main(pool=None):
+    """
+    下载新邮件中的作业附件
+
+    Args:
+        pool (ConnectionPool): 复用已有的连接池 (由 main.py 在多次运行之间共享)；不传时新建并在结束时关闭
+
+    Returns:
+        dict: {'messages': 处理的邮件数, 'failures': 读取或保存失败数, 'last_uid': 已同步到的 UID}；未配置邮箱时返回 None
+    """
+    if not EMAIL_ACCOUNT or not EMAIL_PASSWORD:
+        print("未配置邮箱账号或授权码: 请在 config.json 中填写 email_account / email_password，"
+              "或设置环境变量 HOMEWORK_EMAIL_ACCOUNT / HOMEWORK_EMAIL_PASSWORD。")
+        return None
+
+    own_pool = pool is None
+    if own_pool:
+        pool = ConnectionPool(max_connections)
+    else:
+        pool.refresh()
+    try:
+        # 确保下载目录存在
+        if not os.path.exists(download_dir):
+            os.makedirs(download_dir)
+
+        # 2. 搜索指定日期范围的邮件 (增量)
+        search_query = build_search_query()
+        state = load_sync_state()
+        box_state = state.get(mailbox, {})
+        mail = pool.acquire()
+        try:
+            uidvalidity = get_uidvalidity(mail)
+            mail_ids, last_uid = search_new_uids(mail, search_query, box_state, uidvalidity)
+        except (imaplib.IMAP4.abort, OSError):
+            pool.discard(mail)
+            raise
+        except imaplib.IMAP4.error:
+            pool.release(mail)
+            raise
+        except BaseException:
+            pool.discard(mail)
+            raise
+        pool.release(mail)
+
+        # 倒序，从最新开始处理
+        target_ids = list(reversed(mail_ids))
+
+        print(f"共找到 {len(target_ids)} 封邮件。\n")
+
+        # 3. 并发处理每一封邮件
+        cache = RawCache(raw_cache_dir, mailbox, uidvalidity) if raw_cache_dir else None
+        failures = run_pipeline(pool, target_ids, cache)
+
+        # 4. 全部处理完成后再更新同步状态 (中途出错时下次会重新处理这些邮件)
+        if failures:
+            print(f"有 {failures} 封邮件读取或保存附件失败，本次不更新同步状态，下次运行会重新处理。")
+        else:
+            last_uid = max([last_uid] + [int(u) for u in mail_ids])
+            state[mailbox] = {'uidvalidity': uidvalidity, 'last_uid': last_uid, 'query': search_query}
+            save_sync_state(state)
+    finally:
+        if own_pool:
+            pool.close()
+
+    return {'messages': len(target_ids), 'failures': failures, 'last_uid': last_uid}
+
+if __name__ == "__main__":
+    main()
@@ -1,49 +1,374 @@
-import sys
 import os
-import subprocess
-
-def run_script(script_name):
-    """运行指定的Python脚本"""
-    script_path = os.path.join(os.getcwd(), script_name)
-    if not os.path.exists(script_path):
-        print(f"错误: 找不到脚本 {script_name}")
-        return
-    
-    print(f"\n>>> 正在启动 {script_name} ...")
+import sys
+import json
+import argparse
+import contextlib
+
+import extract
+import mail
+import check
+import grade
+import metrics
+import similarity
+import store
+from config import DEFAULTS, load_config
+from roster import load_roster
+
+class Session:
+    """
+    菜单中各功能共用的会话状态
+
+    学生名单 (含匹配索引) 和 IMAP 连接池在第一次使用时建立，之后在各次操作之间复用；
+    students.json 被重新提取或修改后会自动重新加载名单 (同时更新数据库)。
+    """
+
+    def __init__(self, roster_file="students.json"):
+        self.roster_file = roster_file
+        self._roster = None
+        self._roster_stat = None
+        self._pool = None
+
+    @property
+    def roster(self):
+        try:
+            st = os.stat(self.roster_file)
+            stat = (st.st_size, st.st_mtime_ns)
+        except OSError:
+            stat = None
+        if self._roster is None or stat != self._roster_stat:
+            self._roster = load_roster(self.roster_file)
+            self._roster_stat = stat
+        return self._roster
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = mail.ConnectionPool(mail.max_connections)
+        return self._pool
+
+    def reset_pool(self):
+        """出错后丢弃连接池 (其中可能有未归还或已断开的连接)，下次使用时重新建立"""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+
+    def close(self):
+        self.reset_pool()
+
+def run_tool(name, func, on_error=None):
+    """在当前进程中运行一个功能，出错或按 Ctrl+C 时回到主菜单"""
+    print(f"\n>>> 正在启动 {name} ...")
     try:
-        # 使用当前 Python 解释器运行脚本
-        subprocess.run([sys.executable, script_name], check=False)
+        func()
+    except (KeyboardInterrupt, EOFError):
+        print("\n已中断。")
+        if on_error:
+            on_error()
+    except SystemExit:
+        pass
     except Exception as e:
-        print(f"运行脚本出错: {e}")
-    print(f"<<< {script_name} 运行结束\n")
-
-def main():
-    while True:
-        print("=" * 40)
-        print("      作业管理系统主菜单")
-        print("=" * 40)
-        print("1. 提取名单 (extract.py) - 从Excel提取学生名单")
-        print("2. 下载作业 (mail.py)    - 从邮箱下载作业附件")
-        print("3. 检查提交 (check.py)   - 检查作业提交情况")
-        print("4. 批改作业 (grade.py)   - 逐个打开文件进行评分")
-        print("0. 退出程序")
-        print("-" * 40)
-        
-        choice = input("请输入功能序号 (0-4): ").strip()
-        
-        if choice == '1':
-            run_script("extract.py")
-        elif choice == '2':
-            run_script("mail.py")
-        elif choice == '3':
-            run_script("check.py")
-        elif choice == '4':
-            run_script("grade.py")
-        elif choice == '0':
-            print("感谢使用，再见！")
-            break
+        print(f"运行出错: {e}")
+        if on_error:
+            on_error()
+    print(f"<<< {name} 运行结束\n")
+
+def menu(config):
+    """交互式主菜单"""
+    session = Session(config['roster_file'])
+    try:
+        while True:
+            print("=" * 40)
+            print("      作业管理系统主菜单")
+            print("=" * 40)
+            print("1. 提取名单 (extract.py) - 从Excel提取学生名单")
+            print("2. 下载作业 (mail.py)    - 从邮箱下载作业附件")
+            print("3. 检查提交 (check.py)   - 检查作业提交情况")
+            print("4. 批改作业 (grade.py)   - 逐个打开文件进行评分")
+            print("5. 作业查重 (similarity.py) - 找出内容高度相似的作业")
+            print("0. 退出程序")
+            print("-" * 40)
+            
+            try:
+                choice = input("请输入功能序号 (0-5): ").strip()
+            except (KeyboardInterrupt, EOFError):
+                print()
+                choice = '0'
+            
+            if choice == '1':
+                run_tool("extract.py", extract.main)
+            elif choice == '2':
+                run_tool("mail.py", lambda: mail.main(session.pool), on_error=session.reset_pool)
+            elif choice == '3':
+                run_tool("check.py", lambda: check.main([], session.roster, config['download_dir']))
+            elif choice == '4':
+                run_tool("grade.py", lambda: grade.main(session.roster, config['download_dir']))
+            elif choice == '5':
+                run_tool("similarity.py", lambda: similarity.main([], session.roster, config['download_dir']))
+            elif choice == '0':
+                print("感谢使用，再见！")
+                break
+            else:
+                print("无效输入，请重新选择。")
+    finally:
+        session.close()
+
+# --- 命令行子命令 (可在 cron 等无人值守环境中运行) ---
+
+def emit(record):
+    """pipeline 的输出: 每个事件一行 JSON"""
+    print(json.dumps(record, ensure_ascii=False), flush=True)
+
+def cmd_extract(config, args):
+    students = extract.run(args.file, config['roster_file'])
+    return 1 if students == [] else 0
+
+def cmd_sync(config, args):
+    result = mail.main()
+    return 0 if result and not result['failures'] else 1
+
+def cmd_watch(config, args):
+    mail.watch(args.idle_timeout, args.poll_interval)
+    return 0
+
+def cmd_reprocess(config, args):
+    result = mail.reprocess(args.workers)
+    return 0 if result and not result['failures'] else 1
+
+def cmd_check(config, args):
+    roster = load_roster(config['roster_file'])
+    if not roster.students:
+        print(f"未找到学生名单 {config['roster_file']}")
+        return 1
+    if args.all:
+        formats = [f.strip().lower() for f in config['format'].split(',') if f.strip()]
+        check.run_batch(formats, config['workers'], roster=roster, downloads_path=config['download_dir'])
+        return 0
+    folders = args.folders or check.list_assignment_folders(config['download_dir'])
+    for folder in folders:
+        folder_path = os.path.join(config['download_dir'], folder)
+        submitted, not_submitted, ambiguous, unmatched = check.analyze_all_submissions(
+            roster.students, folder_path, roster.matcher, 'check')
+        print(f"\n[{folder}]")
+        print(check.generate_report(submitted, not_submitted, None, ambiguous, unmatched))
+        check.save_baseline(folder_path, 'check', submitted)
+    return 0
+
+def cmd_report(config, args):
+    roster = load_roster(config['roster_file'])
+    if not roster.students:
+        print(f"未找到学生名单 {config['roster_file']}")
+        return 1
+    for folder in args.folders or check.list_assignment_folders(config['download_dir']):
+        folder_path = os.path.join(config['download_dir'], folder)
+        output_file = f"{folder}_output.txt"
+        submitted, not_submitted, ambiguous, unmatched = check.analyze_all_submissions(
+            roster.students, folder_path, roster.matcher, output_file)
+        check.generate_report(submitted, not_submitted, output_file, ambiguous, unmatched)
+        if os.path.exists(output_file):
+            check.save_baseline(folder_path, output_file, submitted)
+    return 0
+
+def cmd_grade(config, args):
+    grade.grade_folder(args.folder, load_roster(config['roster_file']), config['download_dir'], args.grader)
+    return 0
+
+def cmd_similar(config, args):
+    folder_path = os.path.join(config['download_dir'], args.folder)
+    if not os.path.isdir(folder_path):
+        print(f"文件夹不存在: {folder_path}")
+        return 1
+    roster = load_roster(config['roster_file'])
+    result = similarity.find_similar(folder_path, roster if roster.students else None, args.threshold,
+                                     args.workers, args.template, config['download_dir'])
+    print(similarity.generate_report(result, args.threshold, f"{args.folder}_similarity.txt"))
+    return 0
+
+def _print_students(students):
+    for s in students:
+        print(f"{s['serial'] if s['serial'] is not None else '':<6}{s['id']:<16}{s['name']}")
+
+def cmd_query(config, args):
+    """直接查询数据库 (需要先运行过 check 或 sync，数据库中才有对应作业的提交记录)"""
+    db = store.get_store()
+    load_roster(config['roster_file'], db) # students.json 在程序之外被修改过时先导入
+    if args.what in ('missing', 'submitted', 'average') and args.target not in db.folders() + db.graded_folders():
+        print(f"数据库中没有作业 {args.target} 的记录 (请先运行 check 或 sync)")
+        return 1
+    if args.what == 'missing':
+        students = db.missing(args.target)
+        print(f"[{args.target}] 未提交: {len(students)} 人")
+        _print_students(students)
+    elif args.what == 'submitted':
+        students = db.submitted(args.target)
+        print(f"[{args.target}] 已提交: {len(students)} 人")
+        for s in students:
+            print(f"{s['serial'] if s['serial'] is not None else '':<6}{s['id']:<16}{s['name']:<10}{s['filename']}")
+    elif args.what == 'average':
+        average, n = db.average(args.target)
+        if not n:
+            print(f"[{args.target}] 还没有有效成绩")
+        else:
+            print(f"[{args.target}] 平均分: {average:.2f} (基于 {n} 份有效成绩)")
+    else:
+        history = db.student_history(args.target)
+        if not history:
+            print(f"没有学号 {args.target} 的提交记录")
+            return 1
+        for h in history:
+            score = h['score'] if h['score'] is not None else "未批改"
+            print(f"{h['folder']:<16}{score:<8}{h['filename']}")
+    return 0
+
+def cmd_export(config, args):
+    """把数据库中的名单和所有成绩导出为 students.json 和 <文件夹>_grades.json"""
+    db = store.get_store()
+    students = db.students()
+    if students:
+        store.export_json(students, config['roster_file'])
+        # 导出的 JSON 与数据库一致，下次加载时不需要重新导入
+        db.set_meta('students_digest', extract.file_sha256(config['roster_file']))
+        print(f"名单已导出到: {config['roster_file']}")
+    for folder in db.graded_folders():
+        grade.export_grades(db, folder)
+    return 0
+
+def cmd_pipeline(config, args):
+    """
+    同步邮件后检查所有作业文件夹，结果以 JSON Lines 输出到标准输出
+
+    各工具的提示信息改为输出到标准错误，标准输出中只有 JSON。
+    """
+    status = 0
+    emit({'stage': 'sync', 'event': 'start'})
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            result = mail.main()
+        if result is None:
+            emit({'stage': 'sync', 'event': 'error', 'error': '未配置邮箱账号或授权码'})
+            status = 1
         else:
-            print("无效输入，请重新选择。")
+            emit({'stage': 'sync', 'event': 'done', **result})
+            if result['failures']:
+                status = 1
+    except Exception as e:
+        emit({'stage': 'sync', 'event': 'error', 'error': str(e)})
+        status = 1
+
+    roster = load_roster(config['roster_file'])
+    if not roster.students:
+        emit({'stage': 'check', 'event': 'error', 'error': f"未找到学生名单 {config['roster_file']}"})
+        return 1
+
+    for folder in check.list_assignment_folders(config['download_dir']):
+        folder_path = os.path.join(config['download_dir'], folder)
+        with contextlib.redirect_stdout(sys.stderr):
+            submitted, not_submitted, ambiguous, unmatched = check.analyze_all_submissions(
+                roster.students, folder_path, roster.matcher, 'pipeline')
+        emit({
+            'stage': 'check',
+            'folder': folder,
+            'total': len(roster),
+            'submitted': len(submitted),
+            'new': [{'id': s['id'], 'name': s['name'], 'filename': s['filename']} for s in submitted if s['new']],
+            'missing': [{'id': s['id'], 'name': s['name']} for s in not_submitted],
+            'ambiguous': ambiguous,
+            'unmatched': unmatched,
+        })
+        with contextlib.redirect_stdout(sys.stderr):
+            check.save_baseline(folder_path, 'pipeline', submitted)
+    emit({'stage': 'pipeline', 'event': 'done', 'status': status})
+    return status
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="作业管理系统 (不带子命令时进入交互菜单)")
+    parser.add_argument('--config', help="配置文件路径 (默认 config.json，也可用环境变量 HOMEWORK_CONFIG 指定)")
+    parser.add_argument('--download-dir', dest='download_dir', help="作业下载目录 (默认 downloads)")
+    parser.add_argument('--roster', dest='roster_file', help="学生名单 JSON (默认 students.json)")
+    parser.add_argument('--database', help="数据库文件 (默认 course.db)")
+    parser.add_argument('--profile', action='store_true', help="统计各阶段耗时，结束时在标准错误输出汇总表")
+    parser.add_argument('--profile-json', metavar='FILE', help="把耗时统计保存为 JSON")
+    parser.add_argument('--trace', metavar='FILE', help="把每次计时保存为 Chrome trace (chrome://tracing 或 Perfetto 打开)")
+    sub = parser.add_subparsers(dest='command')
+
+    p = sub.add_parser('extract', help="从 Excel/CSV 提取学生名单")
+    p.add_argument('file', nargs='?', default="总名单.xlsx", help="名单文件 (默认 总名单.xlsx)")
+    p.set_defaults(func=cmd_extract)
+
+    p = sub.add_parser('sync', help="从邮箱下载新的作业附件 (授权码请用配置文件或环境变量 HOMEWORK_EMAIL_PASSWORD 提供)")
+    p.add_argument('--account', dest='email_account', help="邮箱地址")
+    p.add_argument('--host', dest='imap_host', help="IMAP 服务器 (默认 imap.qq.com)")
+    p.add_argument('--mailbox', help="邮箱文件夹 (默认 inbox)")
+    p.add_argument('--since', dest='start_date', help="起始日期 YYYY-MM-DD")
+    p.add_argument('--until', dest='end_date', help="结束日期 YYYY-MM-DD (包含)")
+    p.add_argument('--fetch-mode', dest='fetch_mode', choices=['structure', 'full'])
+    p.add_argument('--connections', dest='max_connections', type=int, help="并发连接数")
+    p.add_argument('--batch-size', dest='fetch_batch_size', type=int, help="每条 UID FETCH 命令最多获取的邮件数")
+    p.add_argument('--full-resync', action='store_true', help="忽略增量同步状态，重新扫描整个日期范围")
+    p.set_defaults(func=cmd_sync)
+
+    p = sub.add_parser('watch', help="持续监听邮箱 (IMAP IDLE，不支持时轮询)，新邮件到达后立即下载")
+    p.add_argument('--idle-timeout', type=int, default=600, help="每次 IDLE 的最长时间，秒 (默认 600)")
+    p.add_argument('--poll-interval', type=int, default=60, help="不支持 IDLE 时的检查间隔，秒 (默认 60)")
+    p.set_defaults(func=cmd_watch)
+
+    p = sub.add_parser('reprocess', help="不连接邮箱，用原始邮件缓存重新分类、重命名、去重，重建下载目录")
+    p.add_argument('--workers', type=int, help="并行解析的进程数 (默认 CPU 核数)")
+    p.set_defaults(func=cmd_reprocess)
+
+    p = sub.add_parser('check', help="检查提交情况并在终端输出报告")
+    p.add_argument('folders', nargs='*', help="作业文件夹 (默认全部)")
+    p.add_argument('--all', action='store_true', help="输出 学生×作业 提交矩阵")
+    p.add_argument('--format', help="提交矩阵格式，逗号分隔: csv,xlsx,json")
+    p.add_argument('--workers', type=int, help="并行扫描的进程数")
+    p.set_defaults(func=cmd_check)
+
+    p = sub.add_parser('report', help="为作业文件夹生成提交报告 <文件夹>_output.txt")
+    p.add_argument('folders', nargs='*', help="作业文件夹 (默认全部)")
+    p.set_defaults(func=cmd_report)
+
+    p = sub.add_parser('grade', help="批改一个作业文件夹")
+    p.add_argument('folder', help="作业文件夹名，如 LAB1")
+    p.add_argument('--grader', help="批改人 (默认为当前系统用户名)；多人可同时批改同一个文件夹")
+    p.set_defaults(func=cmd_grade)
+
+    p = sub.add_parser('similar', help="作业查重: 找出一个作业文件夹中内容高度相似的文件，生成 <文件夹>_similarity.txt")
+    p.add_argument('folder', help="作业文件夹名，如 LAB1")
+    p.add_argument('--threshold', type=float, default=similarity.THRESHOLD,
+                   help=f"相似度阈值 0-1 (默认 {similarity.THRESHOLD})")
+    p.add_argument('--template', help="作业模板文件，模板中的内容 (题目、表格等) 不计入相似度")
+    p.add_argument('--workers', type=int, help="提取文本的进程数 (默认 CPU 核数)")
+    p.set_defaults(func=cmd_similar)
+
+    p = sub.add_parser('query', help="查询数据库: 未提交名单、已提交名单、平均分、学生的提交历史")
+    p.add_argument('what', choices=['missing', 'submitted', 'average', 'student'],
+                   help="missing/submitted/average 后接作业文件夹名，student 后接学号")
+    p.add_argument('target', help="作业文件夹名 (如 LAB3) 或学号")
+    p.set_defaults(func=cmd_query)
+
+    p = sub.add_parser('export', help="从数据库导出 students.json 和各作业的 <文件夹>_grades.json")
+    p.set_defaults(func=cmd_export)
+
+    p = sub.add_parser('pipeline', help="同步邮件并检查所有作业文件夹，以 JSON Lines 输出结果")
+    p.add_argument('--since', dest='start_date', help="起始日期 YYYY-MM-DD")
+    p.add_argument('--until', dest='end_date', help="结束日期 YYYY-MM-DD (包含)")
+    p.set_defaults(func=cmd_pipeline)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    overrides = {k: v for k, v in vars(args).items() if k in DEFAULTS}
+    config = load_config(args.config, overrides)
+    if args.profile or args.profile_json or args.trace:
+        metrics.enable(args.profile, args.profile_json, args.trace)
+    mail.configure(config)
+    store.configure(config)
+    if getattr(args, 'full_resync', False):
+        mail.full_resync = True
+
+    if args.command is None:
+        menu(config)
+        return 0
+    return args.func(config, args)
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,240 @@
+"""
+性能统计: 按阶段统计耗时 (计时器) 和数量 (计数器)，用来判断慢在网络、解析、分类、扫描目录还是写盘
+
+默认关闭，关闭时每次计时只多一次全局变量判断。开启方式:
+    python3 main.py --profile sync                    # 结束时在标准错误输出汇总表
+    python3 main.py --profile-json stats.json sync    # 同时把汇总保存为 JSON
+    python3 main.py --trace trace.json sync           # 保存为 Chrome trace (用 chrome://tracing 或 Perfetto 打开)
+也可以设置环境变量 HOMEWORK_PROFILE=1 (以及 HOMEWORK_PROFILE_JSON / HOMEWORK_TRACE)，
+直接运行 mail.py、check.py 等脚本时同样有效。
+
+阶段可以嵌套 (例如保存附件时边下载边解码)，汇总表中每个阶段只计自身的时间，不包括嵌套在其中的其他阶段；
+多个线程的耗时累加，因此各阶段之和可能超过总耗时。
+"""
+import os
+import sys
+import json
+import time
+import atexit
+import functools
+import threading
+import contextlib
+import multiprocessing
+from collections import defaultdict
+
+ENV_PREFIX = "HOMEWORK_"
+
+# Chrome trace 最多记录的事件数 (超出后只统计，不再记录)
+MAX_TRACE_EVENTS = 1000000
+
+_enabled = False
+_tracing = False
+_outputs = {'summary': False, 'json': None, 'trace': None}
+_registered = False
+
+_lock = threading.Lock()
+_local = threading.local()
+_origin = time.perf_counter()
+_seconds = defaultdict(float)
+_calls = defaultdict(int)
+_counters = defaultdict(int)
+_events = []
+_threads = {}
+_dropped = 0
+
+_NULL = contextlib.nullcontext()
+
+def enabled():
+    return _enabled
+
+def enable(summary=True, json_path=None, trace_path=None):
+    """
+    开启统计
+
+    Args:
+        summary (bool): 程序结束时在标准错误输出汇总表
+        json_path (str): 程序结束时把汇总保存为 JSON
+        trace_path (str): 记录每次计时的起止时间，程序结束时保存为 Chrome trace
+    """
+    global _enabled, _tracing, _registered
+    _enabled = True
+    _tracing = _tracing or bool(trace_path)
+    _outputs['summary'] = _outputs['summary'] or summary
+    _outputs['json'] = json_path or _outputs['json']
+    _outputs['trace'] = trace_path or _outputs['trace']
+    if not _registered and (summary or json_path or trace_path):
+        atexit.register(report)
+        _registered = True
+
+def reset():
+    """清空已有的统计 (例如性能测试中只统计某一次运行)"""
+    global _origin, _dropped
+    with _lock:
+        _seconds.clear()
+        _calls.clear()
+        _counters.clear()
+        _events.clear()
+        _threads.clear()
+        _dropped = 0
+        _origin = time.perf_counter()
+
+class _Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(0.0) # 嵌套阶段的耗时
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        global _dropped
+        elapsed = time.perf_counter() - self.start
+        stack = _local.stack
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        with _lock:
+            _seconds[self.name] += elapsed - nested
+            _calls[self.name] += 1
+            if _tracing:
+                if len(_events) < MAX_TRACE_EVENTS:
+                    thread = threading.current_thread()
+                    _threads.setdefault(thread.ident, thread.name)
+                    _events.append((self.name, self.start, elapsed, thread.ident))
+                else:
+                    _dropped += 1
+        return False
+
+def stage(name):
+    """计时一段代码: with metrics.stage('mail.write'): ..."""
+    return _Stage(name) if _enabled else _NULL
+
+def timed(name):
+    """计时一个函数 (装饰器)；是否开启在调用时判断，导入之后再开启同样有效"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Stage(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def timed_iter(name, iterable):
+    """计时迭代过程 (每次取下一项的耗时)，用于生成器这类边读边处理的数据源"""
+    if not _enabled:
+        return iterable
+    return _timed_iter(name, iter(iterable))
+
+def _timed_iter(name, it):
+    while True:
+        with _Stage(name):
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+        yield item
+
+def count(name, n=1):
+    """计数器加 n"""
+    if _enabled:
+        with _lock:
+            _counters[name] += n
+
+def drain():
+    """取出并清空本进程的统计 (进程池中的子进程把结果交给父进程合并)"""
+    with _lock:
+        data = {'stages': {k: [_seconds[k], _calls[k]] for k in _calls}, 'counters': dict(_counters)}
+        _seconds.clear()
+        _calls.clear()
+        _counters.clear()
+    return data
+
+def merge(data):
+    """合并 drain() 的结果"""
+    if not data:
+        return
+    with _lock:
+        for name, (seconds, calls) in data['stages'].items():
+            _seconds[name] += seconds
+            _calls[name] += calls
+        for name, n in data['counters'].items():
+            _counters[name] += n
+
+def summary():
+    """
+    Returns:
+        dict: {'wall_seconds': 总耗时, 'stages': {阶段: {'seconds', 'calls'}}, 'counters': {计数器: 值}}
+    """
+    with _lock:
+        return {
+            'wall_seconds': round(time.perf_counter() - _origin, 6),
+            'stages': {name: {'seconds': round(_seconds[name], 6), 'calls': _calls[name]} for name in sorted(_calls)},
+            'counters': dict(sorted(_counters.items())),
+        }
+
+def format_summary(data=None):
+    """把汇总整理为表格文本"""
+    data = data or summary()
+    lines = ["=" * 68, f"性能统计  (总耗时 {data['wall_seconds']:.3f} 秒)", "-" * 68,
+             f"{'阶段':<24}{'耗时(秒)':>11}{'调用次数':>10}{'平均(毫秒)':>10}"]
+    for name, item in data['stages'].items():
+        avg = item['seconds'] / item['calls'] * 1000 if item['calls'] else 0
+        lines.append(f"{name:<26}{item['seconds']:>14.3f}{item['calls']:>14}{avg:>14.3f}")
+    if data['counters']:
+        lines.append("-" * 68)
+        lines.append(f"{'计数器':<23}{'值':>13}")
+        for name, value in data['counters'].items():
+            lines.append(f"{name:<26}{value:>14}")
+    lines.append("=" * 68)
+    return "\n".join(lines)
+
+def _write_json(path, data, indent=2):
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+    os.replace(tmp_file, path)
+
+def write_trace(path):
+    """保存为 Chrome trace 格式 (每次计时为一个完整事件，时间单位微秒)"""
+    pid = os.getpid()
+    with _lock:
+        events = [{'name': name, 'cat': name.split('.')[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                   'ts': round((start - _origin) * 1e6, 3), 'dur': round(elapsed * 1e6, 3)}
+                  for name, start, elapsed, tid in _events]
+        events += [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': tname}}
+                   for tid, tname in _threads.items()]
+        dropped = _dropped
+    _write_json(path, {'traceEvents': events, 'displayTimeUnit': 'ms'}, indent=None)
+    if dropped:
+        print(f"trace 事件过多，有 {dropped} 个未记录", file=sys.stderr)
+
+def report():
+    """输出汇总表并保存 JSON / trace (开启统计时在程序结束时自动调用)"""
+    # 进程池的子进程退出时不输出，统计由父进程合并
+    if not _enabled or multiprocessing.parent_process() is not None:
+        return
+    data = summary()
+    if _outputs['summary']:
+        print(format_summary(data), file=sys.stderr)
+    try:
+        if _outputs['json']:
+            _write_json(_outputs['json'], data)
+            print(f"性能统计已保存到: {_outputs['json']}", file=sys.stderr)
+        if _outputs['trace']:
+            write_trace(_outputs['trace'])
+            print(f"trace 已保存到: {_outputs['trace']}", file=sys.stderr)
+    except OSError as e:
+        print(f"保存性能统计失败: {e}", file=sys.stderr)
+
+if os.environ.get(ENV_PREFIX + "PROFILE") or os.environ.get(ENV_PREFIX + "PROFILE_JSON") \
+        or os.environ.get(ENV_PREFIX + "TRACE"):
+    enable(summary=os.environ.get(ENV_PREFIX + "PROFILE", "1") not in ('', '0', 'false', 'no'),
+           json_path=os.environ.get(ENV_PREFIX + "PROFILE_JSON"), trace_path=os.environ.get(ENV_PREFIX + "TRACE"))
@@ -0,0 +1,227 @@
+import os
+import re
+import json
+import shutil
+import hashlib
+import codecs
+import zipfile
+import subprocess
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+
+# 预览缓存目录: 每个文件按 (路径, 大小, 修改时间) 缓存一份文本预览和页数
+CACHE_DIR = ".preview_cache"
+
+# 预览缓存的格式版本，提取或解码文本的方式变化时加一，使旧的预览失效
+CACHE_VERSION = 2
+
+# 预览中保留的最大字符数
+PREVIEW_CHARS = 2000
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+def _cache_key(filepath):
+    st = os.stat(filepath)
+    raw = f"{CACHE_VERSION}|{os.path.abspath(filepath)}|{st.st_size}|{st.st_mtime_ns}"
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+def _docx_preview(filepath):
+    """直接解析 .docx 中的 XML 提取文本和页数 (不依赖第三方库)"""
+    with zipfile.ZipFile(filepath) as z:
+        root = ET.fromstring(z.read('word/document.xml'))
+        paragraphs = []
+        for p in root.iter(W_NS + 'p'):
+            text = ''.join(t.text or '' for t in p.iter(W_NS + 't'))
+            if text.strip():
+                paragraphs.append(text)
+
+        pages = None
+        if 'docProps/app.xml' in z.namelist():
+            m = re.search(rb'<Pages>(\d+)</Pages>', z.read('docProps/app.xml'))
+            if m:
+                pages = int(m.group(1))
+    return '\n'.join(paragraphs), pages
+
+def _pdf_pages(filepath):
+    """统计 PDF 页数: 优先使用 pypdf，未安装时按页面对象粗略统计"""
+    try:
+        from pypdf import PdfReader
+        return len(PdfReader(filepath).pages)
+    except ImportError:
+        pass
+    with open(filepath, 'rb') as f:
+        data = f.read()
+    pages = len(re.findall(rb'/Type\s*/Page\b', data))
+    if not pages:
+        counts = [int(c) for c in re.findall(rb'/Count\s+(\d+)', data)]
+        pages = max(counts) if counts else None
+    return pages
+
+def _pdf_text(filepath, max_chars=PREVIEW_CHARS):
+    """提取 PDF 文本 (max_chars 为 None 时提取全文): 优先使用 pypdf，其次 pdftotext 命令，都没有时返回空"""
+    try:
+        from pypdf import PdfReader
+        reader = PdfReader(filepath)
+        parts = []
+        for page in reader.pages:
+            parts.append(page.extract_text() or '')
+            if max_chars and sum(len(p) for p in parts) >= max_chars:
+                break
+        return '\n'.join(parts)
+    except ImportError:
+        pass
+    if shutil.which('pdftotext'):
+        pages = ['-l', '3'] if max_chars else []
+        result = subprocess.run(['pdftotext', *pages, '-enc', 'UTF-8', filepath, '-'],
+                                capture_output=True, timeout=60)
+        return result.stdout.decode('utf-8', errors='replace')
+    return ''
+
+def _decode_text(raw, partial=False):
+    """
+    文本文件: 先按 UTF-8 解码，失败时按 GBK 系列解码
+
+    partial 表示 raw 只是文件的开头，末尾可能截断了一个多字节字符，这时忽略最后不完整的字符
+    """
+    try:
+        if partial:
+            return codecs.getincrementaldecoder('utf-8')().decode(raw)
+        return raw.decode('utf-8')
+    except UnicodeDecodeError:
+        return raw.decode('gb18030', errors='replace')
+
+def _convert_to_pdf(filepath, out_dir):
+    """用 LibreOffice 把 .doc 转换为 PDF，返回 PDF 路径；没有安装时返回 None"""
+    soffice = shutil.which('soffice') or shutil.which('libreoffice')
+    if not soffice:
+        return None
+    subprocess.run([soffice, '--headless', '--convert-to', 'pdf', '--outdir', out_dir, filepath],
+                   capture_output=True, timeout=120)
+    pdf_path = os.path.join(out_dir, os.path.splitext(os.path.basename(filepath))[0] + '.pdf')
+    return pdf_path if os.path.exists(pdf_path) else None
+
+def prepare_preview(filepath, cache_dir=CACHE_DIR):
+    """
+    为一个作业文件准备预览 (结果缓存在 cache_dir 中)
+
+    Returns:
+        dict: {'text': 文本预览, 'pages': 页数或 None, 'pdf': 转换得到的 PDF 路径或 None, 'error': 错误信息或 None}
+    """
+    key = _cache_key(filepath)
+    cache_file = os.path.join(cache_dir, key + '.json')
+    if os.path.exists(cache_file):
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    info = {'text': '', 'pages': None, 'pdf': None, 'error': None}
+    ext = os.path.splitext(filepath)[1].lower()
+    try:
+        if ext == '.docx':
+            info['text'], info['pages'] = _docx_preview(filepath)
+        elif ext == '.pdf':
+            info['pages'] = _pdf_pages(filepath)
+            info['text'] = _pdf_text(filepath)
+        elif ext == '.doc':
+            os.makedirs(cache_dir, exist_ok=True)
+            if shutil.which('antiword'):
+                result = subprocess.run(['antiword', filepath], capture_output=True, timeout=60)
+                info['text'] = result.stdout.decode('utf-8', errors='replace')
+            pdf_path = _convert_to_pdf(filepath, os.path.join(cache_dir, key))
+            if pdf_path:
+                info['pdf'] = pdf_path
+                info['pages'] = _pdf_pages(pdf_path)
+                if not info['text']:
+                    info['text'] = _pdf_text(pdf_path)
+        elif ext == '.txt':
+            with open(filepath, 'rb') as f:
+                info['text'] = _decode_text(f.read(PREVIEW_CHARS * 4), partial=True)
+    except Exception as e:
+        info['error'] = str(e)
+
+    info['text'] = info['text'][:PREVIEW_CHARS]
+
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_file, 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+    except OSError:
+        pass
+    return info
+
+def extract_text(filepath):
+    """
+    提取文件的全部文本 (查重等需要全文的场合使用，不写缓存)
+
+    支持 .docx / .pdf / .txt，以及安装了 antiword 时的 .doc；其他格式返回空字符串。
+    """
+    ext = os.path.splitext(filepath)[1].lower()
+    if ext == '.docx':
+        return _docx_preview(filepath)[0]
+    if ext == '.pdf':
+        return _pdf_text(filepath, None)
+    if ext == '.txt':
+        with open(filepath, 'rb') as f:
+            return _decode_text(f.read())
+    if ext == '.doc' and shutil.which('antiword'):
+        result = subprocess.run(['antiword', filepath], capture_output=True, timeout=60)
+        return result.stdout.decode('utf-8', errors='replace')
+    return ''
+
+def format_preview(info, max_chars=800):
+    """把预览信息整理为适合在终端显示的文本"""
+    lines = []
+    if info.get('pages'):
+        lines.append(f"  页数: {info['pages']}")
+    if info.get('pdf'):
+        lines.append(f"  已转换为 PDF: {info['pdf']}")
+    if info.get('error'):
+        lines.append(f"  预览失败: {info['error']}")
+    text = (info.get('text') or '').strip()
+    if text:
+        if len(text) > max_chars:
+            text = text[:max_chars] + " ..."
+        lines.append("  " + "-" * 36)
+        lines.extend("  " + line for line in text.splitlines() if line.strip())
+        lines.append("  " + "-" * 36)
+    elif not info.get('error'):
+        lines.append("  (无可显示的文本预览)")
+    return "\n".join(lines)
+
+class PreviewPrefetcher:
+    """
+    后台预读: 批改当前文件时，用线程池提前为后面 lookahead 个文件准备预览
+
+    Args:
+        paths (list): 按批改顺序排列的文件路径
+        lookahead (int): 提前准备的文件数
+    """
+
+    def __init__(self, paths, lookahead=3, workers=2, cache_dir=CACHE_DIR):
+        self.paths = paths
+        self.lookahead = lookahead
+        self.cache_dir = cache_dir
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.futures = {}
+
+    def _submit(self, index):
+        if 0 <= index < len(self.paths) and index not in self.futures:
+            self.futures[index] = self.executor.submit(prepare_preview, self.paths[index], self.cache_dir)
+
+    def advance(self, index):
+        """开始批改第 index 个文件: 确保它和后面 lookahead 个文件都已在准备中"""
+        for i in range(index, index + self.lookahead + 1):
+            self._submit(i)
+
+    def get(self, index):
+        """获取第 index 个文件的预览 (如果还没准备好会等待)"""
+        self._submit(index)
+        try:
+            return self.futures[index].result()
+        except Exception as e:
+            return {'text': '', 'pages': None, 'pdf': None, 'error': str(e)}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
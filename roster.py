@@ -0,0 +1,192 @@
+import os
+import json
+import hashlib
+from typing import List, Optional
+from store import Store, get_store
+
+# 名单索引缓存的格式版本，Roster 的结构变化时加一，使旧缓存失效
+INDEX_VERSION = 2
+
+class AhoCorasick:
+    """多模式匹配自动机: 扫描一遍文本即可找出其中出现的所有模式"""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+    def add(self, pattern: str, value) -> None:
+        """加入一个模式，匹配时返回 value"""
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            node = nxt
+        self.output[node].append(value)
+
+    def build(self) -> None:
+        """按广度优先计算失败指针"""
+        queue = list(self.goto[0].values())
+        for node in queue:
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.output[nxt] = self.output[nxt] + self.output[self.fail[nxt]]
+
+    def search(self, text: str) -> List:
+        """返回文本中出现的所有模式对应的 value (可能重复)"""
+        found = []
+        node = 0
+        for ch in text:
+            while node and ch not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(ch, 0)
+            if self.output[node]:
+                found.extend(self.output[node])
+        return found
+
+    def to_dict(self) -> dict:
+        """导出自动机的状态表 (value 须可 JSON 序列化)"""
+        return {'goto': self.goto, 'fail': self.fail, 'output': self.output}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'AhoCorasick':
+        """从 to_dict 的结果恢复 (JSON 中的 value 为列表，转回元组)"""
+        matcher = cls()
+        matcher.goto = data['goto']
+        matcher.fail = data['fail']
+        matcher.output = [[tuple(v) for v in values] for values in data['output']]
+        return matcher
+
+def build_matcher(students: List[dict]) -> AhoCorasick:
+    """用所有学生的学号和姓名建立一个匹配自动机"""
+    matcher = AhoCorasick()
+    for index, student in enumerate(students):
+        student_id = str(student['id'])
+        student_name = str(student['name'])
+        if student_id:
+            matcher.add(student_id, ('id', index))
+        # 姓名只有一个字时容易误判，不参与匹配
+        if len(student_name) > 1:
+            matcher.add(student_name, ('name', index))
+    matcher.build()
+    return matcher
+
+def match_file(filename: str, students: List[dict], matcher: AhoCorasick) -> List[int]:
+    """
+    找出文件名中提到的所有学生，返回学生在名单中的下标 (按名单顺序)
+
+    学号匹配优先: 如果文件名中的某个学号已经确定了学生，与该学生同名的其他学生不再计入 (防止重名误判)；
+    姓名取最长匹配: 例如文件名中有 "吴杰勇" 时，不再把名单中的 "吴杰" 也算作提交
+    """
+    by_id = set()
+    by_name = set()
+    for kind, index in matcher.search(filename):
+        (by_id if kind == 'id' else by_name).add(index)
+
+    longer_names = {students[i]['name'] for i in by_id | by_name}
+    matched = set(by_id)
+    for index in by_name:
+        name = students[index]['name']
+        if any(name in other and name != other for other in longer_names):
+            continue
+        if any(students[i]['name'] == name for i in by_id):
+            continue # 该姓名已经通过学号确定了学生
+        matched.add(index)
+    return sorted(matched)
+
+class Roster:
+    """
+    学生名单及其匹配索引，grade.py 与 check.py 共用，保证两边对同一文件名得到相同的学生
+
+    Attributes:
+        students (list): 名单 (与 students.json 中的顺序一致)
+        by_id (dict): {学号: 名单下标}
+        by_name (dict): {姓名: [名单下标, ...]} (可能重名)
+        matcher (AhoCorasick): 学号和姓名的匹配自动机
+        digest (str): students.json 文件内容的 sha256
+    """
+
+    def __init__(self, students: List[dict], digest: str = '', matcher: Optional[AhoCorasick] = None):
+        self.students = students
+        self.digest = digest
+        self.by_id = {}
+        self.by_name = {}
+        for index, student in enumerate(students):
+            self.by_id[str(student['id'])] = index
+            self.by_name.setdefault(str(student['name']), []).append(index)
+        self.matcher = matcher or build_matcher(students)
+
+    def __len__(self) -> int:
+        return len(self.students)
+
+    def match(self, filename: str) -> List[int]:
+        """文件名中提到的所有学生的名单下标 (规则见 match_file)"""
+        return match_file(filename, self.students, self.matcher)
+
+    def resolve(self, filename: str) -> Optional[dict]:
+        """文件名对应的学生；匹配到多个学生时取名单中最靠前的一个，没有匹配时返回 None"""
+        matched = self.match(filename)
+        return self.students[matched[0]] if matched else None
+
+def _index_path(json_file: str) -> str:
+    """名单索引缓存文件: 与 students.json 同目录的隐藏文件"""
+    folder, name = os.path.split(json_file)
+    return os.path.join(folder, f".{name}.index")
+
+def load_roster(json_file: str = "students.json", store: Store = None) -> Roster:
+    """
+    加载学生名单并建立匹配索引
+
+    名单以数据库 (store.py) 为准，students.json 是导出的副本；数据库中还没有名单，
+    或 JSON 在程序之外被修改过 (内容哈希与数据库记录的不同) 时，先把 JSON 导入数据库。
+    建好的索引按名单的内容哈希缓存在磁盘上，名单没有变化时直接读取缓存，不再读取名单和重建自动机。
+    数据库和 JSON 中都没有名单时返回空名单。
+    """
+    store = store or get_store()
+    digest = store.get_meta('students_digest')
+    try:
+        with open(json_file, 'rb') as f:
+            data = f.read()
+    except OSError:
+        data = None
+    if data is not None:
+        json_digest = hashlib.sha256(data).hexdigest()
+        if json_digest != digest:
+            try:
+                store.replace_students(json.loads(data.decode('utf-8')), json_digest)
+                digest = json_digest
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"加载JSON文件失败: {e}")
+    if not digest:
+        return Roster([])
+
+    # 索引缓存使用 JSON (不用 pickle: 加载 pickle 会执行文件中的任意代码)
+    index_file = _index_path(json_file)
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('version') == INDEX_VERSION and cached.get('digest') == digest:
+            return Roster(cached['students'], digest, AhoCorasick.from_dict(cached['matcher']))
+    except Exception:
+        pass # 缓存不存在、已损坏或是旧版本的格式，重新建立
+
+    roster = Roster(store.students(), digest)
+
+    tmp_file = index_file + ".tmp"
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({'version': INDEX_VERSION, 'digest': digest, 'students': roster.students,
+                       'matcher': roster.matcher.to_dict()}, f, ensure_ascii=False)
+        os.replace(tmp_file, index_file)
+    except (OSError, TypeError, ValueError):
+        pass
+    return roster
@@ -0,0 +1,397 @@
+"""
+作业查重: 用 MinHash + LSH 找出同一作业文件夹中内容高度相似的文件对
+
+每个文件提取全文后按字符切成长度为 SHINGLE_SIZE 的片段 (中文按字、英文按字母，忽略空白和标点)，
+用 NUM_PERM 个哈希函数计算 MinHash 签名；两个签名相同位置取值相同的比例即为两份文本片段集合的
+Jaccard 相似度的估计。签名按 LSH 分段放入哈希桶，只有至少一段完全相同的文件才会被比较，
+文件数增加时耗时近似线性增长，不需要两两比较。
+
+签名按文件内容的 sha256 缓存在 downloads/.similarity_cache 中，再次运行时只处理新文件。
+
+    python3 similarity.py                       # 交互选择作业文件夹
+    python3 main.py similar LAB1 --threshold 0.6 --template 实验模板.docx
+"""
+import os
+import re
+import zlib
+import json
+import argparse
+from itertools import combinations
+from concurrent.futures import ProcessPoolExecutor
+
+import metrics
+from extract import file_sha256
+from preview import extract_text
+from roster import load_roster
+
+# 签名缓存文件 (在下载目录下)
+CACHE_FILE = ".similarity_cache"
+CACHE_VERSION = 2
+
+NUM_PERM = 128      # MinHash 签名长度 (越长估计越准，计算越慢)
+SHINGLE_SIZE = 5    # 片段长度 (字符)
+THRESHOLD = 0.5     # 默认相似度阈值
+
+TEXT_EXTENSIONS = ('.docx', '.pdf', '.txt', '.doc')
+
+# 提取到的文本少于这么多个片段时不参与比较 (扫描件、图片型 PDF 等)
+MIN_SHINGLES = 20
+
+_MERSENNE = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+# 片段哈希 (crc32) 和系数 a 都小于 2^32，a * x 小于 2^64，在 uint64 中计算不会溢出
+_NON_TEXT = re.compile(r'[\W_]+')
+
+def shingles(text, k=SHINGLE_SIZE):
+    """文本的片段集合 (每个片段以 crc32 表示)；排版、空白和标点的差异不影响结果"""
+    text = _NON_TEXT.sub('', text.lower())
+    return {zlib.crc32(text[i:i + k].encode('utf-8')) for i in range(len(text) - k + 1)}
+
+_permutations = {}
+
+def _get_permutations(num_perm):
+    """MinHash 使用的哈希函数 h(x) = (a * x + b) mod p 的参数 (固定种子，保证缓存的签名可以复用)"""
+    import numpy as np
+    if num_perm not in _permutations:
+        rng = np.random.RandomState(1)
+        a = rng.randint(1, _MAX_HASH + 1, size=num_perm, dtype=np.uint64)
+        b = rng.randint(0, _MERSENNE, size=num_perm, dtype=np.uint64)
+        _permutations[num_perm] = (a[:, None], b[:, None])
+    return _permutations[num_perm]
+
+def minhash(hashes, num_perm=NUM_PERM):
+    """
+    计算片段集合的 MinHash 签名
+
+    Returns:
+        numpy.ndarray: 长度为 num_perm 的 uint32 数组
+    """
+    import numpy as np
+    a, b = _get_permutations(num_perm)
+    values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+    signature = np.full(num_perm, _MAX_HASH, dtype=np.uint64)
+    p = np.uint64(_MERSENNE)
+    # 分块计算，控制 num_perm × 片段数 的中间矩阵大小
+    for start in range(0, len(values), 4096):
+        chunk = values[start:start + 4096]
+        hashed = ((a * chunk % p + b) % p) & np.uint64(_MAX_HASH)
+        np.minimum(signature, hashed.min(axis=1), out=signature)
+    return signature.astype(np.uint32)
+
+def estimate_similarity(sig_a, sig_b):
+    """两个签名估计的 Jaccard 相似度"""
+    return float((sig_a == sig_b).mean())
+
+def _integrate(f, a, b, steps=100):
+    step = (b - a) / steps
+    return sum(f(a + (i + 0.5) * step) for i in range(steps)) * step
+
+def lsh_params(threshold, num_perm=NUM_PERM):
+    """
+    选择 LSH 的分段数 bands 和每段长度 rows
+
+    相似度为 s 的两个文件至少有一段相同 (成为候选) 的概率为 1 - (1 - s^rows)^bands。
+    在所有 bands × rows <= num_perm 的组合中，选择使 阈值以下成为候选 (误报) 与阈值以上没有成为候选 (漏报)
+    的概率积分加权和最小的一组。候选对之后还会用签名核实相似度，误报只多花一点时间，因此漏报的权重更高。
+
+    Returns:
+        tuple: (bands, rows)
+    """
+    best, best_error = (1, num_perm), None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            prob = lambda s: 1 - (1 - s ** rows) ** bands
+            false_positive = _integrate(prob, 0.0, threshold)
+            false_negative = _integrate(lambda s: 1 - prob(s), threshold, 1.0)
+            error = 0.3 * false_positive + 0.7 * false_negative
+            if best_error is None or error < best_error:
+                best, best_error = (bands, rows), error
+    return best
+
+def candidate_pairs(signatures, bands, rows):
+    """
+    把签名按段放入哈希桶，返回至少有一段完全相同的下标对
+
+    Args:
+        signatures (list): 签名数组列表
+    """
+    pairs = set()
+    for band in range(bands):
+        buckets = {}
+        for index, signature in enumerate(signatures):
+            key = signature[band * rows:(band + 1) * rows].tobytes()
+            buckets.setdefault(key, []).append(index)
+        for members in buckets.values():
+            if len(members) > 1:
+                pairs.update(combinations(members, 2))
+    return pairs
+
+# --- 签名缓存 (JSON): {"版本:签名长度:片段长度:模板哈希": {内容 sha256: 签名的十六进制字符串或 null}} ---
+# 不用 pickle: 缓存在共享的下载目录中，加载 pickle 会执行文件中的任意代码
+
+def cache_key(num_perm, shingle_size, template_digest):
+    return f"{CACHE_VERSION}:{num_perm}:{shingle_size}:{template_digest}"
+
+def load_cache(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        if cache.get('version') == CACHE_VERSION and isinstance(cache.get('signatures'), dict):
+            return cache
+    except Exception:
+        pass # 缓存不存在、已损坏或是旧版本的格式，重新计算
+    return {'version': CACHE_VERSION, 'signatures': {}}
+
+def save_cache(path, cache):
+    tmp_file = path + ".tmp"
+    try:
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(cache, f)
+        os.replace(tmp_file, path)
+    except OSError as e:
+        print(f"保存查重缓存失败: {e}")
+
+# 进程池中每个进程持有一份模板片段 (只在进程启动时传入一次)
+_worker_template = frozenset()
+
+def _init_worker(template):
+    global _worker_template
+    _worker_template = template
+
+def _init_pool_worker(template):
+    metrics.drain() # 丢弃 fork 时从父进程继承的统计
+    _init_worker(template)
+
+def _signature(filepath, num_perm, shingle_size):
+    """
+    提取文本并计算签名
+
+    Returns:
+        tuple: (签名的十六进制字符串，文本过少时为 None, 错误信息或 None)
+    """
+    try:
+        with metrics.stage('similarity.extract'):
+            text = extract_text(filepath)
+        with metrics.stage('similarity.minhash'):
+            hashes = shingles(text, shingle_size) - _worker_template
+            if len(hashes) < MIN_SHINGLES:
+                return None, None
+            return minhash(hashes, num_perm).tobytes().hex(), None
+    except Exception as e:
+        return None, str(e)
+
+def _signature_in_worker(filepath, num_perm, shingle_size):
+    """子进程中计算，连同本次的性能统计一起返回给父进程"""
+    signature, error = _signature(filepath, num_perm, shingle_size)
+    return signature, error, metrics.drain() if metrics.enabled() else None
+
+def compute_signatures(paths, cache, key, workers=None, num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE, template=frozenset()):
+    """
+    计算一组文件的签名，内容已经处理过的文件直接使用缓存
+
+    Returns:
+        tuple: ({文件路径: 签名数组或 None}, {文件路径: 错误信息})
+    """
+    import numpy as np
+
+    known = cache['signatures'].setdefault(key, {})
+    with metrics.stage('similarity.hash'):
+        digests = {path: file_sha256(path) for path in paths}
+    pending = sorted({d: p for p, d in digests.items() if d not in known}.items())
+    if pending:
+        print(f"需要提取文本并计算签名的文件: {len(pending)} 个 (其余 {len(paths) - len(pending)} 个使用缓存)")
+    else:
+        print(f"所有 {len(paths)} 个文件都使用缓存的签名")
+
+    errors = {}
+    def collect(digest, path, signature, error):
+        # 提取失败的文件不写入缓存，下次重试
+        if error:
+            errors[path] = error
+        else:
+            known[digest] = signature
+
+    workers = workers or os.cpu_count() or 1
+    if workers > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(pending)), initializer=_init_pool_worker,
+                                 initargs=(template,)) as executor:
+            futures = [(d, p, executor.submit(_signature_in_worker, p, num_perm, shingle_size)) for d, p in pending]
+            for done, (digest, path, future) in enumerate(futures, 1):
+                signature, error, stats = future.result()
+                metrics.merge(stats)
+                collect(digest, path, signature, error)
+                if done % 50 == 0:
+                    print(f"  已处理 {done}/{len(pending)}")
+    else:
+        _init_worker(template)
+        for digest, path in pending:
+            collect(digest, path, *_signature(path, num_perm, shingle_size))
+
+    signatures = {}
+    for path, digest in digests.items():
+        data = known.get(digest)
+        signatures[path] = np.frombuffer(bytes.fromhex(data), dtype=np.uint32) if data is not None else None
+    return signatures, errors
+
+def template_shingles(template_file, shingle_size=SHINGLE_SIZE):
+    """作业模板 (题目、表格等所有人都有的内容) 的片段，计算签名前从每个文件中去掉"""
+    if not template_file:
+        return frozenset(), ''
+    return frozenset(shingles(extract_text(template_file), shingle_size)), file_sha256(template_file)
+
+def find_similar(folder_path, roster=None, threshold=THRESHOLD, workers=None, template_file=None,
+                 cache_dir="downloads", num_perm=NUM_PERM, shingle_size=SHINGLE_SIZE):
+    """
+    找出一个作业文件夹中相似度不低于 threshold 的文件对
+
+    同一学生的多个版本 (重新提交) 之间不算抄袭，不会列出。
+
+    Returns:
+        dict: {'files': 参与比较的文件数,
+               'pairs': [{'files': [文件A, 文件B], 'similarity': 相似度, 'students': [学生A, 学生B]}] (按相似度从高到低),
+               'skipped': [没有可比较文本的文件], 'errors': {文件: 错误信息}}
+    """
+    files = sorted(f for f in os.listdir(folder_path)
+                   if not f.startswith('.') and f.lower().endswith(TEXT_EXTENSIONS)
+                   and os.path.isfile(os.path.join(folder_path, f)))
+    print(f"在文件夹中找到 {len(files)} 个可提取文本的文件")
+
+    template, template_digest = template_shingles(template_file, shingle_size)
+    cache_path = os.path.join(cache_dir, CACHE_FILE)
+    cache = load_cache(cache_path)
+    key = cache_key(num_perm, shingle_size, template_digest)
+    paths = [os.path.join(folder_path, f) for f in files]
+    signatures, errors = compute_signatures(paths, cache, key, workers, num_perm, shingle_size, template)
+    save_cache(cache_path, cache)
+
+    names = [f for f, p in zip(files, paths) if signatures[p] is not None]
+    skipped = [f for f, p in zip(files, paths) if signatures[p] is None and p not in errors]
+    sigs = [signatures[os.path.join(folder_path, f)] for f in names]
+
+    with metrics.stage('similarity.lsh'):
+        bands, rows = lsh_params(threshold, num_perm)
+        candidates = candidate_pairs(sigs, bands, rows)
+    metrics.count('similarity.candidates', len(candidates))
+
+    pairs = []
+    with metrics.stage('similarity.verify'):
+        for i, j in candidates:
+            score = estimate_similarity(sigs[i], sigs[j])
+            if score < threshold:
+                continue
+            students = [roster.resolve(names[i]) if roster else None, roster.resolve(names[j]) if roster else None]
+            if students[0] and students[1] and students[0]['id'] == students[1]['id']:
+                continue
+            pairs.append({'files': [names[i], names[j]], 'similarity': round(score, 3), 'students': students})
+    pairs.sort(key=lambda p: (-p['similarity'], p['files']))
+    print(f"候选文件对 {len(candidates)} 个 (LSH: {bands} 段 × {rows})，相似度不低于 {threshold:.0%} 的 {len(pairs)} 对")
+
+    return {'files': len(names), 'pairs': pairs, 'skipped': skipped,
+            'errors': {os.path.basename(p): e for p, e in errors.items()}}
+
+def _student_label(student):
+    return f"{student['id']} {student['name']}" if student else "(未匹配到学生)"
+
+@metrics.timed('similarity.report')
+def generate_report(result, threshold=THRESHOLD, output_file=None):
+    """生成查重报告"""
+    report = []
+    report.append("=" * 60)
+    report.append("作业查重报告")
+    report.append("=" * 60)
+    report.append(f"参与比较的文件: {result['files']} 个")
+    report.append(f"相似度阈值: {threshold:.0%}")
+    report.append(f"相似文件对: {len(result['pairs'])} 对")
+    report.append("")
+
+    if result['pairs']:
+        report.append("相似文件对 (按相似度从高到低):")
+        report.append("-" * 40)
+        for pair in result['pairs']:
+            a, b = pair['files']
+            sa, sb = pair['students']
+            report.append(f"{pair['similarity']:.0%}  {_student_label(sa)}  <->  {_student_label(sb)}")
+            report.append(f"      {a}")
+            report.append(f"      {b}")
+
+    if result['skipped']:
+        report.append("")
+        report.append("没有可比较文本的文件 (扫描件、图片或内容过少，请人工检查):")
+        report.append("-" * 40)
+        report.extend(result['skipped'])
+
+    if result['errors']:
+        report.append("")
+        report.append("提取文本失败的文件:")
+        report.append("-" * 40)
+        for filename, error in result['errors'].items():
+            report.append(f"{filename}: {error}")
+
+    report_text = "\n".join(report)
+
+    if output_file:
+        try:
+            with open(output_file, 'w', encoding='utf-8') as f:
+                f.write(report_text)
+            print(f"报告已保存到: {output_file}")
+        except Exception as e:
+            print(f"保存报告文件失败: {e}")
+
+    return report_text
+
+def main(argv=None, roster=None, downloads_path="downloads"):
+    """
+    主函数
+
+    Args:
+        argv (list): 命令行参数 (默认读取 sys.argv)
+        roster (Roster): 已加载的学生名单 (由 main.py 共享)；不传时从 students.json 加载
+        downloads_path (str): 作业下载目录
+    """
+    parser = argparse.ArgumentParser(description="作业查重 (MinHash + LSH)")
+    parser.add_argument('folder', nargs='?', help="作业文件夹名 (不指定时交互选择)")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help=f"相似度阈值 0-1 (默认 {THRESHOLD})")
+    parser.add_argument('--template', help="作业模板文件，模板中的内容不计入相似度")
+    parser.add_argument('--workers', type=int, help="提取文本的进程数 (默认 CPU 核数)")
+    args = parser.parse_args(argv)
+
+    print("作业查重程序")
+    print("=" * 50)
+
+    if roster is None:
+        roster = load_roster("students.json")
+    if not roster.students:
+        print("未找到学生名单 students.json，报告中将不显示学生信息")
+
+    if not os.path.exists(downloads_path):
+        print(f"错误：目录 '{downloads_path}' 不存在。")
+        return
+
+    folder_name = args.folder
+    if not folder_name:
+        subfolders = sorted(f for f in os.listdir(downloads_path) if os.path.isdir(os.path.join(downloads_path, f)))
+        if not subfolders:
+            print(f"'{downloads_path}' 下没有找到任何文件夹。")
+            return
+        print("请选择作业文件夹:")
+        for i, folder in enumerate(subfolders, 1):
+            print(f"{i}. {folder}")
+        choice = input("请输入序号: ").strip()
+        if not choice.isdigit() or not 1 <= int(choice) <= len(subfolders):
+            print("输入无效。")
+            return
+        folder_name = subfolders[int(choice) - 1]
+        print(f"已选择: {folder_name}")
+
+    folder_path = os.path.join(downloads_path, folder_name)
+    if not os.path.isdir(folder_path):
+        print(f"文件夹不存在: {folder_path}")
+        return
+
+    result = find_similar(folder_path, roster if roster.students else None, args.threshold, args.workers,
+                          args.template, downloads_path)
+    print(generate_report(result, args.threshold, f"{folder_name}_similarity.txt"))
+    return result
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+课程数据库 (SQLite，WAL 模式): 学生名单、作业提交和成绩
+
+    students     学生名单 (按名单顺序)
+    submissions  每个作业文件夹中的文件: 内容哈希、邮件 UID、收到时间、大小
+    matches      文件 -> 学生 (一个文件可能提到多个学生)
+    grades       成绩 (每个文件一条，录入时立即写入)
+    grade_log    每一次录入的成绩 (多人同时批改时，被拒绝的成绩也保留在这里)
+    leases       批改租约: 正在批改某个文件的会话及租约到期时间 (见 claim_next)
+
+extract.py / mail.py / check.py / grade.py 都通过这里读写。students.json、<文件夹>_grades.json
+和 <文件夹>_output.txt 仍然会生成，但只是导出的结果；"谁没交 LAB3"、"课堂作业2 的平均分" 这类问题
+直接按索引查询，不再重新读取所有文件、扫描目录 (见 main.py query)。
+"""
+import os
+import json
+import sqlite3
+import time
+import threading
+import contextlib
+
+# 数据库文件 (可在 config.json 中用 database 修改)
+DB_FILE = "course.db"
+
+SCHEMA_VERSION = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS students (
+    id TEXT PRIMARY KEY,
+    serial INTEGER,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS students_name ON students(name);
+CREATE TABLE IF NOT EXISTS submissions (
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    sha256 TEXT,
+    uid TEXT,
+    received TEXT,
+    size INTEGER,
+    PRIMARY KEY (folder, filename)
+);
+CREATE INDEX IF NOT EXISTS submissions_sha256 ON submissions(sha256);
+CREATE TABLE IF NOT EXISTS matches (
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    student_id TEXT NOT NULL,
+    PRIMARY KEY (folder, student_id, filename)
+);
+CREATE INDEX IF NOT EXISTS matches_file ON matches(folder, filename);
+CREATE TABLE IF NOT EXISTS grades (
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    student_id TEXT,
+    score TEXT,
+    score_value REAL,
+    graded_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    grader TEXT,
+    owner TEXT,
+    PRIMARY KEY (folder, filename)
+);
+CREATE INDEX IF NOT EXISTS grades_student ON grades(student_id, folder);
+CREATE TABLE IF NOT EXISTS grade_log (
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    student_id TEXT,
+    score TEXT,
+    grader TEXT,
+    accepted INTEGER NOT NULL,
+    graded_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    owner TEXT
+);
+CREATE INDEX IF NOT EXISTS grade_log_file ON grade_log(folder, filename);
+CREATE TABLE IF NOT EXISTS leases (
+    folder TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    owner TEXT NOT NULL,
+    grader TEXT,
+    expires REAL NOT NULL,
+    PRIMARY KEY (folder, filename)
+);
+"""
+
+# 旧版本数据库缺少的列: (表, 列, 定义)
+MIGRATIONS = [
+    ('grades', 'grader', 'TEXT'),
+    ('grades', 'owner', 'TEXT'),
+    ('grade_log', 'owner', 'TEXT'),
+]
+
+def _score_value(score):
+    """分数的数值 (用于求平均)，不是数字时为 None"""
+    try:
+        return float(score)
+    except (TypeError, ValueError):
+        return None
+
+class Store:
+    """
+    一个数据库连接 (同一进程的多个线程共用，写操作按锁串行)
+
+    每个写操作是一个事务，提交后即使程序随后崩溃也不会丢失；
+    WAL 模式下读操作不会被写操作阻塞，多个进程 (如 check 的进程池) 可以同时使用同一个数据库。
+    """
+
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        with self.transaction() as db:
+            # executescript 会自动提交，这里逐条执行以保证在同一个事务中
+            for statement in SCHEMA.split(';'):
+                if statement.strip():
+                    db.execute(statement)
+            for table, column, definition in MIGRATIONS:
+                columns = {r['name'] for r in db.execute(f"PRAGMA table_info({table})")}
+                if column not in columns:
+                    db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('schema_version', ?)", (str(SCHEMA_VERSION),))
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """写事务 (BEGIN IMMEDIATE: 开始时就取得写锁，避免与其他进程的写操作交错后才失败)"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    # --- meta ---
+
+    def get_meta(self, key):
+        rows = self.query("SELECT value FROM meta WHERE key = ?", (key,))
+        return rows[0]['value'] if rows else None
+
+    def set_meta(self, key, value):
+        with self.transaction() as db:
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # --- 学生名单 ---
+
+    def replace_students(self, students, digest=None):
+        """
+        用新名单替换学生表
+
+        Args:
+            students (list): [{'serial', 'id', 'name'}]，按名单顺序
+            digest (str): 对应 students.json 的内容哈希 (用来判断 JSON 是否在数据库之外被修改过)
+        """
+        with self.transaction() as db:
+            db.execute("DELETE FROM students")
+            db.executemany("INSERT OR IGNORE INTO students (id, serial, name, position) VALUES (?, ?, ?, ?)",
+                           [(str(s['id']), s.get('serial'), s['name'], i) for i, s in enumerate(students)])
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('students_digest', ?)", (digest,))
+
+    def students(self):
+        rows = self.query("SELECT serial, id, name FROM students ORDER BY position")
+        return [{'serial': r['serial'], 'id': r['id'], 'name': r['name']} for r in rows]
+
+    # --- 作业提交 ---
+
+    def record_submission(self, folder, filename, sha256=None, uid=None, received=None, size=None):
+        """记录一个下载到作业文件夹中的文件 (已有记录时更新)"""
+        with self.transaction() as db:
+            db.execute("""
+                INSERT INTO submissions (folder, filename, sha256, uid, received, size) VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (folder, filename) DO UPDATE SET
+                    sha256 = excluded.sha256, uid = excluded.uid, received = excluded.received, size = excluded.size
+            """, (folder, filename, sha256, uid, received, size))
+
+    def sync_folder(self, folder, matches):
+        """
+        按检查结果更新一个文件夹: 删除已不存在的文件，加入新文件，替换匹配结果
+
+        Args:
+            matches (dict): {文件名: [学号, ...]}，包括文件夹中的所有文件
+        """
+        with self.transaction() as db:
+            existing = {r['filename'] for r in db.execute("SELECT filename FROM submissions WHERE folder = ?", (folder,))}
+            removed = existing - matches.keys()
+            db.executemany("DELETE FROM submissions WHERE folder = ? AND filename = ?", [(folder, f) for f in removed])
+            db.executemany("INSERT OR IGNORE INTO submissions (folder, filename) VALUES (?, ?)",
+                           [(folder, f) for f in matches.keys() - existing])
+            db.execute("DELETE FROM matches WHERE folder = ?", (folder,))
+            db.executemany("INSERT OR IGNORE INTO matches (folder, filename, student_id) VALUES (?, ?, ?)",
+                           [(folder, f, str(i)) for f, ids in matches.items() for i in ids])
+
+    def folders(self):
+        return [r['folder'] for r in self.query("SELECT DISTINCT folder FROM submissions ORDER BY folder")]
+
+    def missing(self, folder):
+        """没有提交 folder 的学生 (按名单顺序)"""
+        rows = self.query("""
+            SELECT serial, id, name FROM students s
+            WHERE NOT EXISTS (SELECT 1 FROM matches m WHERE m.folder = ? AND m.student_id = s.id)
+            ORDER BY position
+        """, (folder,))
+        return [dict(r) for r in rows]
+
+    def submitted(self, folder):
+        """已提交 folder 的学生及其文件 (每人取文件名最靠前的一个)"""
+        rows = self.query("""
+            SELECT s.serial, s.id, s.name, MIN(m.filename) AS filename FROM matches m
+            JOIN students s ON s.id = m.student_id
+            WHERE m.folder = ?
+            GROUP BY s.id
+            ORDER BY s.position
+        """, (folder,))
+        return [dict(r) for r in rows]
+
+    def student_history(self, student_id):
+        """一名学生在各作业中的提交和成绩"""
+        rows = self.query("""
+            SELECT m.folder, m.filename, sub.received, g.score FROM matches m
+            LEFT JOIN submissions sub ON sub.folder = m.folder AND sub.filename = m.filename
+            LEFT JOIN grades g ON g.folder = m.folder AND g.filename = m.filename
+            WHERE m.student_id = ?
+            ORDER BY m.folder, m.filename
+        """, (str(student_id),))
+        return [dict(r) for r in rows]
+
+    # --- 成绩 ---
+
+    def set_grade(self, folder, filename, student_id, score, grader=None, owner=None):
+        """
+        录入一条成绩 (同时记入 grade_log)
+
+        传入 owner (批改会话) 时按租约处理，并在同一个事务中释放租约: 本会话已不再持有租约
+        (例如休眠超过租约时间后被别人领取)、且文件已有其他会话录入的成绩时不覆盖已有成绩。
+        比较的是会话而不是批改人: 同一批改人可能在多个终端中同时批改。
+
+        Returns:
+            dict: 成绩被拒绝时返回已有成绩 {'score', 'grader', 'owner'}；录入成功时返回 None
+        """
+        student_id = str(student_id) if student_id is not None else None
+        with self.transaction() as db:
+            if owner is not None:
+                held = db.execute("SELECT 1 FROM leases WHERE folder = ? AND filename = ? AND owner = ?",
+                                  (folder, filename, owner)).fetchone()
+                existing = db.execute("SELECT score, grader, owner FROM grades WHERE folder = ? AND filename = ?",
+                                      (folder, filename)).fetchone()
+                db.execute("DELETE FROM leases WHERE folder = ? AND filename = ? AND owner = ?", (folder, filename, owner))
+                if not held and existing is not None and existing['owner'] != owner:
+                    db.execute("""
+                        INSERT INTO grade_log (folder, filename, student_id, score, grader, owner, accepted)
+                        VALUES (?, ?, ?, ?, ?, ?, 0)
+                    """, (folder, filename, student_id, score, grader, owner))
+                    return dict(existing)
+            db.execute("""
+                INSERT INTO grades (folder, filename, student_id, score, score_value, grader, owner) VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (folder, filename) DO UPDATE SET
+                    student_id = excluded.student_id, score = excluded.score, score_value = excluded.score_value,
+                    grader = excluded.grader, owner = excluded.owner, graded_at = CURRENT_TIMESTAMP
+            """, (folder, filename, student_id, score, _score_value(score), grader, owner))
+            db.execute("""
+                INSERT INTO grade_log (folder, filename, student_id, score, grader, owner, accepted) VALUES (?, ?, ?, ?, ?, ?, 1)
+            """, (folder, filename, student_id, score, grader, owner))
+        return None
+
+    def import_grades(self, folder, records):
+        """导入旧的 <文件夹>_grades.json 记录 (已有成绩的文件不覆盖)，返回导入的条数"""
+        rows = [(folder, r['filename'], str(r['id']) if r.get('id') is not None else None,
+                 r.get('score'), _score_value(r.get('score')))
+                for r in records if r.get('filename')]
+        with self.transaction() as db:
+            before = db.total_changes
+            db.executemany("""
+                INSERT OR IGNORE INTO grades (folder, filename, student_id, score, score_value) VALUES (?, ?, ?, ?, ?)
+            """, rows)
+            return db.total_changes - before
+
+    def graded_filenames(self, folder):
+        return {r['filename'] for r in self.query("SELECT filename FROM grades WHERE folder = ?", (folder,))}
+
+    def grades(self, folder):
+        """
+        一个作业的成绩，格式与 <文件夹>_grades.json 相同 (按录入顺序)
+
+        Returns:
+            list: 匹配到学生的记录为 {serial, id, name, score, filename}，否则为 {filename, score}
+        """
+        rows = self.query("""
+            SELECT g.filename, g.score, s.serial, s.id, s.name FROM grades g
+            LEFT JOIN students s ON s.id = g.student_id
+            WHERE g.folder = ?
+            ORDER BY g.rowid
+        """, (folder,))
+        records = []
+        for r in rows:
+            if r['id'] is not None:
+                records.append({'serial': r['serial'], 'id': r['id'], 'name': r['name'],
+                                'score': r['score'], 'filename': r['filename']})
+            else:
+                records.append({'filename': r['filename'], 'score': r['score']})
+        return records
+
+    # --- 多人批改的租约 ---
+
+    def claim_next(self, folder, filenames, owner, grader=None, ttl=300, exclude=()):
+        """
+        领取下一个要批改的文件: 按 filenames 的顺序取第一个还没有成绩、也没有被其他会话持有有效租约的文件
+
+        在一个写事务中完成查找和登记，多个 grade.py 会话 (多个进程) 同时领取也不会拿到同一个文件；
+        租约过期 (会话已退出或崩溃，不再续约) 的文件可以被重新领取。每个会话同时只持有一个租约。
+
+        Args:
+            owner (str): 批改会话的唯一标识
+            ttl (float): 租约有效期 (秒)，需要在到期前用 renew_lease 续约
+            exclude: 本会话不再领取的文件 (如已跳过的)
+
+        Returns:
+            str: 领取到的文件名；没有可领取的文件时返回 None
+        """
+        now = time.time()
+        with self.transaction() as db:
+            db.execute("DELETE FROM leases WHERE folder = ? AND (owner = ? OR expires <= ?)", (folder, owner, now))
+            taken = {r['filename'] for r in db.execute("SELECT filename FROM grades WHERE folder = ?", (folder,))}
+            taken.update(r['filename'] for r in db.execute("SELECT filename FROM leases WHERE folder = ?", (folder,)))
+            for filename in filenames:
+                if filename not in taken and filename not in exclude:
+                    db.execute("INSERT INTO leases (folder, filename, owner, grader, expires) VALUES (?, ?, ?, ?, ?)",
+                               (folder, filename, owner, grader, now + ttl))
+                    return filename
+        return None
+
+    def renew_lease(self, folder, filename, owner, ttl=300):
+        """
+        续约
+
+        Returns:
+            bool: 租约是否仍属于本会话
+        """
+        with self.transaction() as db:
+            cursor = db.execute("UPDATE leases SET expires = ? WHERE folder = ? AND filename = ? AND owner = ?",
+                                (time.time() + ttl, folder, filename, owner))
+            return cursor.rowcount > 0
+
+    def release_lease(self, folder, filename, owner):
+        with self.transaction() as db:
+            db.execute("DELETE FROM leases WHERE folder = ? AND filename = ? AND owner = ?", (folder, filename, owner))
+
+    def active_leases(self, folder):
+        """正在被批改的文件: [{'filename', 'grader', 'owner', 'expires'}]"""
+        rows = self.query("SELECT filename, grader, owner, expires FROM leases WHERE folder = ? AND expires > ? ORDER BY filename",
+                          (folder, time.time()))
+        return [dict(r) for r in rows]
+
+    def graded_folders(self):
+        return [r['folder'] for r in self.query("SELECT DISTINCT folder FROM grades ORDER BY folder")]
+
+    def average(self, folder):
+        """
+        Returns:
+            tuple: (平均分或 None, 有效成绩数)
+        """
+        row = self.query("SELECT AVG(score_value) AS average, COUNT(score_value) AS n FROM grades WHERE folder = ?",
+                         (folder,))[0]
+        return row['average'], row['n']
+
+# 每个进程、每个数据库文件一个连接 (进程池中的子进程不能使用父进程的连接)
+_stores = {}
+_stores_lock = threading.Lock()
+
+def configure(config):
+    """按配置设置数据库文件"""
+    global DB_FILE
+    DB_FILE = config['database']
+
+def get_store(path=None):
+    """获取 (必要时打开) 数据库"""
+    path = os.path.abspath(path or DB_FILE)
+    key = (os.getpid(), path)
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            store = _stores[key] = Store(path)
+        return store
+
+def export_json(data, path):
+    """导出为 JSON 文件 (先写临时文件再替换)"""
+    tmp_file = path + ".tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_file, path)
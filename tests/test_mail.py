@@ -0,0 +1,122 @@
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from email.message import EmailMessage
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+
+import mail
+from fake_imap import FakeIMAPServer, Mailbox
+
+def make_message(subject, filename, content):
+    msg = EmailMessage()
+    msg['Subject'] = subject
+    msg.set_content("见附件")
+    msg.add_attachment(content, maintype='application', subtype='pdf', filename=filename)
+    return msg.as_bytes()
+
+class MailTestCase(unittest.TestCase):
+    """在临时目录中运行，mail.py 的下载目录、状态文件和缓存目录都指向这里"""
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp(prefix="mail-test-")
+        self.downloads = os.path.join(self.tmp, "downloads")
+        os.makedirs(self.downloads)
+        patcher = mock.patch.multiple(
+            mail,
+            download_dir=self.downloads,
+            sync_state_file=os.path.join(self.downloads, ".sync_state.json"),
+            manifest_file=os.path.join(self.downloads, ".manifest.json"),
+            raw_cache_dir=os.path.join(self.tmp, "cache"),
+            mailbox="INBOX",
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.tmp, ignore_errors=True)
+
+STUDENTS = ["2021000001_张三", "2021000002_李四", "2021000003_王五"]
+
+class BatchFetchTest(MailTestCase):
+    """批量 UID FETCH 的响应中缺少某封邮件时，不能悄悄跳过"""
+
+    def setUp(self):
+        super().setUp()
+        box = Mailbox([(make_message("实验1", f"{name}.pdf", f"%PDF-1 {name}".encode()), None)
+                       for name in STUDENTS])
+        self.server = FakeIMAPServer(box)
+        host, port = self.server.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        patcher = mock.patch.multiple(
+            mail,
+            IMAP_HOST=host, IMAP_PORT=port, IMAP_SSL=False,
+            EMAIL_ACCOUNT="test", EMAIL_PASSWORD="test",
+            start_date=None, end_date=None,
+            fetch_mode="structure", max_connections=1, fetch_batch_size=200,
+            raw_cache_dir="", full_resync=False,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def saved_files(self):
+        return sorted(name for _, _, files in os.walk(self.downloads) for name in files if not name.startswith('.'))
+
+    def test_uid_missing_from_batch_is_fetched_again(self):
+        self.server.omit_in_batch = {2}
+
+        result = mail.main()
+
+        self.assertEqual(result['failures'], 0)
+        self.assertEqual(result['last_uid'], 3)
+        self.assertEqual(self.saved_files(), [f"{name}.pdf" for name in STUDENTS])
+
+    def test_uid_never_returned_blocks_sync_state(self):
+        self.server.missing_uids = {2}
+
+        result = mail.main()
+
+        self.assertEqual(result['failures'], 1)
+        self.assertEqual(mail.load_sync_state(), {})
+        self.assertEqual(self.saved_files(), [f"{STUDENTS[0]}.pdf", f"{STUDENTS[2]}.pdf"])
+
+class ReprocessTest(MailTestCase):
+
+    def test_failed_message_keeps_old_tree(self):
+        cache = mail.RawCache(mail.raw_cache_dir, mail.mailbox, 1)
+        cache.put(1, make_message("实验1", "2021000001_张三.pdf", b"%PDF-1 zhangsan"))
+        os.makedirs(cache.path, exist_ok=True)
+        with open(cache.file(2), 'wb') as f:
+            f.write(b"not a gzip file") # 无法解析的缓存
+
+        old_file = os.path.join(self.downloads, "实验1", "2021000002_李四.pdf")
+        os.makedirs(os.path.dirname(old_file))
+        with open(old_file, 'wb') as f:
+            f.write(b"%PDF-1 lisi")
+
+        result = mail.reprocess(workers=1)
+
+        self.assertFalse(result['applied'])
+        self.assertEqual(result['failed_uids'], [2])
+        self.assertTrue(os.path.exists(old_file))
+        self.assertFalse(os.path.exists(self.downloads + ".bak"))
+
+    def test_clean_cache_replaces_tree(self):
+        cache = mail.RawCache(mail.raw_cache_dir, mail.mailbox, 1)
+        cache.put(1, make_message("实验1", "2021000001_张三.pdf", b"%PDF-1 zhangsan"))
+
+        result = mail.reprocess(workers=1)
+
+        self.assertTrue(result['applied'])
+        self.assertEqual(result['failures'], 0)
+        folders = [f for f in os.listdir(self.downloads) if not f.startswith('.')]
+        self.assertEqual(len(folders), 1)
+        self.assertEqual(os.listdir(os.path.join(self.downloads, folders[0])), ["2021000001_张三.pdf"])
+
+if __name__ == '__main__':
+    unittest.main()